@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+BCIF Admission Control
+Bounds the work each worker process takes on. Requests are admitted into a
+lane (heavy PDF fills, light parsing, progress streams) with its own in-flight limit and a
+short wait queue; a request that finds the queue full, or is still waiting
+at its deadline, is rejected at once so the caller gets a fast 503 with
+Retry-After instead of the worker collapsing under memory pressure.
+"""
+
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, Optional
+
+class Saturated(Exception):
+    """Raised when a lane cannot admit a request; carries the suggested Retry-After"""
+
+    def __init__(self, lane: str, reason: str, retry_after: int):
+        super().__init__(f'{lane} lane saturated ({reason})')
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+class Lane:
+    def __init__(self, name: str, limit: int, max_waiting: int, wait_timeout: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_timeout = wait_timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_total: Dict[str, int] = {'queue_full': 0, 'timeout': 0}
+        # Smoothed service time, used to suggest a Retry-After
+        self.service_seconds = 1.0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        """Hold a slot for the block; yields the Slot so a request can give it back early"""
+        held = Slot(self)
+        held.acquire()
+        try:
+            yield held
+        finally:
+            held.release()
+
+    def _release(self, elapsed: float) -> None:
+        with self._cond:
+            self.in_flight -= 1
+            self.service_seconds += 0.2 * (elapsed - self.service_seconds)
+            self._cond.notify()
+
+    def _acquire(self) -> None:
+        with self._cond:
+            if self.in_flight < self.limit and not self.waiting:
+                self.in_flight += 1
+                self.admitted_total += 1
+                return
+            if self.waiting >= self.max_waiting:
+                self._reject('queue_full')
+            self.waiting += 1
+            try:
+                deadline = time.monotonic() + self.wait_timeout
+                while self.in_flight >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._reject('timeout')
+                    self._cond.wait(remaining)
+                self.in_flight += 1
+                self.admitted_total += 1
+            finally:
+                self.waiting -= 1
+
+    def _reject(self, reason: str) -> None:
+        # Called with the condition held
+        self.rejected_total[reason] += 1
+        backlog = (self.waiting + 1) / self.limit
+        raise Saturated(self.name, reason, max(1, math.ceil(self.service_seconds * backlog)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'in_flight': self.in_flight,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'wait_timeout': self.wait_timeout,
+                'admitted_total': self.admitted_total,
+                'rejected_total': dict(self.rejected_total),
+                'service_seconds': round(self.service_seconds, 4),
+            }
+
+class Slot:
+    """One request's place in a lane. Waiting on other work (a coalesced fill) should not hold it."""
+
+    def __init__(self, lane: Lane):
+        self.lane = lane
+        self.held = False
+        self._started = 0.0
+
+    def acquire(self) -> None:
+        self.lane._acquire()
+        self.held = True
+        self._started = time.perf_counter()
+
+    def release(self) -> None:
+        """Give the slot back now; leaving the admit block then releases nothing"""
+        if self.held:
+            self.held = False
+            self.lane._release(time.perf_counter() - self._started)
+
+    @contextmanager
+    def paused(self):
+        """Release the slot for the block and queue for it again after (may raise Saturated)"""
+        was_held = self.held
+        self.release()
+        try:
+            yield
+        finally:
+            if was_held:
+                self.acquire()
+
+def _lane_from_env(name: str, limit: int, max_waiting: int, wait_timeout: float) -> Lane:
+    prefix = f'BCIF_{name.upper()}_'
+    return Lane(
+        name,
+        int(os.environ.get(prefix + 'CONCURRENCY', limit)),
+        int(os.environ.get(prefix + 'QUEUE', max_waiting)),
+        float(os.environ.get(prefix + 'QUEUE_TIMEOUT', wait_timeout)),
+    )
+
+class AdmissionController:
+    def __init__(self, lanes: Optional[Dict[str, Lane]] = None):
+        self.lanes = lanes or {
+            # pypdf fills hold the GIL and a parsed document each; keep few in flight
+            'heavy': _lane_from_env('heavy', 2, 8, 2.0),
+            'light': _lane_from_env('light', 8, 32, 0.5),
+            # Progress streams hold a request thread for minutes; cap them and never queue
+            'stream': _lane_from_env('stream', 2, 0, 0.0),
+        }
+
+    def admit(self, lane: str):
+        """Context manager holding a slot in the lane (yields the Slot); raises Saturated when it cannot"""
+        return self.lanes[lane].slot()
+
+    def hold(self, lane: str) -> Slot:
+        """
+        A slot held past the view, for streamed responses; the caller releases
+        it (Slot.release) when the stream closes. Raises Saturated.
+        """
+        held = Slot(self.lanes[lane])
+        held.acquire()
+        return held
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        gauges = []
+        for name, s in self.stats().items():
+            gauges += [
+                ('bcif_admission_in_flight', 'Requests running in an admission lane (this process)', {'lane': name}, s['in_flight']),
+                ('bcif_admission_queue_depth', 'Requests waiting for an admission lane (this process)', {'lane': name}, s['waiting']),
+                ('bcif_admission_limit', 'In-flight limit of an admission lane', {'lane': name}, s['limit']),
+            ]
+            for reason, count in s['rejected_total'].items():
+                gauges.append(('bcif_admission_rejected_total', 'Requests rejected with 503 by admission control (this process)',
+                               {'lane': name, 'reason': reason}, count))
+        return gauges
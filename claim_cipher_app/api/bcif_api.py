@@ -6,18 +6,43 @@ Uses the proven bcif_fill.py logic to fill PDF forms server-side
 
 import os
 import json
+import time
 import tempfile
+import functools
+import contextlib
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, g, Response
 from flask_cors import CORS
 import base64
 
 # Import the proven bcif_fill logic
 import sys
+import logging
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+# Structured JSON logging goes through an async queue; configure it before the
+# pipeline modules log at import time
+from bcif_logging import logging_setup, request_id_var, new_request_id
+logging_setup.configure()
+log = logging.getLogger('bcif.api')
+
 # Import enhanced functions from bcif_fill_enhanced.py
 from bcif_fill_enhanced import apply_text_mapping, apply_post_processing, collect_checkbox_states, fill_pdf
+from bcif_optimize import DEFAULT_OPTIMIZE_LEVEL, resolve_level, check_linearized
+from bcif_config import ConfigManager
+from bcif_jobs import JobQueue
+from bcif_storage import StorageManager
+from bcif_metrics import Metrics
+from bcif_profiling import RequestProfiler
+from bcif_admission import AdmissionController, Saturated
+from bcif_singleflight import SingleFlight
+from bcif_templates import TemplateRegistry
+import bcif_memory
+from bcif_warmup import Warmup
+from bcif_estimate import TextCache, structure_estimate
+from bcif_progress import ProgressStore, NULL_TRACKER, new_progress_id
+from bcif_geocode import default_index as geocode_index, MAX_BATCH as GEOCODE_MAX_BATCH
+from bcif_distance_cache import DistanceCache
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for browser requests
@@ -26,16 +51,280 @@ CORS(app)  # Enable CORS for browser requests
 UPLOAD_FOLDER = Path(tempfile.gettempdir()) / 'bcif_uploads'
 UPLOAD_FOLDER.mkdir(exist_ok=True)
 
+# Mapping is loaded and compiled once, then hot-reloaded when the file changes
+config_manager = ConfigManager()
+try:
+    config_manager.load()
+except Exception:
+    pass  # reported per request until the file becomes loadable
+
+# Templates in forms/, each paired with its own mapping, parsed once into a bounded LRU
+templates = TemplateRegistry(config_manager)
+
+# Synthetic fill per configured template; /health/ready waits for it
+warmup = Warmup(templates, UPLOAD_FOLDER)
+
+# Uploads and results: sharded, TTL-expired and held under a byte quota
+storage = StorageManager(UPLOAD_FOLDER)
+
+# Extracted estimate text by upload hash, so re-uploads skip PDF parsing
+text_cache = TextCache(storage)
+
+# Per-stage latency histograms, shared between worker processes via snapshots
+metrics = Metrics(UPLOAD_FOLDER / 'metrics')
+
+# Opt-in per-request profiling (disabled unless BCIF_PROFILE_TOKEN is set)
+profiler = RequestProfiler(storage)
+
+# Per-process in-flight limits with short wait queues, one lane per cost class
+admission = AdmissionController()
+
+# Concurrent identical fills (retries, several reviewers on one claim) run once
+singleflight = SingleFlight(UPLOAD_FOLDER / 'singleflight')
+
+# Stage/page progress per issued progress id or job id, streamed as SSE from /progress/<id>
+progress = ProgressStore(UPLOAD_FOLDER / 'progress')
+
+# Durable queue for async extract/fill jobs; its dispatcher starts on first use
+job_queue = JobQueue(UPLOAD_FOLDER / 'jobs', metrics_dir=metrics.directory, progress=progress)
+
+# Road distances reported by the browser's Google legs, reused by offline route planning;
+# kept in its own directory, which the storage janitor leaves alone
+distance_cache = DistanceCache(Path(os.environ.get('BCIF_DISTANCE_CACHE_PATH',
+                                                   UPLOAD_FOLDER / 'distances' / 'distances.sqlite3')))
+
+def start_background_tasks():
+    """Start per-process background threads (call again in each worker after fork)"""
+    logging_setup.start()
+    config_manager.start_watching()
+    templates.start_watching()
+    storage.start_janitor()
+    metrics.start_flusher()
+    warmup.start()
+
+def stop_background_tasks():
+    """Stop background threads before forking workers"""
+    warmup.stop()
+    config_manager.stop_watching()
+    templates.stop_watching()
+    storage.stop_janitor()
+    metrics.stop_flusher()
+    logging_setup.stop()
+
+# The prod server imports this module in its master before forking and starts
+# the threads in each worker (post_fork); everyone else gets them on import
+if os.environ.get('BCIF_DEFER_BACKGROUND_TASKS', '').strip().lower() not in ('1', 'true', 'yes', 'on'):
+    start_background_tasks()
+
+def active_mapping(template_name=None):
+    """Snapshot of the active compiled mapping (the template's paired one if any), loading it if startup failed"""
+    if template_name is not None:
+        return templates.mapping_for(template_name)
+    if config_manager.current is None:
+        config_manager.load()
+    return config_manager.current
+
+def resolve_fields(extracted_text, mapping):
+    """Run text mapping, post-processing and checkbox rules against one mapping snapshot"""
+    rm = g.request_metrics
+    g.progress.stage('mapping')
+    with rm.stage('mapping'):
+        text_fields = apply_text_mapping(extracted_text, mapping.text_fields)
+        apply_post_processing(text_fields, mapping.post_processing)
+    with rm.stage('checkboxes'):
+        checkbox_fields = collect_checkbox_states(extracted_text, mapping.checkbox_rules)
+    return text_fields, checkbox_fields
+
+def extract_estimate_text(content):
+    """Text of an uploaded estimate, from the extracted-text cache if these bytes were seen before"""
+    from bcif_fill_enhanced import extract_text
+    started = time.perf_counter()
+    g.progress.stage('extracting')
+    text, cache_hit = text_cache.extract(content, lambda pdf: extract_text(pdf, on_page=g.progress.pages))
+    g.request_metrics.record('text_cache' if cache_hit else 'extract', time.perf_counter() - started)
+    return text
+
+def instrumented(endpoint, lane=None, track=False):
+    """
+    Time a view under the given endpoint label. The view labels its stages via
+    g.request_metrics; 'respond' covers sending the body and ends when the
+    response is closed, which is also when the request is counted. Requests
+    flagged for profiling by an authorised caller run under the profiler.
+    With a lane, the view only runs once admission control grants a slot;
+    otherwise the caller gets 503 with Retry-After. With track, the view's
+    stages are also published as progress, under the id the client reserved
+    and sent as X-Progress-Id or else a fresh one; either way the response
+    carries it in X-Progress-Id.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            rm = g.request_metrics = metrics.request(endpoint)
+            progress_id = None
+            if track:
+                # Never the caller's own id: a chosen id could overwrite or read someone else's progress
+                progress_id = request.headers.get('X-Progress-Id', '')
+                if not progress.claim(progress_id):
+                    progress_id = new_progress_id()
+            g.progress = progress.tracker(progress_id) if track else NULL_TRACKER
+            profile_mode = profiler.requested_mode(request.headers, request.args)
+            try:
+                with admission.admit(lane) if lane else contextlib.nullcontext() as slot:
+                    g.admission_slot = slot
+                    if profile_mode:
+                        result, profile_id = profiler.run(profile_mode, view, *args, **kwargs)
+                    else:
+                        result = view(*args, **kwargs)
+            except Saturated as e:
+                profile_mode = None
+                result = jsonify({'error': f'Server busy: {e}', 'retry_after': e.retry_after}), 503, {
+                    'Retry-After': str(e.retry_after)}
+                log.warning('request rejected', extra={'data': {'endpoint': endpoint, 'lane': e.lane, 'reason': e.reason}})
+            response = app.make_response(result)
+            returned = time.perf_counter()
+            if progress_id:
+                response.headers['X-Progress-Id'] = progress_id
+            if response.status_code < 400:
+                g.progress.done(status=response.status_code)
+            else:
+                g.progress.failed(f'HTTP {response.status_code}')
+            if profile_mode:
+                if profile_id:
+                    response.headers['X-Profile-Id'] = profile_id
+                    response.headers['X-Profile-Url'] = f'/profiles/{profile_id}'
+                    log.info('request profiled', extra={'data': {'profile_id': profile_id, 'mode': profile_mode}})
+                else:
+                    response.headers['X-Profile-Status'] = 'busy'
+            
+            def on_close():
+                rm.record('respond', time.perf_counter() - returned)
+                rm.finish(response.status_code)
+                log.info('request complete', extra={'data': {
+                    'endpoint': endpoint,
+                    'status': response.status_code,
+                    'template': rm.template,
+                    'mapping_version': rm.mapping_version,
+                    'timings_ms': {k: round(v * 1000, 3) for k, v in rm.timings.items()},
+                }})
+            response.call_on_close(on_close)
+            return response
+        return wrapper
+    return decorator
+
+@app.before_request
+def assign_request_id():
+    """Take the caller's X-Request-Id or mint one; every log record of the request carries it"""
+    g.request_id = request.headers.get('X-Request-Id', '')[:64] or new_request_id()
+    request_id_var.set(g.request_id)
+
+@app.after_request
+def echo_request_id(response):
+    response.headers['X-Request-Id'] = g.get('request_id', '')
+    return response
+
+# Launch timestamp from start_api.py; the first request served reports cold-start time
+_launched_at = float(os.environ.get('BCIF_LAUNCHED_AT', 0)) or None
+
+@app.after_request
+def report_cold_start(response):
+    global _launched_at
+    if _launched_at is not None:
+        launched, _launched_at = _launched_at, None
+        log.info('first request served', extra={'data': {
+            'path': request.path,
+            'cold_start_ms': round((time.time() - launched) * 1000, 1),
+        }})
+    return response
+
+def label_request(template_name, mapping):
+    """Attach template and mapping version labels to the current request's metrics"""
+    rm = g.request_metrics
+    rm.template = template_name
+    rm.mapping_version = mapping.sha256[:12]
+
+def fill_once(content, template_name, mapping, optimize, linearize, compute):
+    """
+    Run compute() -> (result_id, output_path, text_fields, optimized) once for
+    concurrent identical requests. Returns (result_id, output_path, text_fields,
+    optimized, coalesced).
+    """
+    key = singleflight.key(content, template_name, mapping.sha256, optimize, linearize)
+    
+    def run():
+        result_id, output_path, text_fields, optimized = compute()
+        return {'result_id': result_id, 'output_path': str(output_path), 'text_fields': text_fields,
+                'optimized': optimized}
+    
+    started = time.perf_counter()
+    result, coalesced = singleflight.do(key, run, reusable=lambda r: Path(r['output_path']).exists(),
+                                        slot=g.get('admission_slot'))
+    if coalesced:
+        g.request_metrics.record('coalesced', time.perf_counter() - started)
+    return result['result_id'], Path(result['output_path']), result['text_fields'], result.get('optimized'), coalesced
+
+def parse_flag(value) -> bool:
+    """Interpret a JSON or form field as a boolean flag"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def new_result_path():
+    """Allocate a stored result: returns (result_id, output_path)"""
+    return storage.new_path('filled_bcif')
+
+def send_filled_pdf(result_id, output_path, text_fields, linearize=False, coalesced=None, optimized=None):
+    """
+    Send a filled PDF and point the client at its range-servable stored copy.
+    X-Optimize-Level is the level the output actually got, which is lower than
+    the requested one when an optimization backend is missing.
+    """
+    if coalesced is None:
+        storage.register(output_path)  # a shared result was registered by the request that made it
+    response = send_file(
+        output_path,
+        as_attachment=True,
+        download_name=f'CCC_BCIF_{text_fields.get("Claim Number", "FILLED")}.pdf',
+        mimetype='application/pdf'
+    )
+    response.headers['X-Result-Id'] = result_id
+    response.headers['Content-Location'] = f'/results/{result_id}'
+    if coalesced:
+        response.headers['X-Coalesced'] = coalesced
+    if linearize:
+        response.headers['X-Linearized'] = 'true' if check_linearized(output_path)['linearized'] else 'false'
+    if optimized:
+        response.headers['X-Optimize-Level'] = optimized['applied']
+    return response
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Simple health check endpoint"""
     return jsonify({
         'status': 'healthy',
         'message': 'BCIF API is running',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'ready': is_ready()
     })
 
+def is_ready():
+    return warmup.ready and config_manager.current is not None
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness: the process is up and serving requests (restart it if this fails)"""
+    return jsonify({'status': 'alive', 'pid': os.getpid()})
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness: 200 once warm-up has filled every configured template, 503 until then"""
+    body = {'status': 'ready' if is_ready() else 'not ready', 'pid': os.getpid(), 'warmup': warmup.describe(),
+            'mapping_loaded': config_manager.current is not None}
+    if not is_ready():
+        return jsonify(body), 503, {'Retry-After': '1'}
+    return jsonify(body)
+
 @app.route('/fill-bcif', methods=['POST'])
+@instrumented('/fill-bcif', lane='heavy', track=True)
 def fill_bcif_form():
     """
     Fill BCIF form using extracted text data
@@ -43,8 +332,12 @@ def fill_bcif_form():
     Expected JSON payload:
     {
         "extracted_text": "full text from CCC PDF",
-        "template_name": "Fillable_CCC_BCIF.pdf" (optional)
+        "template_name": "Fillable_CCC_BCIF.pdf" (optional),
+        "optimize": "none" | "fast" | "standard" | "max" (optional, default "fast"),
+        "linearize": true | false (optional, default false)
     }
+    
+    The filled PDF stays available at /results/<X-Result-Id> with range support.
     """
     try:
         data = request.get_json()
@@ -57,64 +350,83 @@ def fill_bcif_form():
         extracted_text = data['extracted_text']
         template_name = data.get('template_name', 'Fillable_CCC_BCIF.pdf')
         
-        # Load the mapping configuration
-        mapping_path = Path(__file__).parent.parent / 'config' / 'bcif-mapping.json'
+        try:
+            optimize = resolve_level(data.get('optimize', DEFAULT_OPTIMIZE_LEVEL))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        linearize = parse_flag(data.get('linearize'))
         
-        if not mapping_path.exists():
+        # Take the active mapping snapshot
+        try:
+            mapping = active_mapping(template_name)
+        except Exception:
+            manager = templates.manager_for(template_name)
             return jsonify({
-                'error': f'Mapping configuration not found: {mapping_path}'
+                'error': f'Mapping configuration not loadable: {manager.mapping_path} ({manager.last_error})'
             }), 500
         
-        with open(mapping_path, 'r') as f:
-            mapping_spec = json.load(f)
+        # Resolve the PDF template
+        template_path = templates.resolve_template(template_name)
         
-        # Load the PDF template
-        template_path = Path(__file__).parent.parent / 'forms' / template_name
-        
-        if not template_path.exists():
+        if template_path is None:
             return jsonify({
-                'error': f'PDF template not found: {template_path}'
+                'error': f'PDF template not found: {template_name}'
             }), 500
+        label_request(template_name, mapping)
         
         # Apply the proven bcif_fill.py logic
-        print(f"Processing text extraction with {len(extracted_text)} characters")
-        print(f"First 500 chars: {extracted_text[:500]}")
-        
-        # Extract text fields using patterns
-        text_fields = apply_text_mapping(extracted_text, mapping_spec.get("text_fields", {}))
-        print(f"Extracted {len(text_fields)} text fields: {list(text_fields.keys())}")
-        print(f"Field values: {text_fields}")
-        
-        # Apply post-processing
-        apply_post_processing(text_fields, mapping_spec.get("post_processing", {}))
-        
-        # Extract checkbox states
-        checkbox_fields = collect_checkbox_states(extracted_text, mapping_spec.get("checkbox_rules", {}))
-        print(f"Found {len(checkbox_fields)} checkbox options: {checkbox_fields}")
+        # Estimate text and field values are PII: only sampled, only at DEBUG
+        sampled = log.isEnabledFor(logging.DEBUG) and logging_setup.sample_payload()
+        if sampled:
+            log.debug('estimate text', extra={'data': {'chars': len(extracted_text), 'preview': extracted_text[:500]}})
         
-        # Create temporary output file
-        output_path = UPLOAD_FOLDER / f'filled_bcif_{os.urandom(8).hex()}.pdf'
+        def compute():
+            # Extract text fields using patterns, then apply post-processing
+            g.progress.stage('mapping')
+            with g.request_metrics.stage('mapping'):
+                text_fields = apply_text_mapping(extracted_text, mapping.text_fields)
+                apply_post_processing(text_fields, mapping.post_processing)
+            
+            # Extract checkbox states
+            with g.request_metrics.stage('checkboxes'):
+                checkbox_fields = collect_checkbox_states(extracted_text, mapping.checkbox_rules)
+            log.info('fields resolved', extra={'data': {
+                'text_chars': len(extracted_text),
+                'text_fields': sorted(text_fields),
+                'checkbox_count': len(checkbox_fields),
+            }})
+            if sampled:
+                log.debug('field values', extra={'data': {'text_fields': text_fields, 'checkboxes': checkbox_fields}})
+            
+            # Create temporary output file
+            result_id, output_path = new_result_path()
+            
+            # Fill the PDF using the proven logic
+            g.progress.stage('filling')
+            with g.request_metrics.stage('fill'):
+                optimized = fill_pdf(templates.prepared(template_name), text_fields, checkbox_fields, output_path,
+                                     optimize=optimize, linearize=linearize)
+            
+            log.debug('BCIF form filled', extra={'data': {'result_id': result_id}})
+            return result_id, output_path, text_fields, optimized
         
-        # Fill the PDF using the proven logic
-        fill_pdf(template_path, text_fields, checkbox_fields, output_path)
-        
-        print(f"BCIF form filled successfully: {output_path}")
+        # Identical concurrent requests share one fill
+        result_id, output_path, text_fields, optimized, coalesced = fill_once(
+            extracted_text.encode('utf-8'), template_name, mapping, optimize, linearize, compute)
         
         # Return the filled PDF
-        return send_file(
-            output_path,
-            as_attachment=True,
-            download_name=f'CCC_BCIF_{text_fields.get("Claim Number", "FILLED")}.pdf',
-            mimetype='application/pdf'
-        )
+        return send_filled_pdf(result_id, output_path, text_fields, linearize, coalesced, optimized)
         
+    except Saturated:
+        raise  # a coalesced request could not get its slot back: 503 from instrumented
     except Exception as e:
-        print(f"Error filling BCIF form: {str(e)}")
+        log.exception('Error filling BCIF form')
         return jsonify({
             'error': f'Form filling failed: {str(e)}'
         }), 500
 
 @app.route('/extract-and-fill', methods=['POST'])
+@instrumented('/extract-and-fill', lane='heavy', track=True)
 def extract_and_fill():
     """
     Complete workflow: extract from uploaded PDF and fill BCIF form
@@ -122,6 +434,8 @@ def extract_and_fill():
     Expected form data:
     - pdf_file: The CCC estimate PDF file
     - template_name: BCIF template name (optional)
+    - optimize: output optimization level (optional, default "fast")
+    - linearize: "true" to linearize the output for fast web view (optional)
     """
     try:
         if 'pdf_file' not in request.files:
@@ -133,51 +447,379 @@ def extract_and_fill():
         if pdf_file.filename == '':
             return jsonify({'error': 'No file selected'}), 400
         
-        # Save uploaded file temporarily
-        upload_path = UPLOAD_FOLDER / f'upload_{os.urandom(8).hex()}.pdf'
-        pdf_file.save(upload_path)
+        try:
+            optimize = resolve_level(request.form.get('optimize', DEFAULT_OPTIMIZE_LEVEL))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        linearize = parse_flag(request.form.get('linearize'))
         
-        # Extract text from uploaded PDF
-        from bcif_fill_enhanced import extract_text
-        extracted_text = extract_text(upload_path)
+        # Pin the mapping and template before doing any work
+        try:
+            mapping = active_mapping(template_name)
+        except Exception:
+            manager = templates.manager_for(template_name)
+            return jsonify({
+                'error': f'Mapping configuration not loadable: {manager.mapping_path} ({manager.last_error})'
+            }), 500
         
-        print(f"Extracted {len(extracted_text)} characters from uploaded PDF")
+        template_path = templates.resolve_template(template_name)
+        if template_path is None:
+            return jsonify({'error': f'PDF template not found: {template_name}'}), 500
+        label_request(template_name, mapping)
         
-        # Clean up uploaded file
-        upload_path.unlink()
+        # Save uploaded file temporarily
+        with g.request_metrics.stage('upload'):
+            _, upload_path = storage.new_path('upload')
+            pdf_file.save(upload_path)
+        storage.register(upload_path)
+        g.progress.stage('uploaded', bytes=upload_path.stat().st_size)
         
-        # Process with the fill logic (reuse the logic from fill_bcif_form)
-        mapping_path = Path(__file__).parent.parent / 'config' / 'bcif-mapping.json'
-        with open(mapping_path, 'r') as f:
-            mapping_spec = json.load(f)
+        content = upload_path.read_bytes()
         
-        # Apply extraction and filling
-        text_fields = apply_text_mapping(extracted_text, mapping_spec.get("text_fields", {}))
-        apply_post_processing(text_fields, mapping_spec.get("post_processing", {}))
-        checkbox_fields = collect_checkbox_states(extracted_text, mapping_spec.get("checkbox_rules", {}))
+        def compute():
+            # Extract text from uploaded PDF (or reuse it from an earlier upload of the same file)
+            extracted_text = extract_estimate_text(content)
+            
+            log.info('text extracted', extra={'data': {'text_chars': len(extracted_text)}})
+            
+            # Apply extraction and filling
+            text_fields, checkbox_fields = resolve_fields(extracted_text, mapping)
+            
+            # Fill the form
+            result_id, output_path = new_result_path()
+            
+            g.progress.stage('filling')
+            with g.request_metrics.stage('fill'):
+                optimized = fill_pdf(templates.prepared(template_name), text_fields, checkbox_fields, output_path,
+                                     optimize=optimize, linearize=linearize)
+            
+            log.debug('Complete workflow succeeded', extra={'data': {'result_id': result_id}})
+            return result_id, output_path, text_fields, optimized
         
-        # Fill the form
-        template_path = Path(__file__).parent.parent / 'forms' / template_name
-        output_path = UPLOAD_FOLDER / f'filled_bcif_{os.urandom(8).hex()}.pdf'
+        # Identical uploads in flight at the same time share one extraction and fill
+        try:
+            result_id, output_path, text_fields, optimized, coalesced = fill_once(
+                content, template_name, mapping, optimize, linearize, compute)
+        finally:
+            # Clean up uploaded file
+            storage.remove(upload_path)
         
-        fill_pdf(template_path, text_fields, checkbox_fields, output_path)
+        return send_filled_pdf(result_id, output_path, text_fields, linearize, coalesced, optimized)
         
-        print(f"Complete workflow succeeded: {output_path}")
+    except Saturated:
+        raise  # a coalesced request could not get its slot back: 503 from instrumented
+    except Exception as e:
+        log.exception('Extract and fill failed')
+        return jsonify({
+            'error': f'Extract and fill failed: {str(e)}'
+        }), 500
+
+@app.route('/parse-estimate', methods=['POST'])
+@instrumented('/parse-estimate', lane='heavy', track=True)
+def parse_estimate():
+    """
+    Parse a CCC estimate into structured JSON: claim identifiers, parties,
+    vehicle, options and estimate totals
+    
+    Accepts form data with pdf_file, or JSON with extracted_text, plus an
+    optional template_name whose paired mapping is used. The document
+    carries schema and schema_version; the version changes with its shape.
+    """
+    try:
+        if 'pdf_file' in request.files:
+            params = request.form
+            content = request.files['pdf_file'].read()
+            if not content:
+                return jsonify({'error': 'No file selected'}), 400
+            g.progress.stage('uploaded', bytes=len(content))
+        else:
+            params = request.get_json(silent=True) or {}
+            if 'extracted_text' not in params:
+                return jsonify({'error': 'Upload pdf_file or send extracted_text'}), 400
+            content = None
+        template_name = params.get('template_name', 'Fillable_CCC_BCIF.pdf')
+        
+        try:
+            mapping = active_mapping(template_name)
+        except Exception:
+            manager = templates.manager_for(template_name)
+            return jsonify({
+                'error': f'Mapping configuration not loadable: {manager.mapping_path} ({manager.last_error})'
+            }), 500
+        label_request(template_name, mapping)
+        
+        extracted_text = params['extracted_text'] if content is None else extract_estimate_text(content)
+        text_fields, checkbox_fields = resolve_fields(extracted_text, mapping)
+        g.progress.stage('parsing')
+        with g.request_metrics.stage('parse'):
+            doc = structure_estimate(extracted_text, text_fields, checkbox_fields, mapping)
         
-        return send_file(
-            output_path,
-            as_attachment=True,
-            download_name=f'CCC_BCIF_{text_fields.get("Claim Number", "FILLED")}.pdf',
-            mimetype='application/pdf'
-        )
+        # Compact encoding: no whitespace, empty values already dropped
+        return Response(json.dumps(doc, separators=(',', ':')), mimetype='application/json')
         
     except Exception as e:
-        print(f"Extract and fill failed: {str(e)}")
+        log.exception('Estimate parsing failed')
         return jsonify({
-            'error': f'Extract and fill failed: {str(e)}'
+            'error': f'Estimate parsing failed: {str(e)}'
         }), 500
 
+@app.route('/routes/optimize', methods=['POST'])
+@instrumented('/routes/optimize', lane='light')
+def optimize_route_endpoint():
+    """
+    Order a day's stops without Google Maps
+
+    JSON with start and stops [{lat, lng, priority, ...}], plus optional
+    return_to_start, priority_mode (strict, urgent or none), circuity and
+    speed_mph. Points without lat/lng are geocoded offline from their
+    address. Returns the stops in visiting order with estimated legs and
+    totals.
+    """
+    from bcif_routing import optimize_route, CIRCUITY, SPEED_MPH
+    params = request.get_json(silent=True) or {}
+    try:
+        with g.request_metrics.stage('geocode'):
+            index = geocode_index()
+            start = index.locate(params.get('start'), 'start')
+            stops = [index.locate(stop, f'stop {i}') for i, stop in enumerate(params.get('stops') or [])]
+        with g.request_metrics.stage('solve'):
+            route = optimize_route(
+                start,
+                stops,
+                return_to_start=parse_flag(params.get('return_to_start')),
+                priority_mode=params.get('priority_mode', 'strict'),
+                circuity=float(params.get('circuity', CIRCUITY)),
+                speed_mph=float(params.get('speed_mph', SPEED_MPH)),
+                distance_cache=distance_cache,
+            )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(route)
+
+@app.route('/routes/schedule', methods=['POST'])
+@instrumented('/routes/schedule', lane='light')
+def schedule_route_endpoint():
+    """
+    Fit a day of inspections into their time windows
+
+    JSON with start and stops [{lat, lng or address, earliest, latest,
+    service_minutes, priority, ...}] (times as HH:MM), plus optional
+    day_start, day_end, return_to_start, circuity and speed_mph. Returns
+    timed appointments, and the stops that do not fit with the reason.
+    """
+    from bcif_routing import CIRCUITY, SPEED_MPH
+    from bcif_schedule import schedule_day, DAY_START, DAY_END
+    params = request.get_json(silent=True) or {}
+    try:
+        with g.request_metrics.stage('geocode'):
+            index = geocode_index()
+            start = index.locate(params.get('start'), 'start')
+            stops = [index.locate(stop, f'stop {i}') for i, stop in enumerate(params.get('stops') or [])]
+        with g.request_metrics.stage('solve'):
+            plan = schedule_day(
+                start,
+                stops,
+                day_start=params.get('day_start', DAY_START),
+                day_end=params.get('day_end', DAY_END),
+                return_to_start=parse_flag(params.get('return_to_start')),
+                travel={
+                    'circuity': float(params.get('circuity', CIRCUITY)),
+                    'speed_mph': float(params.get('speed_mph', SPEED_MPH)),
+                    'distance_cache': distance_cache,
+                },
+            )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(plan)
+
+@app.route('/routes/partition', methods=['POST'])
+@instrumented('/routes/partition', lane='heavy')
+def partition_routes_endpoint():
+    """
+    Split a week of stops between adjusters and days, then route every day
+
+    JSON with adjusters [{lat, lng or address, days, day_capacity, ...}]
+    (their home bases) and stops as for /routes/optimize, plus optional
+    days, day_capacity, priority_mode, return_to_start (default true),
+    circuity and speed_mph. Returns each adjuster's day routes and the stops
+    beyond everyone's capacity.
+    """
+    from bcif_routing import CIRCUITY, SPEED_MPH
+    from bcif_partition import partition_routes, DAYS, DAY_CAPACITY
+    params = request.get_json(silent=True) or {}
+    try:
+        with g.request_metrics.stage('geocode'):
+            index = geocode_index()
+            adjusters = [index.locate(adjuster, f'adjuster {a}') for a, adjuster in enumerate(params.get('adjusters') or [])]
+            stops = [index.locate(stop, f'stop {i}') for i, stop in enumerate(params.get('stops') or [])]
+        with g.request_metrics.stage('solve'):
+            plan = partition_routes(
+                adjusters,
+                stops,
+                days=params.get('days', DAYS),
+                day_capacity=params.get('day_capacity', DAY_CAPACITY),
+                priority_mode=params.get('priority_mode', 'strict'),
+                return_to_start=parse_flag(params.get('return_to_start', True)),
+                circuity=float(params.get('circuity', CIRCUITY)),
+                speed_mph=float(params.get('speed_mph', SPEED_MPH)),
+                distance_cache=distance_cache,
+            )
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(plan)
+
+@app.route('/distances', methods=['POST'])
+@instrumented('/distances', lane='light')
+def record_distances():
+    """
+    Remember road distances measured elsewhere (e.g. Google Directions legs)
+
+    JSON with legs [{origin: {lat, lng}, destination: {lat, lng}, miles,
+    minutes}] and an optional source label. Later route plans through the
+    same places (to about 100 m) use these instead of estimates.
+    """
+    from bcif_routing import coordinates
+    params = request.get_json(silent=True) or {}
+    legs = params.get('legs')
+    if not isinstance(legs, list) or not legs:
+        return jsonify({'error': 'Send legs as a non-empty list'}), 400
+    try:
+        rows = []
+        for i, leg in enumerate(legs):
+            try:
+                miles, minutes = float(leg['miles']), float(leg['minutes'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f'leg {i} needs numeric miles and minutes') from None
+            if miles < 0 or minutes < 0:
+                raise ValueError(f'leg {i} has a negative distance or duration')
+            rows.append((coordinates(leg.get('origin'), f'leg {i} origin'),
+                         coordinates(leg.get('destination'), f'leg {i} destination'), miles, minutes))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    source = str(params.get('source') or 'client')[:32]
+    with g.request_metrics.stage('store'):
+        stored = distance_cache.put_many(rows, source)
+    return jsonify({'stored': stored})
+
+@app.route('/distances/stats', methods=['GET'])
+def distance_stats():
+    """Cached location pairs by source, file size and this worker's hit/miss counts"""
+    return jsonify(distance_cache.stats())
+
+@app.route('/geocode', methods=['POST'])
+@instrumented('/geocode', lane='light')
+def geocode_batch():
+    """
+    Coordinates for free-form addresses from the bundled ZIP/city centroids
+
+    JSON with addresses: ["123 Main St, Raleigh, NC 27601", ...]. Each
+    result has lat, lng and precision (zip, city, zip3 or state), or is
+    null when nothing in the address could be placed.
+    """
+    params = request.get_json(silent=True) or {}
+    addresses = params.get('addresses')
+    if not isinstance(addresses, list):
+        return jsonify({'error': 'Send addresses as a list of strings'}), 400
+    if len(addresses) > GEOCODE_MAX_BATCH:
+        return jsonify({'error': f'At most {GEOCODE_MAX_BATCH} addresses per request'}), 400
+    index = geocode_index()
+    with g.request_metrics.stage('geocode'):
+        results = [index.geocode(address) for address in addresses]
+    return jsonify({
+        'results': results,
+        'count': len(results),
+        'resolved': sum(r is not None for r in results),
+    })
+
+@app.route('/geocode/cities', methods=['GET'])
+def geocode_cities():
+    """City name autocomplete: ?prefix=ral&state=NC&limit=10, largest cities first"""
+    state = (request.args.get('state') or '').upper() or None
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    return jsonify({'cities': geocode_index().cities(request.args.get('prefix', ''), state, limit)})
+
+@app.route('/mileage/bill', methods=['POST'])
+@instrumented('/mileage/bill', lane='heavy')
+def bill_mileage():
+    """
+    Bill a batch of trips with the Mileage Cypher rules (free miles, rate per
+    mile, round trips doubled)
+
+    Form data with a trips CSV file (firm, distance, optional round_trip
+    columns), or JSON with trips {firm: [...], distance: [...], round_trip:
+    [...]} or csv text. Optional firms is the page's firm list ({id,
+    freeMiles, ratePerMile, roundTripDefault}), as JSON text in form data;
+    per_trip=false leaves out the per-trip columns.
+    """
+    from bcif_billing import RateTable, DEFAULT_FIRMS, bill_trips, read_csv
+    try:
+        with g.request_metrics.stage('parse'):
+            if 'trips' in request.files:
+                params = request.form
+                firms = json.loads(params['firms']) if params.get('firms') else DEFAULT_FIRMS
+                trips = read_csv(request.files['trips'].read().decode('utf-8-sig'))
+            else:
+                params = request.get_json(silent=True) or {}
+                firms = params.get('firms') or DEFAULT_FIRMS
+                if isinstance(params.get('csv'), str):
+                    trips = read_csv(params['csv'])
+                elif isinstance(params.get('trips'), dict):
+                    trips = params['trips']
+                else:
+                    return jsonify({'error': 'Upload a trips CSV, or send trips columns or csv text'}), 400
+            rates = RateTable(firms)
+        with g.request_metrics.stage('bill'):
+            bill = bill_trips(rates, trips.get('firm') or [], trips.get('distance') or [], trips.get('round_trip'),
+                              per_trip=parse_flag(params.get('per_trip', True)))
+    except UnicodeDecodeError:
+        return jsonify({'error': 'trips CSV must be UTF-8 text'}), 400
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(bill)
+
+@app.route('/results/<result_id>', methods=['GET'])
+def get_result(result_id):
+    """
+    Serve a previously filled PDF inline with HTTP range support, so viewers
+    can fetch a linearized file's first page before the rest arrives
+    """
+    if not storage.valid_id(result_id):
+        return jsonify({'error': 'Invalid result id'}), 400
+    
+    output_path = storage.path_for('filled_bcif', result_id)
+    if not output_path.exists():
+        return jsonify({'error': 'Result not found or expired'}), 404
+    storage.touch(output_path)
+    
+    # conditional=True makes Werkzeug honour Range / If-Range and answer 206
+    return send_file(output_path, mimetype='application/pdf', conditional=True)
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def get_profile(profile_id):
+    """
+    Fetch a stored request profile (top functions by cumulative time) as JSON,
+    or the raw cProfile dump with ?format=pstats for snakeviz/pstats.
+    Requires the same X-BCIF-Profile-Token as the profiled request.
+    """
+    if not profiler.authorized(request.headers):
+        return jsonify({'error': 'Profiling token required'}), 403
+    if not storage.valid_id(profile_id):
+        return jsonify({'error': 'Invalid profile id'}), 400
+    
+    if request.args.get('format') == 'pstats':
+        path = profiler.pstats_path(profile_id)
+        if path is None:
+            return jsonify({'error': 'No pstats dump for this profile'}), 404
+        return send_file(path, as_attachment=True, download_name=f'bcif_{profile_id}.pstats',
+                         mimetype='application/octet-stream')
+    
+    summary = profiler.load(profile_id)
+    if summary is None:
+        return jsonify({'error': 'Profile not found or expired'}), 404
+    return jsonify(summary)
+
 @app.route('/debug-extraction', methods=['POST'])
+@instrumented('/debug-extraction', lane='light')
 def debug_extraction():
     """
     Debug endpoint to see what gets extracted without filling the form
@@ -185,44 +827,240 @@ def debug_extraction():
     try:
         data = request.get_json()
         extracted_text = data.get('extracted_text', '')
+        template_name = data.get('template_name')
+        if template_name is not None and templates.resolve_template(template_name) is None:
+            return jsonify({'error': f'PDF template not found: {template_name}'}), 400
         
-        # Load mapping
-        mapping_path = Path(__file__).parent.parent / 'config' / 'bcif-mapping.json'
-        with open(mapping_path, 'r') as f:
-            mapping_spec = json.load(f)
-        
-        # Extract fields
-        text_fields = apply_text_mapping(extracted_text, mapping_spec.get("text_fields", {}))
-        apply_post_processing(text_fields, mapping_spec.get("post_processing", {}))
-        checkbox_fields = collect_checkbox_states(extracted_text, mapping_spec.get("checkbox_rules", {}))
+        # Extract fields with the active mapping (or the one paired with template_name)
+        mapping = active_mapping(template_name)
+        label_request(template_name or '', mapping)
+        text_fields, checkbox_fields = resolve_fields(extracted_text, mapping)
         
         return jsonify({
             'text_fields': text_fields,
             'checkbox_fields': checkbox_fields,
             'field_count': len(text_fields),
-            'checkbox_count': len(checkbox_fields)
+            'checkbox_count': len(checkbox_fields),
+            'mapping_version': mapping.sha256[:12]
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Cleanup old files on startup
-def cleanup_old_files():
-    """Remove old temporary files"""
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """
+    Enqueue an extract/fill job and return its id immediately
+    
+    Accepts either form data with pdf_file (extract and fill) or JSON with
+    extracted_text (fill only), plus optional template_name, optimize and
+    linearize as on the synchronous endpoints.
+    """
     try:
-        for file_path in UPLOAD_FOLDER.glob('*.pdf'):
-            if file_path.stat().st_mtime < (time.time() - 3600):  # 1 hour old
-                file_path.unlink()
-    except Exception:
-        pass
+        if 'pdf_file' in request.files:
+            params = request.form
+            kind = 'extract_and_fill'
+        else:
+            params = request.get_json(silent=True) or {}
+            kind = 'fill'
+            if 'extracted_text' not in params:
+                return jsonify({'error': 'Upload pdf_file or send extracted_text'}), 400
+        
+        template_name = params.get('template_name', 'Fillable_CCC_BCIF.pdf')
+        if templates.resolve_template(template_name) is None:
+            return jsonify({'error': f'PDF template not found: {template_name}'}), 400
+        try:
+            optimize = resolve_level(params.get('optimize', DEFAULT_OPTIMIZE_LEVEL))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        linearize = parse_flag(params.get('linearize'))
+        
+        input_path = job_queue.folder / f'input_{os.urandom(8).hex()}'
+        if kind == 'extract_and_fill':
+            input_path = input_path.with_suffix('.pdf')
+            request.files['pdf_file'].save(input_path)
+        else:
+            input_path = input_path.with_suffix('.txt')
+            input_path.write_text(params['extracted_text'], encoding='utf-8')
+        
+        try:
+            job_id = job_queue.enqueue(kind, input_path, template_name, optimize, linearize)
+        except OverflowError as e:
+            input_path.unlink(missing_ok=True)
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        return jsonify({
+            'job_id': job_id,
+            'status': 'queued',
+            'status_url': f'/jobs/{job_id}',
+            'progress_url': f'/progress/{job_id}',
+            'result_url': f'/jobs/{job_id}/result'
+        }), 202
+        
+    except Exception as e:
+        log.exception('Job enqueue failed')
+        return jsonify({'error': f'Job enqueue failed: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Report a job's status, attempts and (when done) a summary of the fill"""
+    job_queue.start()  # resumes queued jobs after a restart
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify({
+        'job_id': job['id'],
+        'kind': job['kind'],
+        'status': job['status'],
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'error': job['error'],
+        'result': job['result'],
+        'created_at': job['created_at'],
+        'finished_at': job['finished_at'],
+        'result_url': f'/jobs/{job_id}/result' if job['status'] == 'done' else None
+    })
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Stream the filled PDF of a finished job"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Job is {job['status']}", 'status': job['status']}), 409
+    
+    claim_number = (job['result'] or {}).get('claim_number') or 'FILLED'
+    return send_file(
+        job['output_path'],
+        as_attachment=True,
+        download_name=f'CCC_BCIF_{claim_number}.pdf',
+        mimetype='application/pdf',
+        conditional=True
+    )
+
+@app.route('/progress', methods=['POST'])
+def reserve_progress():
+    """
+    Issue a progress id before sending long work: open /progress/<id>, then
+    send the request with X-Progress-Id: <id> (within BCIF_PROGRESS_RESERVATION_SECONDS)
+    to have its stages streamed there. 503 when too many ids are outstanding.
+    """
+    try:
+        progress_id = progress.reserve()
+    except OverflowError as e:
+        response = jsonify({'error': str(e)})
+        response.headers['Retry-After'] = str(int(progress.reservation_seconds))
+        return response, 503
+    return jsonify({'progress_id': progress_id, 'progress_url': f'/progress/{progress_id}'}), 201
+
+@app.route('/progress/<progress_id>', methods=['GET'])
+def stream_progress(progress_id):
+    """
+    Server-Sent Events with the stages (uploaded, extracting page k/N, mapping,
+    filling, done) of a job id, or of a request's issued X-Progress-Id.
+    ?format=json returns the latest snapshot instead, for clients that poll.
+    Streams hold a request thread, so each worker serves only a few at once
+    (the stream lane); past that the caller gets 503 and should poll.
+    """
+    if not progress.valid_id(progress_id):
+        return jsonify({'error': 'Invalid progress id'}), 400
+    if request.args.get('format') == 'json':
+        state = progress.read(progress_id)
+        if state is None:
+            return jsonify({'error': 'No progress recorded for this id'}), 404
+        return jsonify(state)
+    if not progress.known(progress_id):
+        return jsonify({'error': 'No progress recorded for this id'}), 404
+    try:
+        slot = admission.hold('stream')
+    except Saturated as e:
+        log.warning('request rejected', extra={'data': {'endpoint': '/progress', 'lane': e.lane, 'reason': e.reason}})
+        return jsonify({'error': f'Server busy: {e}', 'retry_after': e.retry_after}), 503, {
+            'Retry-After': str(e.retry_after)}
+    response = Response(progress.stream(progress_id), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The slot outlives the view: it is given back when the stream ends or the client goes away
+    response.call_on_close(slot.release)
+    return response
+
+@app.route('/config/version', methods=['GET'])
+def config_version():
+    """Report the active mapping version (hash, load time) and watcher state"""
+    return jsonify(config_manager.describe())
+
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """Templates in forms/ with their paired mapping, field counts and whether they are parsed and cached"""
+    return jsonify(templates.describe())
+
+@app.route('/templates/rescan', methods=['POST'])
+def rescan_templates():
+    """Re-pair templates with the mappings in config/ (new mappings are watched from then on)"""
+    templates.discover()
+    return jsonify(templates.describe())
+
+def operational_gauges():
+    """Storage, job queue and mapping gauges evaluated at scrape time"""
+    stats = storage.stats()
+    gauges = [
+        ('bcif_storage_bytes', 'Bytes held in the upload/result folder', {}, stats['bytes']),
+        ('bcif_storage_files', 'Files held in the upload/result folder', {}, stats['file_count']),
+        ('bcif_storage_quota_bytes', 'Byte quota of the upload/result folder', {}, stats['quota_bytes']),
+        ('bcif_storage_evicted_total', 'Files evicted to stay under quota (this process)', {}, stats['evicted_total']),
+        ('bcif_storage_expired_total', 'Files removed after their TTL (this process)', {}, stats['expired_total']),
+    ]
+    for status, count in job_queue.stats()['jobs'].items():
+        gauges.append(('bcif_jobs', 'Jobs in the queue database by status', {'status': status}, count))
+    if config_manager.current:
+        gauges.append(('bcif_mapping_info', 'Active mapping version', {'mapping_version': config_manager.current.sha256[:12]}, 1))
+    return gauges
+
+metrics.add_gauge_source(operational_gauges)
+metrics.add_gauge_source(admission.gauges)
+metrics.add_gauge_source(singleflight.gauges)
+metrics.add_gauge_source(templates.gauges)
+metrics.add_gauge_source(bcif_memory.gauges)
+metrics.add_gauge_source(warmup.gauges)
+metrics.add_gauge_source(text_cache.gauges)
+metrics.add_gauge_source(distance_cache.gauges)
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus text exposition of stage histograms, request counters and gauges, merged across workers"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admission/stats', methods=['GET'])
+def admission_stats():
+    """In-flight, queued and rejected counts per admission lane for this worker process"""
+    return jsonify({'pid': os.getpid(), 'lanes': admission.stats()})
+
+@app.route('/memory/stats', methods=['GET'])
+def memory_stats():
+    """This worker's private (USS) vs shared memory and frozen GC object count"""
+    return jsonify(bcif_memory.describe())
+
+@app.route('/storage/stats', methods=['GET'])
+def storage_stats():
+    """Upload/result folder occupancy, quota use and janitor counters for monitoring"""
+    return jsonify(storage.stats())
 
 if __name__ == '__main__':
-    import time
-    cleanup_old_files()
+    import argparse
+    from bcif_server import add_server_arguments, run
+    
+    # bcif_server imports "bcif_api"; make that resolve to this already-loaded module
+    sys.modules.setdefault('bcif_api', sys.modules[__name__])
+    
+    parser = argparse.ArgumentParser(description="BCIF API server")
+    add_server_arguments(parser)
+    args = parser.parse_args()
     
-    print("Starting BCIF API server...")
+    print(f"Starting BCIF API server ({args.mode} mode)...")
     print(f"Upload folder: {UPLOAD_FOLDER}")
     print(f"Template path: {Path(__file__).parent.parent / 'forms'}")
     print(f"Config path: {Path(__file__).parent.parent / 'config'}")
     
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    run(args)
\ No newline at end of file
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""
+BCIF Form Filling API (async)
+ASGI front end for the form-filling path of bcif_api.py: /fill-bcif,
+/extract-and-fill, /results/<id>, /debug-extraction, the health checks,
+/config/version and /metrics, with the same payloads. Job, progress, route
+planning, template and stats endpoints are served by the Flask app only.
+Uploads and responses are streamed on the event loop, so slow clients cost
+a coroutine rather than a thread; CPU-bound extraction and filling run in a
+shared process pool.
+Serve with: python start_api.py --mode async  (or uvicorn bcif_asgi:app)
+"""
+
+import asyncio
+import contextlib
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, FileResponse, PlainTextResponse
+from starlette.routing import Route
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bcif_logging import logging_setup, request_id_var, new_request_id
+logging_setup.configure()
+log = logging.getLogger('bcif.asgi')
+
+from bcif_fill_enhanced import apply_text_mapping, apply_post_processing, collect_checkbox_states
+from bcif_optimize import DEFAULT_OPTIMIZE_LEVEL, resolve_level, check_linearized
+from bcif_config import ConfigManager
+from bcif_templates import TemplateRegistry
+from bcif_storage import StorageManager
+from bcif_metrics import Metrics
+from bcif_jobs import run_job, init_worker, warmup_state
+
+# Same folder layout as the Flask app, so results and metrics are shared
+UPLOAD_FOLDER = Path(tempfile.gettempdir()) / 'bcif_uploads'
+UPLOAD_FOLDER.mkdir(exist_ok=True)
+
+POOL_WORKERS = int(os.environ.get('BCIF_ASYNC_POOL_WORKERS', os.cpu_count() or 1))
+# Fills allowed to wait for a pool process before new ones get 503
+MAX_PENDING = int(os.environ.get('BCIF_ASYNC_MAX_PENDING', POOL_WORKERS * 4))
+UPLOAD_CHUNK = 64 * 1024
+
+config_manager = ConfigManager()
+# Template -> mapping pairing for the routes that resolve fields in this process
+templates = TemplateRegistry(config_manager)
+storage = StorageManager(UPLOAD_FOLDER)
+metrics = Metrics(UPLOAD_FOLDER / 'metrics')
+
+class CpuPool:
+    """Process pool for extraction/filling with a bound on queued work"""
+
+    def __init__(self, workers: int = POOL_WORKERS, max_pending: int = MAX_PENDING):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self.pending = 0
+        self.executor = None
+
+    def start(self) -> None:
+        if self.executor is None:
+            # spawn: the event loop process already runs background threads
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                mp_context=multiprocessing.get_context('spawn'))
+
+    def stop(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    @property
+    def saturated(self) -> bool:
+        return self.pending >= self.max_pending
+
+    def reserve(self) -> bool:
+        """
+        Count a request as pending before its body is read, so slow uploads
+        can't all pass the check and queue past max_pending together. False
+        when saturated; otherwise the caller must release() when done.
+        """
+        if self.saturated:
+            return False
+        self.pending += 1
+        return True
+
+    def release(self) -> None:
+        self.pending -= 1
+
+    async def run(self, func, *args, reserved: bool = False):
+        """Run func in a pool process; reserved=True when the caller already holds a reserve()d slot"""
+        if not reserved:
+            self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            if not reserved:
+                self.pending -= 1
+
+cpu_pool = CpuPool()
+
+# Pool processes run a synthetic fill in their initializer; ready once they report back
+pool_warmup = {'state': 'cold', 'workers': []}
+
+async def warm_pool() -> None:
+    pool_warmup['state'] = 'warming'
+    try:
+        # Every submission spawns a pool process, and each runs its warm-up before taking work
+        # (the probes themselves may all be answered by whichever process is warm first)
+        states = await asyncio.gather(*(cpu_pool.run(warmup_state) for _ in range(cpu_pool.workers)))
+    except Exception as e:
+        pool_warmup.update(state='failed', error=f'{type(e).__name__}: {e}')
+        log.warning('Pool warm-up failed', extra={'data': {'error': pool_warmup['error']}})
+        return
+    pool_warmup['workers'] = states
+    pool_warmup['state'] = 'ready' if all(st['state'] in ('ready', 'disabled') for st in states) else 'failed'
+
+def busy_response() -> JSONResponse:
+    retry_after = max(1, cpu_pool.pending // cpu_pool.workers)
+    return JSONResponse({'error': 'Server busy: fill pool saturated', 'retry_after': retry_after}, status_code=503,
+                        headers={'Retry-After': str(retry_after)})
+
+def parse_flag(value) -> bool:
+    """Interpret a JSON or form field as a boolean flag"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+def active_mapping(template_name=None):
+    """Snapshot of the active compiled mapping (the template's paired one if any), loading it if startup failed"""
+    if template_name is not None:
+        return templates.mapping_for(template_name)
+    if config_manager.current is None:
+        config_manager.load()
+    return config_manager.current
+
+def filled_pdf_response(result_id, output_path, summary, linearize=False) -> FileResponse:
+    """Stream a filled PDF and point the client at its range-servable stored copy"""
+    storage.register(output_path)
+    headers = {'X-Result-Id': result_id, 'Content-Location': f'/results/{result_id}'}
+    if linearize:
+        headers['X-Linearized'] = 'true' if check_linearized(output_path)['linearized'] else 'false'
+    if summary.get('optimize'):
+        headers['X-Optimize-Level'] = summary['optimize']['applied']
+    return FileResponse(output_path, media_type='application/pdf', headers=headers,
+                        filename=f'CCC_BCIF_{summary.get("claim_number") or "FILLED"}.pdf')
+
+async def fill_in_pool(endpoint, kind, input_path, template_name, optimize, linearize, text=None):
+    """Run one extract/fill in the process pool (under the caller's reserved slot): returns (result_id, output_path, summary)"""
+    result_id, output_path = storage.new_path('filled_bcif')
+    summary = await cpu_pool.run(run_job, kind, str(input_path) if input_path else None, template_name, optimize,
+                                 linearize, str(output_path), str(metrics.directory), endpoint, text, reserved=True)
+    return result_id, output_path, summary
+
+def request_options(params):
+    """(template_name, optimize, linearize) from JSON or form params; raises ValueError on a bad level"""
+    template_name = params.get('template_name', 'Fillable_CCC_BCIF.pdf')
+    optimize = resolve_level(params.get('optimize', DEFAULT_OPTIMIZE_LEVEL))
+    return template_name, optimize, parse_flag(params.get('linearize'))
+
+async def health_check(request: Request):
+    """Simple health check endpoint"""
+    return JSONResponse({'status': 'healthy', 'message': 'BCIF API is running', 'version': '1.0.0', 'server': 'async',
+                         'ready': is_ready()})
+
+def is_ready() -> bool:
+    return pool_warmup['state'] == 'ready' and config_manager.current is not None
+
+async def health_live(request: Request):
+    """Liveness: the event loop is up and serving requests"""
+    return JSONResponse({'status': 'alive', 'pid': os.getpid()})
+
+async def health_ready(request: Request):
+    """Readiness: 200 once the fill pool has warmed up, 503 until then"""
+    body = {'status': 'ready' if is_ready() else 'not ready', 'pid': os.getpid(), 'warmup': pool_warmup,
+            'mapping_loaded': config_manager.current is not None}
+    if not is_ready():
+        return JSONResponse(body, status_code=503, headers={'Retry-After': '1'})
+    return JSONResponse(body)
+
+async def fill_bcif_form(request: Request):
+    """Fill BCIF form using extracted text data (same JSON payload as the Flask route)"""
+    started = time.perf_counter()
+    # The pending slot is taken before the body is read and held until the fill is done
+    if not cpu_pool.reserve():
+        return busy_response()
+    try:
+        return await _fill_bcif_form(request, started)
+    finally:
+        cpu_pool.release()
+
+async def _fill_bcif_form(request: Request, started: float):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'extracted_text' not in data:
+        return JSONResponse({'error': 'Missing extracted_text in request'}, status_code=400)
+    try:
+        template_name, optimize, linearize = request_options(data)
+    except ValueError as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    if config_manager.resolve_template(template_name) is None:
+        return JSONResponse({'error': f'PDF template not found: {template_name}'}, status_code=500)
+
+    try:
+        result_id, output_path, summary = await fill_in_pool('/fill-bcif', 'fill', None, template_name, optimize,
+                                                             linearize, data['extracted_text'])
+    except Exception as e:
+        log.exception('Error filling BCIF form')
+        return JSONResponse({'error': f'Form filling failed: {str(e)}'}, status_code=500)
+    log.info('request complete', extra={'data': {
+        'endpoint': '/fill-bcif', 'field_count': summary['field_count'],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)}})
+    return filled_pdf_response(result_id, output_path, summary, linearize)
+
+async def extract_and_fill(request: Request):
+    """Complete workflow: receive the estimate PDF without blocking, then extract and fill in the pool"""
+    started = time.perf_counter()
+    # Reserved before the upload is read: a slow upload counts against the bound while it trickles in
+    if not cpu_pool.reserve():
+        return busy_response()
+    try:
+        return await _extract_and_fill(request, started)
+    finally:
+        cpu_pool.release()
+
+async def _extract_and_fill(request: Request, started: float):
+    # python-multipart parses the body as it arrives; a slow upload only parks this coroutine
+    async with request.form() as form:
+        pdf_file = form.get('pdf_file')
+        if pdf_file is None or not hasattr(pdf_file, 'read'):
+            return JSONResponse({'error': 'No PDF file uploaded'}, status_code=400)
+        if not pdf_file.filename:
+            return JSONResponse({'error': 'No file selected'}, status_code=400)
+        try:
+            template_name, optimize, linearize = request_options(form)
+        except ValueError as e:
+            return JSONResponse({'error': str(e)}, status_code=400)
+        if config_manager.resolve_template(template_name) is None:
+            return JSONResponse({'error': f'PDF template not found: {template_name}'}, status_code=500)
+
+        _, upload_path = storage.new_path('upload')
+        with open(upload_path, 'wb') as out:
+            while chunk := await pdf_file.read(UPLOAD_CHUNK):
+                out.write(chunk)
+    storage.register(upload_path)
+
+    try:
+        result_id, output_path, summary = await fill_in_pool('/extract-and-fill', 'extract_and_fill', upload_path,
+                                                             template_name, optimize, linearize)
+    except Exception as e:
+        log.exception('Extract and fill failed')
+        return JSONResponse({'error': f'Extract and fill failed: {str(e)}'}, status_code=500)
+    finally:
+        storage.remove(upload_path)
+    log.info('request complete', extra={'data': {
+        'endpoint': '/extract-and-fill', 'field_count': summary['field_count'],
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 3)}})
+    return filled_pdf_response(result_id, output_path, summary, linearize)
+
+def resolve_fields(extracted_text, mapping):
+    text_fields = apply_text_mapping(extracted_text, mapping.text_fields)
+    apply_post_processing(text_fields, mapping.post_processing)
+    return text_fields, collect_checkbox_states(extracted_text, mapping.checkbox_rules)
+
+async def debug_extraction(request: Request):
+    """See what gets extracted without filling the form (regex work runs off the event loop)"""
+    try:
+        data = await request.json()
+        template_name = data.get('template_name')
+        if template_name is not None and templates.resolve_template(template_name) is None:
+            return JSONResponse({'error': f'PDF template not found: {template_name}'}, status_code=400)
+        # Same mapping choice as the Flask route: the one paired with template_name, else the default
+        mapping = active_mapping(template_name)
+        text_fields, checkbox_fields = await asyncio.to_thread(resolve_fields, data.get('extracted_text', ''), mapping)
+        return JSONResponse({
+            'text_fields': text_fields,
+            'checkbox_fields': checkbox_fields,
+            'field_count': len(text_fields),
+            'checkbox_count': len(checkbox_fields),
+            'mapping_version': mapping.sha256[:12]
+        })
+    except Exception as e:
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def get_result(request: Request):
+    """Serve a previously filled PDF inline with HTTP range support"""
+    result_id = request.path_params['result_id']
+    if not storage.valid_id(result_id):
+        return JSONResponse({'error': 'Invalid result id'}, status_code=400)
+    output_path = storage.path_for('filled_bcif', result_id)
+    if not output_path.exists():
+        return JSONResponse({'error': 'Result not found or expired'}, status_code=404)
+    storage.touch(output_path)
+    return FileResponse(output_path, media_type='application/pdf')
+
+async def config_version(request: Request):
+    """Report the active mapping version (hash, load time) and watcher state"""
+    return JSONResponse(config_manager.describe())
+
+async def metrics_endpoint(request: Request):
+    """Prometheus text exposition, merged with the pool processes' snapshots"""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+def pool_gauges():
+    return [
+        ('bcif_async_pool_pending', 'Fills submitted to the process pool and not yet finished', {}, cpu_pool.pending),
+        ('bcif_async_pool_workers', 'Processes in the fill pool', {}, cpu_pool.workers),
+    ]
+
+metrics.add_gauge_source(pool_gauges)
+
+class RequestIdMiddleware(BaseHTTPMiddleware):
+    """Take the caller's X-Request-Id or mint one; every log record of the request carries it"""
+
+    async def dispatch(self, request, call_next):
+        request_id = request.headers.get('X-Request-Id', '')[:64] or new_request_id()
+        request_id_var.set(request_id)
+        response = await call_next(request)
+        response.headers['X-Request-Id'] = request_id
+        return response
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    try:
+        config_manager.load()
+    except Exception:
+        pass  # reported per request until the file becomes loadable
+    logging_setup.start()
+    config_manager.start_watching()
+    templates.start_watching()
+    storage.start_janitor()
+    metrics.start_flusher()
+    cpu_pool.start()
+    warming = asyncio.create_task(warm_pool())
+    log.info('async server ready', extra={'data': {'pool_workers': cpu_pool.workers, 'max_pending': cpu_pool.max_pending}})
+    try:
+        yield
+    finally:
+        warming.cancel()
+        cpu_pool.stop()
+        metrics.stop_flusher()
+        storage.stop_janitor()
+        templates.stop_watching()
+        config_manager.stop_watching()
+        metrics.flush()
+        logging_setup.stop()
+
+app = Starlette(
+    routes=[
+        Route('/health', health_check, methods=['GET']),
+        Route('/health/live', health_live, methods=['GET']),
+        Route('/health/ready', health_ready, methods=['GET']),
+        Route('/fill-bcif', fill_bcif_form, methods=['POST']),
+        Route('/extract-and-fill', extract_and_fill, methods=['POST']),
+        Route('/results/{result_id}', get_result, methods=['GET']),
+        Route('/debug-extraction', debug_extraction, methods=['POST']),
+        Route('/config/version', config_version, methods=['GET']),
+        Route('/metrics', metrics_endpoint, methods=['GET']),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'],
+                   expose_headers=['X-Result-Id', 'X-Request-Id', 'X-Linearized', 'X-Optimize-Level', 'Content-Location']),
+        Middleware(RequestIdMiddleware),
+    ],
+    lifespan=lifespan,
+)
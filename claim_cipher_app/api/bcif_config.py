@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+BCIF Config Manager
+Loads and compiles bcif-mapping.json once, then polls its mtime and swaps in a
+freshly compiled version when the file changes. Requests take a reference to
+the active CompiledMapping up front, so a reload never changes the mapping
+under a request that is already running.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from bcif_fill_enhanced import compile_mapping_spec
+
+log = logging.getLogger('bcif.config')
+
+BASE_DIR = Path(__file__).parent.parent
+DEFAULT_MAPPING_PATH = BASE_DIR / 'config' / 'bcif-mapping.json'
+DEFAULT_FORMS_DIR = BASE_DIR / 'forms'
+DEFAULT_POLL_SECONDS = float(os.environ.get('BCIF_MAPPING_POLL_SECONDS', '2.0'))
+
+class CompiledMapping:
+    """An immutable, compiled snapshot of one version of the mapping file"""
+
+    def __init__(self, spec: Dict[str, Any], sha256: str, mtime: float, version: int):
+        self.spec = spec
+        self.text_fields = spec.get("text_fields", {})
+        self.checkbox_rules = spec.get("checkbox_rules", {})
+        self.post_processing = spec.get("post_processing", {})
+        self.meta = spec.get("meta", {})
+        self.sha256 = sha256
+        self.mtime = mtime
+        self.version = version
+        self.loaded_at = time.time()
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.meta.get('name'),
+            'sha256': self.sha256,
+            'hash': self.sha256[:12],
+            'version': self.version,
+            'loaded_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.loaded_at)),
+            'file_mtime': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(self.mtime)),
+            'text_field_count': len(self.text_fields),
+            'checkbox_rule_count': len(self.checkbox_rules.get("rules", [])),
+        }
+
+class ConfigManager:
+    """Owns the active CompiledMapping and resolved template paths"""
+
+    def __init__(self, mapping_path: Path = DEFAULT_MAPPING_PATH, forms_dir: Path = DEFAULT_FORMS_DIR,
+                 poll_interval: float = DEFAULT_POLL_SECONDS):
+        self.mapping_path = Path(mapping_path)
+        self.forms_dir = Path(forms_dir).resolve()
+        self.poll_interval = poll_interval
+        self.current: Optional[CompiledMapping] = None
+        self.last_error: Optional[str] = None
+        self._lock = threading.Lock()
+        self._templates: Dict[str, Path] = {}
+        # path -> (mtime when read, bytes)
+        self._template_data: Dict[Path, Tuple[float, bytes]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self) -> CompiledMapping:
+        """Read, compile and activate the mapping file. On failure the previous version stays active."""
+        with self._lock:
+            try:
+                stat = self.mapping_path.stat()
+                raw = self.mapping_path.read_bytes()
+                spec = compile_mapping_spec(json.loads(raw))
+            except Exception as e:
+                self.last_error = f'{type(e).__name__}: {e}'
+                log.error('Could not load mapping %s: %s', self.mapping_path, self.last_error)
+                raise
+
+            version = self.current.version + 1 if self.current else 1
+            compiled = CompiledMapping(spec, hashlib.sha256(raw).hexdigest(), stat.st_mtime, version)
+            # Single reference assignment: readers see either the old or the new mapping
+            self.current = compiled
+            self.last_error = None
+            log.info('Loaded mapping', extra={'data': {
+                'mapping': self.mapping_path.name, 'version': version, 'mapping_version': compiled.sha256[:12]}})
+            return compiled
+
+    def reload_if_changed(self) -> bool:
+        """Reload when the file's mtime differs from the active version. Returns True on swap."""
+        try:
+            mtime = self.mapping_path.stat().st_mtime
+        except OSError:
+            return False
+        if self.current is not None and mtime == self.current.mtime:
+            return False
+        try:
+            self.load()
+        except Exception:
+            return False
+        return True
+
+    def start_watching(self) -> None:
+        """Start the mtime polling thread (no-op when poll_interval <= 0 or already running)"""
+        if self.poll_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='bcif-config-watcher', daemon=True)
+        self._thread.start()
+
+    def stop_watching(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self.reload_if_changed()
+
+    def resolve_template(self, template_name: str) -> Optional[Path]:
+        """Map a template name to a file in the forms directory, or None if it doesn't exist"""
+        path = self._templates.get(template_name)
+        if path is not None:
+            return path
+        # Only plain file names inside forms/ are accepted
+        if not template_name or Path(template_name).name != template_name:
+            return None
+        path = self.forms_dir / template_name
+        if not path.is_file():
+            return None
+        self._templates[template_name] = path
+        return path
+
+    def preload_templates(self) -> int:
+        """Read every PDF in the forms directory into memory. Returns bytes loaded."""
+        total = 0
+        for path in sorted(self.forms_dir.glob('*.pdf')):
+            mtime = path.stat().st_mtime  # before reading: a write in between makes the copy stale, not wrong
+            data = path.read_bytes()
+            self._templates[path.name] = path
+            self._template_data[path] = (mtime, data)
+            total += len(data)
+        return total
+
+    def template_source(self, path: Path):
+        """Preloaded template bytes while the file is unchanged, otherwise the path for fill_pdf to open"""
+        entry = self._template_data.get(path)
+        if entry is None:
+            return path
+        try:
+            current = path.stat().st_mtime
+        except OSError:
+            current = None
+        if current != entry[0]:
+            self._template_data.pop(path, None)  # edited since preload: never serve (or cache) the old bytes
+            return path
+        return entry[1]
+
+    def describe(self) -> Dict[str, Any]:
+        info = self.current.describe() if self.current else {'version': None}
+        info.update({
+            'path': str(self.mapping_path),
+            'poll_interval_seconds': self.poll_interval,
+            'watching': bool(self._thread and self._thread.is_alive()),
+            'last_error': self.last_error,
+        })
+        return info
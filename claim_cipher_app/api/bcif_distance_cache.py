@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+BCIF Distance Cache
+Road distances and drive times between places adjusters visit week after
+week (body shops, tow yards, salvage auctions), kept in SQLite so route
+planning reuses them instead of falling back to straight-line estimates.
+Places are keyed by their coordinates rounded to BCIF_DISTANCE_CACHE_DECIMALS
+(3 = about 100 m) and packed into one integer; each pair is stored once,
+smaller key first, in a WITHOUT ROWID table whose primary key covers every
+lookup. Entries expire after BCIF_DISTANCE_CACHE_TTL seconds. If the
+database file is removed under a running server, the next operation
+recreates it empty rather than failing every route request.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+DECIMALS = int(os.environ.get('BCIF_DISTANCE_CACHE_DECIMALS', 3))
+TTL = float(os.environ.get('BCIF_DISTANCE_CACHE_TTL', 30 * 86400))
+PURGE_INTERVAL = 3600.0
+
+log = logging.getLogger('bcif.distances')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS distances (
+    a INTEGER NOT NULL,
+    b INTEGER NOT NULL,
+    miles REAL NOT NULL,
+    minutes REAL NOT NULL,
+    source TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (a, b)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS distances_expires_at ON distances (expires_at);
+"""
+
+Point = Tuple[float, float]
+
+class DistanceCache:
+    def __init__(self, path: Path, ttl: float = TTL, decimals: int = DECIMALS):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.decimals = decimals
+        self._scale = 10 ** decimals
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'stored': 0}
+        self._last_purge = 0.0
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    def _run(self, work):
+        """work(db) on its own connection, recreating the schema once if the database was removed"""
+        try:
+            with self._connect() as db:
+                return work(db)
+        except sqlite3.OperationalError as e:
+            if 'no such table' not in str(e) and 'unable to open' not in str(e):
+                raise
+        log.warning('Distance cache database was missing; recreating it empty', extra={'data': {'path': str(self.path)}})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            return work(db)
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit connection per operation, as in the job queue; WAL lets workers read while one writes
+        db = sqlite3.connect(str(self.path), timeout=30, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def key(self, point: Point) -> int:
+        """One integer per ~100 m cell: rounded latitude and longitude, both shifted non-negative"""
+        lat, lng = point
+        s = self._scale
+        return (round(lat * s) + 90 * s) * (360 * s + 1) + round(lng * s) + 180 * s
+
+    # ---------- Writes ----------
+
+    def put_many(self, legs: Iterable[Tuple[Point, Point, float, float]], source: str,
+                 ttl: Optional[float] = None) -> int:
+        """Store (origin, destination, miles, minutes) legs; a newer value for a pair replaces the old one"""
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        rows = {}
+        for origin, destination, miles, minutes in legs:
+            a, b = sorted((self.key(origin), self.key(destination)))
+            if a != b:
+                rows[a, b] = (a, b, float(miles), float(minutes), source, expires_at)
+        if rows:
+            self._run(lambda db: db.executemany(
+                "INSERT INTO distances (a, b, miles, minutes, source, expires_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (a, b) DO UPDATE SET miles = excluded.miles, minutes = excluded.minutes, "
+                "source = excluded.source, expires_at = excluded.expires_at",
+                list(rows.values())))
+            with self._lock:
+                self._stats['stored'] += len(rows)
+        self._maybe_purge()
+        return len(rows)
+
+    def purge(self) -> int:
+        now = time.time()
+        return self._run(lambda db: db.execute("DELETE FROM distances WHERE expires_at <= ?", (now,)).rowcount)
+
+    def _maybe_purge(self) -> None:
+        now = time.time()
+        if now - self._last_purge >= PURGE_INTERVAL:
+            self._last_purge = now
+            self.purge()
+
+    # ---------- Reads ----------
+
+    def lookup(self, keys: Iterable[int]) -> Dict[Tuple[int, int], Tuple[float, float]]:
+        """Every unexpired cached pair among the keys: {(a, b): (miles, minutes)} with a < b"""
+        keys = sorted(set(keys))
+        if len(keys) < 2:
+            return {}
+        marks = ','.join('?' * len(keys))
+        now = time.time()
+        rows = self._run(lambda db: db.execute(
+            f"SELECT a, b, miles, minutes FROM distances WHERE a IN ({marks}) AND b IN ({marks}) AND expires_at > ?",
+            (*keys, *keys, now)).fetchall())
+        return {(a, b): (miles, minutes) for a, b, miles, minutes in rows}
+
+    def overlay(self, points: Sequence[Point], miles, minutes) -> int:
+        """
+        Replace estimates in the n x n miles and minutes matrices (NumPy
+        arrays for points, in order) with cached values. Only the misses keep
+        their estimates. Returns how many distinct pairs came from the cache.
+        """
+        where: Dict[int, List[int]] = defaultdict(list)
+        for i, point in enumerate(points):
+            where[self.key(point)].append(i)
+        found = self.lookup(where)
+        for (a, b), (cached_miles, cached_minutes) in found.items():
+            for i in where[a]:
+                for j in where[b]:
+                    miles[i, j] = miles[j, i] = cached_miles
+                    minutes[i, j] = minutes[j, i] = cached_minutes
+        pairs = len(where) * (len(where) - 1) // 2
+        with self._lock:
+            self._stats['hits'] += len(found)
+            self._stats['misses'] += pairs - len(found)
+        return len(found)
+
+    def stats(self) -> Dict[str, Any]:
+        by_source = dict(self._run(lambda db: db.execute(
+            "SELECT source, COUNT(*) FROM distances GROUP BY source").fetchall()))
+        with self._lock:
+            counters = dict(self._stats)
+        return {
+            'path': str(self.path),
+            'bytes': self.path.stat().st_size if self.path.exists() else 0,
+            'pairs': by_source,
+            'ttl_seconds': self.ttl,
+            'decimals': self.decimals,
+            **counters,
+        }
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        with self._lock:
+            s = dict(self._stats)
+        return [
+            ('bcif_distance_cache_pairs_total', 'Location pairs looked up in the distance cache by outcome (this process)',
+             {'result': 'hit'}, s['hits']),
+            ('bcif_distance_cache_pairs_total', 'Location pairs looked up in the distance cache by outcome (this process)',
+             {'result': 'miss'}, s['misses']),
+        ]
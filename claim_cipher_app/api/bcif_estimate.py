@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+BCIF Estimate Parsing
+Turns a CCC estimate into a structured, versioned JSON document (claim
+identifiers, parties, vehicle, options and estimate totals) using the same
+compiled mapping that fills the BCIF form, so the browser no longer needs
+its own pdf.js extractor. Extracted text can be cached by the upload's
+content hash, so re-uploading an estimate skips PDF parsing; the text holds
+claimant PII, so the cache is off unless BCIF_TEXT_CACHE=1.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+
+# Opt-in: the cache keeps estimate text (names, addresses, VINs) on disk
+TEXT_CACHE_ENABLED = os.environ.get('BCIF_TEXT_CACHE', '0').strip().lower() in ('1', 'true', 'yes', 'on')
+
+SCHEMA = 'ccc-estimate'
+SCHEMA_VERSION = 1
+
+# BCIF field name -> (section, key[, sub-key]) in the document
+FIELD_PATHS = {
+    'Claim Number': ('claim', 'claim_number'),
+    'Policy Number': ('claim', 'policy_number'),
+    'Date of loss (mm/dd/yyyy)': ('claim', 'date_of_loss'),
+    'Type of Loss': ('claim', 'type_of_loss'),
+    'Loss State': ('claim', 'loss_state'),
+    'Loss ZIP Code': ('claim', 'loss_zip'),
+    'Company': ('parties', 'company'),
+    'Owner First Name': ('parties', 'owner', 'first_name'),
+    'Owner Last Name': ('parties', 'owner', 'last_name'),
+    'Insured First Name': ('parties', 'insured', 'first_name'),
+    'Insured Last Name': ('parties', 'insured', 'last_name'),
+    'Adjuster First Name': ('parties', 'adjuster', 'first_name'),
+    'Adjuster Last Name': ('parties', 'adjuster', 'last_name'),
+    'Adjuster Contact Number': ('parties', 'adjuster', 'phone'),
+    'Appraiser First Name': ('parties', 'appraiser', 'first_name'),
+    'Appraiser Last Name': ('parties', 'appraiser', 'last_name'),
+    'Year': ('vehicle', 'year'),
+    'Make': ('vehicle', 'make'),
+    'Model': ('vehicle', 'model'),
+    'Trim': ('vehicle', 'trim'),
+    'VIN': ('vehicle', 'vin'),
+    'Odometer (mi)': ('vehicle', 'odometer'),
+    'Cylinders': ('vehicle', 'cylinders'),
+}
+INTEGER_FIELDS = {'Year', 'Odometer (mi)'}
+
+WORKFILE_RE = re.compile(r'Workfile ID:\s*(\S+)')
+DESCRIPTION_RE = re.compile(r'^VEHICLE\s*\n(.+)$', re.MULTILINE)
+LINE_ITEM_RE = re.compile(r'^(\d+)\s+\S', re.MULTILINE)
+LINES_SECTION_RE = re.compile(r'^Line Oper .*?^SUBTOTALS', re.MULTILINE | re.DOTALL)
+SUBTOTALS_RE = re.compile(r'^SUBTOTALS\s+([\d,]+\.\d{2})\s+([\d.]+)\s+([\d.]+)\s*$', re.MULTILINE)
+TOTALS_BLOCK_RE = re.compile(r'^ESTIMATE TOTALS\s*$(.*?)^Net Cost of Repairs\s+([\d,]+\.\d{2})\s*$', re.MULTILINE | re.DOTALL)
+HOURS_RE = re.compile(r'^(?P<category>[A-Za-z][A-Za-z /&-]*?)\s+(?P<hours>[\d.]+)\s+hrs\s+@\s+\$\s*(?P<rate>[\d,.]+)\s*/hr\s+(?P<cost>[\d,]+\.\d{2})$')
+TAX_RE = re.compile(r'^Sales Tax\s+\$\s*(?P<base>[\d,.]+)\s+@\s+(?P<rate>[\d.]+)\s*%\s+(?P<cost>[\d,]+\.\d{2})$')
+AMOUNT_RE = re.compile(r'^(?P<label>[A-Za-z][A-Za-z /&-]*?)\s+(?P<cost>-?[\d,]+\.\d{2})$')
+
+def _money(value: str) -> float:
+    return round(float(value.replace(',', '')), 2)
+
+def _key(label: str) -> str:
+    return re.sub(r'[^a-z0-9]+', '_', label.lower()).strip('_')
+
+def parse_totals(text: str) -> Dict[str, Any]:
+    """The ESTIMATE TOTALS block: cost categories (with labor hours and rates), tax and net cost"""
+    totals: Dict[str, Any] = {}
+    subtotals = SUBTOTALS_RE.search(text)
+    if subtotals:
+        totals['line_subtotals'] = {
+            'parts': _money(subtotals.group(1)),
+            'labor_hours': float(subtotals.group(2)),
+            'paint_hours': float(subtotals.group(3)),
+        }
+    block = TOTALS_BLOCK_RE.search(text)
+    if not block:
+        return totals
+    categories: List[Dict[str, Any]] = []
+    for line in block.group(1).splitlines():
+        line = line.strip()
+        if m := HOURS_RE.match(line):
+            categories.append({'category': m['category'], 'hours': float(m['hours']),
+                               'rate': _money(m['rate']), 'cost': _money(m['cost'])})
+        elif m := TAX_RE.match(line):
+            totals['sales_tax'] = {'base': _money(m['base']), 'rate_percent': float(m['rate']), 'cost': _money(m['cost'])}
+        elif m := AMOUNT_RE.match(line):
+            key = _key(m['label'])
+            if key in ('subtotal', 'total_cost_of_repairs', 'deductible', 'total_adjustments'):
+                totals[key] = _money(m['cost'])
+            else:
+                categories.append({'category': m['label'], 'cost': _money(m['cost'])})
+    totals['categories'] = categories
+    totals['net_cost_of_repairs'] = _money(block.group(2))
+    return totals
+
+def count_line_items(text: str) -> int:
+    """Estimate lines are numbered 1..n; page headers and addresses inside the section break the sequence"""
+    section = LINES_SECTION_RE.search(text)
+    expected = 1
+    for number in LINE_ITEM_RE.findall(section.group(0) if section else ''):
+        if int(number) == expected:
+            expected += 1
+    return expected - 1
+
+def structure_estimate(text: str, text_fields: Dict[str, str], checkbox_fields: List[str], mapping) -> Dict[str, Any]:
+    """
+    Build the versioned estimate document from the mapping's text fields and
+    checkboxes plus the totals parsed from the text. Empty values are left
+    out; fields a mapping adds beyond the known ones land in "other".
+    """
+    doc: Dict[str, Any] = {
+        'schema': SCHEMA,
+        'schema_version': SCHEMA_VERSION,
+        'mapping_version': mapping.sha256[:12],
+        'claim': {}, 'parties': {}, 'vehicle': {}, 'other': {},
+    }
+    for name, value in text_fields.items():
+        if value in (None, ''):
+            continue
+        if name in INTEGER_FIELDS and str(value).isdigit():
+            value = int(value)
+        path = FIELD_PATHS.get(name)
+        if path is None:
+            doc['other'][name] = value
+            continue
+        node = doc[path[0]]
+        for part in path[1:-1]:
+            node = node.setdefault(part, {})
+        node[path[-1]] = value
+
+    if m := WORKFILE_RE.search(text):
+        doc['claim']['workfile_id'] = m.group(1)
+    if m := DESCRIPTION_RE.search(text):
+        doc['vehicle']['description'] = m.group(1).strip()
+    doc['options'] = sorted(checkbox_fields)
+    doc['line_item_count'] = count_line_items(text)
+    doc['totals'] = parse_totals(text)
+    return {k: v for k, v in doc.items() if v not in ({}, [], None, 0)}
+
+class TextCache:
+    """
+    Extracted estimate text keyed by the SHA-256 of the PDF bytes, stored as
+    files under the storage manager (kind "text", BCIF_TEXT_CACHE_TTL) so
+    every worker shares it and the janitor expires it. Disabled (nothing is
+    written, every lookup extracts) unless enabled, or with a TTL of 0.
+    """
+
+    def __init__(self, storage, enabled: bool = TEXT_CACHE_ENABLED):
+        self.storage = storage
+        self.enabled = enabled and storage.ttls.get('text', 0) > 0
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0}
+
+    @staticmethod
+    def digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    def _path(self, digest: str):
+        return self.storage.path_for('text', digest[:16], '.txt')
+
+    def get(self, digest: str) -> Optional[str]:
+        path = self._path(digest)
+        try:
+            stored = path.read_bytes().decode('utf-8')
+        except OSError:
+            stored = None
+        # The first line holds the full digest; a 16-hex prefix collision is a miss
+        hit = stored is not None and stored.startswith(digest + '\n')
+        with self._lock:
+            self._stats['hits' if hit else 'misses'] += 1
+        if not hit:
+            return None
+        self.storage.touch(path)
+        return stored[len(digest) + 1:]
+
+    def put(self, digest: str, text: str) -> None:
+        path = self._path(digest)
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_bytes(f'{digest}\n{text}'.encode('utf-8'))
+        tmp.replace(path)
+        self.storage.register(path)
+
+    def extract(self, content: bytes, extract) -> Tuple[str, bool]:
+        """Cached text of a PDF, calling extract(content) on a miss. Returns (text, cache_hit)."""
+        if not self.enabled:
+            return extract(content), False
+        digest = self.digest(content)
+        text = self.get(digest)
+        if text is not None:
+            return text, True
+        text = extract(content)
+        self.put(digest, text)
+        return text, False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        s = self.stats()
+        return [
+            ('bcif_text_cache_total', 'Extracted-text cache lookups by outcome (this process)', {'result': 'hit'}, s['hits']),
+            ('bcif_text_cache_total', 'Extracted-text cache lookups by outcome (this process)', {'result': 'miss'}, s['misses']),
+        ]
@@ -1,20 +1,142 @@
-import re, json, sys, argparse, time
+import re, io, json, sys, argparse, time, logging, importlib
 from pathlib import Path
-from typing import Dict, Any, List, Tuple, Optional
-
-# Try newer pypdf first, fallback to PyPDF2
-try:
-    from pypdf import PdfReader, PdfWriter
-    from pypdf.generic import NameObject, TextStringObject
-    print("Using pypdf (newer version)")
-except ImportError:
+from typing import Dict, Any, List, Tuple, Optional, Union, Callable
+
+log = logging.getLogger("bcif.fill")
+
+from bcif_optimize import OPTIMIZE_LEVELS, DEFAULT_OPTIMIZE_LEVEL, optimize_writer, optimize_file
+
+# ---------- Lazily imported backends ----------
+# pypdf and reportlab are imported on first use, so mapping-only callers
+# (config loading, --merge_only, regex work) never pay for them. Servers call
+# preload_backends() at startup so no request imports a module.
+
+_pdf_backend = None
+_reportlab_backend = None
+
+def pdf_backend():
+    """(PdfReader, PdfWriter, NameObject, TextStringObject), preferring pypdf over PyPDF2"""
+    global _pdf_backend
+    if _pdf_backend is None:
+        try:
+            from pypdf import PdfReader, PdfWriter
+            from pypdf.generic import NameObject, TextStringObject
+            log.debug("Using pypdf (newer version)")
+        except ImportError:
+            try:
+                from PyPDF2 import PdfReader, PdfWriter
+                from PyPDF2.generic import NameObject, TextStringObject
+                log.debug("Using PyPDF2 (legacy version)")
+            except ImportError:
+                raise ImportError("Neither pypdf nor PyPDF2 is available")
+        _pdf_backend = (PdfReader, PdfWriter, NameObject, TextStringObject)
+    return _pdf_backend
+
+def reportlab_backend():
+    """(canvas, letter) from reportlab; raises ImportError (remembered) when not installed"""
+    global _reportlab_backend
+    if _reportlab_backend is None:
+        try:
+            from reportlab.pdfgen import canvas
+            from reportlab.lib.pagesizes import letter
+            _reportlab_backend = (canvas, letter)
+        except ImportError:
+            _reportlab_backend = False  # don't rescan sys.path on every fallback
+    if not _reportlab_backend:
+        raise ImportError("reportlab is not installed")
+    return _reportlab_backend
+
+def preload_backends() -> List[str]:
+    """Import every PDF backend this process may need; returns the names that loaded"""
+    loaded = []
+    pdf_backend()
+    loaded.append(_pdf_backend[0].__module__.split(".")[0])
     try:
-        from PyPDF2 import PdfReader, PdfWriter
-        from PyPDF2.generic import NameObject, TextStringObject
-        print("Using PyPDF2 (legacy version)")
+        reportlab_backend()
+        loaded.append("reportlab")
     except ImportError:
-        print("ERROR: Neither pypdf nor PyPDF2 is available")
-        sys.exit(1)
+        pass
+    try:
+        importlib.import_module("pikepdf")  # used by bcif_optimize for object streams/linearization
+        loaded.append("pikepdf")
+    except ImportError:
+        pass
+    return loaded
+
+# ---------- Prepared templates ----------
+
+class PreparedTemplate:
+    """
+    A template parsed once with every object resolved up front. Fills clone
+    its pages into their own writer, which only reads the shared objects, so
+    one PreparedTemplate serves concurrent fills without re-parsing the PDF.
+    """
+
+    def __init__(self, source: Union[Path, bytes]):
+        PdfReader = pdf_backend()[0]
+        data = source if isinstance(source, bytes) else Path(source).read_bytes()
+        self.size = len(data)
+        self.reader = PdfReader(io.BytesIO(data))
+        # Resolve everything now: later reads must never touch the shared stream
+        for ids in self.reader.xref.values():
+            for idnum in ids:
+                self.reader.get_object(idnum)
+        for idnum in getattr(self.reader, "xref_objStm", {}):
+            self.reader.get_object(idnum)
+        self.pages = list(self.reader.pages)
+        # Which annotation each field is and its checkbox state names, so fills skip the lookups
+        self.plan = fill_plan(self.pages)
+        self.fields: Dict[str, str] = {}
+        for _, _, fname, kind, _, _ in self.plan:
+            if fname:
+                self.fields[fname] = kind
+
+    def describe(self) -> Dict[str, Any]:
+        checkboxes = sum(1 for t in self.fields.values() if t == "checkbox")
+        return {
+            "bytes": self.size,
+            "pages": len(self.pages),
+            "field_count": len(self.fields),
+            "text_field_count": len(self.fields) - checkboxes,
+            "checkbox_count": checkboxes,
+        }
+
+def page_annots(page) -> list:
+    """A page's /Annots array resolved (PyPDF2 3.x hands back the indirect reference)"""
+    if "/Annots" not in page:
+        return []
+    return page["/Annots"].get_object() or []
+
+def fill_plan(pages) -> List[Tuple[int, int, Optional[str], str, Any, Any]]:
+    """
+    (page index, annotation index, field name, "text"/"checkbox", on state,
+    off state) for every widget. Indexes stay valid on pages cloned into a
+    writer; a checkbox without an appearance dict has no on/off state.
+    """
+    plan = []
+    for pno, page in enumerate(pages):
+        for ano, a_ref in enumerate(page_annots(page)):
+            try:
+                a = a_ref.get_object()
+                fname_obj = a.get("/T")
+                fname = str(fname_obj).strip("()") if fname_obj else None
+                if a.get("/FT") != "/Btn":
+                    if fname:
+                        plan.append((pno, ano, fname, "text", None, None))
+                    continue
+                on = off = None
+                ap = a.get("/AP")
+                states = ap.get("/N") if ap else None
+                if states:
+                    for key in states.keys():
+                        if "Off" in str(key):
+                            off = off or key
+                        else:
+                            on = on or key
+                plan.append((pno, ano, fname, "checkbox", on, off))
+            except Exception as e:
+                log.warning("Could not process field: %s", e)
+    return plan
 
 # ---------- Enhanced Extraction Helpers ----------
 
@@ -25,20 +147,62 @@ def uniq(seq):
             out.append(x); seen.add(x)
     return out
 
-def extract_text(pdf_path: Path) -> str:
+def extract_text(pdf_path: Union[Path, bytes], on_page: Optional[Callable[[int, int], None]] = None) -> str:
+    PdfReader = pdf_backend()[0]
     text = ""
-    r = PdfReader(str(pdf_path))
-    for p in r.pages:
+    # Uploads parsed by the API arrive as bytes
+    r = PdfReader(io.BytesIO(pdf_path) if isinstance(pdf_path, bytes) else str(pdf_path))
+    pages = len(r.pages)
+    for n, p in enumerate(r.pages, 1):
         try:
             text += p.extract_text() or ""
             text += "\n"
         except Exception:
             continue
+        finally:
+            if on_page:
+                on_page(n, pages)
     return text
 
+# Flags each mapping section is matched with; compile_mapping_spec must agree
+TEXT_PATTERN_FLAGS = re.IGNORECASE | re.MULTILINE
+COMPOSE_PATTERN_FLAGS = re.IGNORECASE
+CHECKBOX_PATTERN_FLAGS = re.IGNORECASE | re.MULTILINE
+
+def search_pattern(pat, text: str, flags: int) -> Optional[re.Match]:
+    """re.search that also accepts patterns precompiled by compile_mapping_spec"""
+    if isinstance(pat, re.Pattern):
+        return pat.search(text)
+    return re.search(pat, text, flags)
+
+def compile_mapping_spec(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of a mapping spec with every regex precompiled"""
+    def compile_all(pats, flags):
+        return [re.compile(p, flags) for p in pats or []]
+
+    text_fields = {}
+    for field, rules in (spec.get("text_fields") or {}).items():
+        rules = dict(rules)
+        if "compose" in rules:
+            compose = dict(rules["compose"])
+            compose["cyl_from"] = compile_all(compose.get("cyl_from"), COMPOSE_PATTERN_FLAGS)
+            compose["disp_from"] = compile_all(compose.get("disp_from"), COMPOSE_PATTERN_FLAGS)
+            rules["compose"] = compose
+        if "patterns" in rules:
+            rules["patterns"] = compile_all(rules["patterns"], TEXT_PATTERN_FLAGS)
+        text_fields[field] = rules
+
+    checkbox_rules = dict(spec.get("checkbox_rules") or {})
+    checkbox_rules["rules"] = [
+        dict(r, match_any=compile_all(r.get("match_any"), CHECKBOX_PATTERN_FLAGS))
+        for r in checkbox_rules.get("rules", [])
+    ]
+
+    return dict(spec, text_fields=text_fields, checkbox_rules=checkbox_rules)
+
 def find_with_patterns(text: str, patterns: List[str]) -> Tuple[Optional[str], Optional[re.Match]]:
     for pat in patterns:
-        m = re.search(pat, text, re.IGNORECASE | re.MULTILINE)
+        m = search_pattern(pat, text, TEXT_PATTERN_FLAGS)
         if m:
             if m.groups():
                 return m.group(1), m
@@ -58,13 +222,13 @@ def build_cylinders(text: str, compose: Dict[str, Any]) -> Optional[str]:
     disp_val = None
     norm = compose.get("normalize", {})
     for pat in compose.get("cyl_from", []):
-        m = re.search(pat, text, re.IGNORECASE)
+        m = search_pattern(pat, text, COMPOSE_PATTERN_FLAGS)
         if m:
             cyl_val = m.group(1)
             cyl_val = norm.get(cyl_val, cyl_val)
             break
     for pat in compose.get("disp_from", []):
-        m = re.search(pat, text, re.IGNORECASE)
+        m = search_pattern(pat, text, COMPOSE_PATTERN_FLAGS)
         if m:
             disp_val = m.group(1)
             if not str(disp_val).lower().endswith("l"):
@@ -132,102 +296,71 @@ def collect_checkbox_states(text: str, checkbox_rules: Dict[str,Any]) -> List[st
         if not field:
             continue
         pats = r.get("match_any", [])
-        if any(re.search(pat, text, re.IGNORECASE | re.MULTILINE) for pat in pats):
+        if any(search_pattern(pat, text, CHECKBOX_PATTERN_FLAGS) for pat in pats):
             on.add(field)
     if (checkbox_rules or {}).get("prefer_4dr_over_2dr") and "4DR" in on and "2DR" in on:
         on.discard("2DR")
     return sorted(on)
 
-def fill_pdf(template: Path, text_fields: Dict[str,str], on_fields: List[str], output: Path, flatten: bool = True) -> None:
+def fill_pdf(template: Union[Path, bytes, PreparedTemplate], text_fields: Dict[str,str], on_fields: List[str], output: Path, flatten: bool = True, optimize: str = "none", linearize: bool = False) -> Dict[str, Any]:
+    """Fill and write the PDF; returns the optimization report (see bcif_optimize.optimize_file)"""
     try:
         # Try the standard approach first
-        r = PdfReader(str(template))
+        PdfReader, PdfWriter, NameObject, TextStringObject = pdf_backend()
+        # The API passes prepared (parsed once) templates; preloaded ones may arrive as bytes
+        if isinstance(template, PreparedTemplate):
+            pages, plan = template.pages, template.plan
+        else:
+            pages = PdfReader(io.BytesIO(template) if isinstance(template, bytes) else str(template)).pages
+            plan = fill_plan(pages)
         w = PdfWriter()
-        for p in r.pages:
+        for p in pages:
             w.add_page(p)
 
-        def set_state(annot, on=False):
+        annots = [page_annots(page) for page in w.pages]
+        on_fields = set(on_fields)
+        for pno, ano, fname, kind, on, off in plan:
             try:
-                ap = annot.get("/AP")
-                if not ap or not ap.get("/N"):
-                    return False
-                desired = None
-                for key in ap["/N"].keys():
-                    if on and "Off" not in str(key):
-                        desired = key; break
-                    if not on and "Off" in str(key):
-                        desired = key; break
-                if desired is None:
-                    return False
-                annot.update({NameObject("/AS"): desired})
-                annot.update({NameObject("/V"): desired})
-                return True
+                a = annots[pno][ano].get_object()
+                if kind == "checkbox":
+                    # Every checkbox is written, off unless asked for, so template defaults don't linger
+                    state = on if fname in on_fields and on is not None else off
+                    if state is not None:
+                        a.update({NameObject("/AS"): state, NameObject("/V"): state})
+                elif fname in text_fields:
+                    value = TextStringObject(text_fields[fname])
+                    a.update({NameObject("/V"): value, NameObject("/DV"): value})
             except Exception as e:
-                print(f"Warning: Could not set checkbox state: {e}")
-                return False
-
-        # First set ALL checkboxes OFF so template defaults don't linger
-        for page in w.pages:
-            if "/Annots" in page:
-                for a_ref in page["/Annots"]:
-                    try:
-                        a = a_ref.get_object()
-                        if a.get("/FT") == "/Btn":
-                            set_state(a, on=False)
-                    except Exception as e:
-                        print(f"Warning: Could not process checkbox: {e}")
-                        continue
-
-        # Turn on only desired checkboxes and write text fields
-        for page in w.pages:
-            if "/Annots" in page:
-                for a_ref in page["/Annots"]:
-                    try:
-                        a = a_ref.get_object()
-                        fname_obj = a.get("/T")
-                        fname = str(fname_obj).strip("()") if fname_obj else None
-                        ftype = a.get("/FT")
-
-                        if not fname:
-                            continue
-
-                        if ftype == "/Btn":
-                            if fname in on_fields:
-                                set_state(a, on=True)
-                        else:
-                            if fname in text_fields:
-                                try:
-                                    a.update({NameObject("/V"): TextStringObject(text_fields[fname])})
-                                    a.update({NameObject("/DV"): TextStringObject(text_fields[fname])})
-                                except Exception as e:
-                                    print(f"Warning: Could not set text field {fname}: {e}")
-                    except Exception as e:
-                        print(f"Warning: Could not process field: {e}")
-                        continue
+                log.warning("Could not set field %s: %s", fname, e)
+
+        # Shrink the output (dedupe) before writing
+        report = optimize_writer(w, optimize)
 
         # Try to write the PDF
         try:
             with open(output, "wb") as f:
                 w.write(f)
-            print(f"SUCCESS: Successfully wrote filled PDF to {output}")
+            optimize_file(output, optimize, linearize=linearize, report=report)
+            log.debug("Wrote filled PDF to %s", output)
+            return report
         except Exception as write_error:
-            print(f"ERROR: PDF write failed: {write_error}")
+            log.error("PDF write failed: %s", write_error)
             raise write_error
             
     except Exception as e:
-        print(f"ERROR: PDF filling completely failed: {e}")
-        print("INFO: Creating fallback summary PDF instead...")
+        log.error("PDF filling completely failed: %s", e)
+        log.info("Creating fallback summary PDF instead")
         
         # Fallback: Create a summary PDF with the extracted data
         create_fallback_summary_pdf(text_fields, on_fields, output)
+        return {"level": optimize, "applied": "none", "steps": [], "missing": [], "fallback_summary": True}
 
 def create_fallback_summary_pdf(text_fields: Dict[str,str], on_fields: List[str], output: Path) -> None:
     """Create a summary PDF when the template filling fails"""
     try:
         # Try to use reportlab for better PDF creation if available
         try:
-            from reportlab.pdfgen import canvas
-            from reportlab.lib.pagesizes import letter
+            canvas, letter = reportlab_backend()
             
             c = canvas.Canvas(str(output), pagesize=letter)
             width, height = letter
@@ -275,10 +408,10 @@ def create_fallback_summary_pdf(text_fields: Dict[str,str], on_fields: List[str]
                     y_pos -= 15
             
             c.save()
-            print(f"SUCCESS: Created fallback summary PDF: {output}")
+            log.info("Created fallback summary PDF: %s", output)
             
         except ImportError:
-            print("INFO: ReportLab not available, creating text summary...")
+            log.info("ReportLab not available, creating text summary")
             # Last resort: create a text file
             with open(output.with_suffix('.txt'), "w") as f:
                 f.write("CCC BCIF Extraction Results\n")
@@ -289,10 +422,10 @@ def create_fallback_summary_pdf(text_fields: Dict[str,str], on_fields: List[str]
                 f.write(f"\nSelected Options:\n")
                 for option in on_fields:
                     f.write(f"CHECKED: {option}\n")
-            print(f"SUCCESS: Created text summary: {output.with_suffix('.txt')}")
+            log.info("Created text summary: %s", output.with_suffix('.txt'))
     
     except Exception as fallback_error:
-        print(f"ERROR: Even fallback PDF creation failed: {fallback_error}")
+        log.error("Even fallback PDF creation failed: %s", fallback_error)
 
 def main():
     ap = argparse.ArgumentParser(description="Fill BCIF PDF using enhanced mapping JSON + estimate PDF")
@@ -302,7 +435,15 @@ def main():
     ap.add_argument("--output", required=True, help="Path to output filled PDF")
     ap.add_argument("--debug_json", default="", help="Optional path to write resolved field/checkbox debug JSON")
     ap.add_argument("--flatten", action="store_true", help="Flatten the output PDF")
+    ap.add_argument("--optimize", default=DEFAULT_OPTIMIZE_LEVEL, choices=list(OPTIMIZE_LEVELS), help="Output optimization level")
+    ap.add_argument("--linearize", action="store_true", help="Linearize the output for fast web view")
     args = ap.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s: %(message)s")
+    try:
+        pdf_backend()
+    except ImportError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
 
     estimate = Path(args.estimate)
     template = Path(args.template)
@@ -325,7 +466,7 @@ def main():
         with open(args.debug_json, "w") as f:
             json.dump(dbg, f, indent=2)
 
-    fill_pdf(template, text_fields, on_fields, output, flatten=args.flatten)
+    fill_pdf(template, text_fields, on_fields, output, flatten=args.flatten, optimize=args.optimize, linearize=args.linearize)
     print(f"Enhanced BCIF processing complete: {output}")
 
 if __name__ == "__main__":
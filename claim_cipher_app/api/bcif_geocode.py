@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+BCIF Geocoding
+Offline coordinates for claim addresses from the bundled US ZIP centroid
+table (data/us_zip_centroids.tsv.gz, or BCIF_GEOCODE_DATA). ZIPs are held
+in sorted typed arrays and city names in one sorted key list, so every
+lookup is a binary search: free-form addresses resolve in microseconds, to
+the ZIP centroid when the address has a ZIP and to the city's otherwise.
+"""
+
+import bisect
+import gzip
+import os
+import re
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+BASE_DIR = Path(__file__).parent.parent
+DATA_PATH = Path(os.environ.get('BCIF_GEOCODE_DATA', BASE_DIR / 'data' / 'us_zip_centroids.tsv.gz'))
+MAX_BATCH = int(os.environ.get('BCIF_GEOCODE_MAX_BATCH', 10000))
+
+STATE_NAMES = {
+    'alabama': 'AL', 'alaska': 'AK', 'arizona': 'AZ', 'arkansas': 'AR', 'california': 'CA',
+    'colorado': 'CO', 'connecticut': 'CT', 'delaware': 'DE', 'district of columbia': 'DC',
+    'florida': 'FL', 'georgia': 'GA', 'hawaii': 'HI', 'idaho': 'ID', 'illinois': 'IL',
+    'indiana': 'IN', 'iowa': 'IA', 'kansas': 'KS', 'kentucky': 'KY', 'louisiana': 'LA',
+    'maine': 'ME', 'maryland': 'MD', 'massachusetts': 'MA', 'michigan': 'MI', 'minnesota': 'MN',
+    'mississippi': 'MS', 'missouri': 'MO', 'montana': 'MT', 'nebraska': 'NE', 'nevada': 'NV',
+    'new hampshire': 'NH', 'new jersey': 'NJ', 'new mexico': 'NM', 'new york': 'NY',
+    'north carolina': 'NC', 'north dakota': 'ND', 'ohio': 'OH', 'oklahoma': 'OK', 'oregon': 'OR',
+    'pennsylvania': 'PA', 'rhode island': 'RI', 'south carolina': 'SC', 'south dakota': 'SD',
+    'tennessee': 'TN', 'texas': 'TX', 'utah': 'UT', 'vermont': 'VT', 'virginia': 'VA',
+    'washington': 'WA', 'west virginia': 'WV', 'wisconsin': 'WI', 'wyoming': 'WY',
+    'puerto rico': 'PR', 'guam': 'GU', 'virgin islands': 'VI',
+}
+STATE_CODES = set(STATE_NAMES.values()) | {'AS', 'MP', 'FM', 'MH', 'PW', 'AA', 'AE', 'AP'}
+
+COUNTRY_RE = re.compile(r'[\s,]*\b(?:USA?|U\.S\.A?\.?|United States(?: of America)?)\s*$', re.IGNORECASE)
+ZIP_RE = re.compile(r'(?:^|[\s,])(\d{5})(?:-\d{4})?\s*$')
+STATE_RE = re.compile(r'(?:^|(?P<sep>[\s,]))(?P<state>' + '|'.join(sorted(STATE_NAMES, key=len, reverse=True))
+                      + r'|[A-Za-z]{2})\.?\s*,?\s*$', re.IGNORECASE)
+# City names are compared lower-case, without punctuation and with the usual abbreviations
+ABBREVIATIONS = {'saint': 'st', 'sainte': 'ste', 'mount': 'mt', 'fort': 'ft', 'north': 'n', 'south': 's',
+                 'east': 'e', 'west': 'w'}
+MAX_CITY_WORDS = 4
+
+def normalize_city(name: str) -> str:
+    words = re.sub(r"[^a-z0-9 ]+", ' ', name.lower().replace("'", '')).split()
+    return ' '.join(ABBREVIATIONS.get(w, w) for w in words)
+
+class GeocodeIndex:
+    def __init__(self, path: Path = DATA_PATH):
+        self.path = Path(path)
+        self._zips = array('i')
+        self._zip_lat = array('f')
+        self._zip_lng = array('f')
+        self._zip_city = array('i')
+        # "<normalized city>|<state>" keys, sorted, with centroid arrays alongside
+        self._city_keys: List[str] = []
+        self._city_names: List[str] = []
+        self._city_lat = array('f')
+        self._city_lng = array('f')
+        self._city_zips = array('i')
+        self._states: Dict[str, tuple] = {}
+        self.loaded_at: Optional[float] = None
+        self.load_ms = 0.0
+
+    def load(self) -> 'GeocodeIndex':
+        started = time.perf_counter()
+        rows = []
+        raw = self.path.read_bytes()
+        if self.path.suffix == '.gz':
+            raw = gzip.decompress(raw)
+        for line in raw.decode('utf-8').splitlines():
+            if line.startswith('#') or not line.strip():
+                continue
+            zip_code, lat, lng, state, city, *aliases = line.split('\t')
+            rows.append((int(zip_code), float(lat), float(lng), state, city,
+                         aliases[0].split('|') if aliases and aliases[0] else []))
+        rows.sort(key=lambda row: row[0])
+
+        # City centroid = mean of its ZIP centroids; alternate names share them
+        cities: Dict[str, list] = {}
+        states: Dict[str, list] = {}
+        normalized: Dict[str, str] = {}  # most names repeat across ZIPs
+        primary = []
+        for zip_code, lat, lng, state, city, aliases in rows:
+            for name in [city] + aliases:
+                if name not in normalized:
+                    normalized[name] = normalize_city(name)
+                key = f'{normalized[name]}|{state}'
+                entry = cities.get(key)
+                if entry is None:
+                    entry = cities[key] = [name, 0.0, 0.0, 0]
+                entry[1] += lat
+                entry[2] += lng
+                entry[3] += 1
+            primary.append(f'{normalized[city]}|{state}')
+            total = states.setdefault(state, [0.0, 0.0, 0])
+            total[0] += lat
+            total[1] += lng
+            total[2] += 1
+
+        self._city_keys = sorted(cities)
+        position = {key: i for i, key in enumerate(self._city_keys)}
+        self._city_names = [cities[key][0] for key in self._city_keys]
+        self._city_lat = array('f', (cities[key][1] / cities[key][3] for key in self._city_keys))
+        self._city_lng = array('f', (cities[key][2] / cities[key][3] for key in self._city_keys))
+        self._city_zips = array('i', (cities[key][3] for key in self._city_keys))
+        self._zips = array('i', (row[0] for row in rows))
+        self._zip_lat = array('f', (row[1] for row in rows))
+        self._zip_lng = array('f', (row[2] for row in rows))
+        self._zip_city = array('i', (position[key] for key in primary))
+        self._states = {state: (t[0] / t[2], t[1] / t[2]) for state, t in states.items()}
+        self.loaded_at = time.time()
+        self.load_ms = round((time.perf_counter() - started) * 1000, 1)
+        return self
+
+    # ---------- Lookups ----------
+
+    def zip(self, code: str) -> Optional[Dict[str, Any]]:
+        """Centroid of a 5-digit ZIP"""
+        if not (len(code) == 5 and code.isdigit()):
+            return None
+        k = bisect.bisect_left(self._zips, int(code))
+        if k == len(self._zips) or self._zips[k] != int(code):
+            return None
+        c = self._zip_city[k]
+        return _location(self._zip_lat[k], self._zip_lng[k], 'zip', zip=code,
+                         city=self._city_names[c], state=self._city_keys[c].rpartition('|')[2])
+
+    def zip_prefix(self, prefix: str) -> Optional[Dict[str, Any]]:
+        """Mean centroid of every ZIP starting with a 1-5 digit prefix (e.g. a ZIP3 area)"""
+        if not (1 <= len(prefix) <= 5 and prefix.isdigit()):
+            return None
+        scale = 10 ** (5 - len(prefix))
+        lo = bisect.bisect_left(self._zips, int(prefix) * scale)
+        hi = bisect.bisect_left(self._zips, (int(prefix) + 1) * scale)
+        if lo == hi:
+            return None
+        lat = sum(self._zip_lat[lo:hi]) / (hi - lo)
+        lng = sum(self._zip_lng[lo:hi]) / (hi - lo)
+        return _location(lat, lng, f'zip{len(prefix)}' if len(prefix) < 5 else 'zip', zip=prefix)
+
+    def city(self, name: str, state: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """City centroid; without a state, the city of that name with the most ZIPs"""
+        key = normalize_city(name)
+        if not key:
+            return None
+        if state:
+            k = bisect.bisect_left(self._city_keys, f'{key}|{state}')
+            if k == len(self._city_keys) or self._city_keys[k] != f'{key}|{state}':
+                return None
+        else:
+            lo = bisect.bisect_left(self._city_keys, f'{key}|')
+            hi = bisect.bisect_left(self._city_keys, f'{key}}}')  # '}' sorts right after '|'
+            if lo == hi:
+                return None
+            k = max(range(lo, hi), key=self._city_zips.__getitem__)
+        return _location(self._city_lat[k], self._city_lng[k], 'city',
+                         city=self._city_names[k], state=self._city_keys[k].rpartition('|')[2])
+
+    def cities(self, prefix: str, state: Optional[str] = None, limit: int = 10) -> List[Dict[str, Any]]:
+        """Cities whose name starts with prefix (autocomplete), largest first"""
+        key = normalize_city(prefix)
+        if not key:
+            return []
+        lo = bisect.bisect_left(self._city_keys, key)
+        hi = bisect.bisect_left(self._city_keys, key + '￿')
+        matches = [k for k in range(lo, hi) if state is None or self._city_keys[k].endswith(f'|{state}')]
+        matches.sort(key=lambda k: -self._city_zips[k])
+        return [_location(self._city_lat[k], self._city_lng[k], 'city', city=self._city_names[k],
+                          state=self._city_keys[k].rpartition('|')[2]) for k in matches[:limit]]
+
+    def state(self, code: str) -> Optional[Dict[str, Any]]:
+        centroid = self._states.get(code)
+        return _location(*centroid, 'state', state=code) if centroid else None
+
+    # ---------- Free-form addresses ----------
+
+    def parse(self, address: str) -> Dict[str, Optional[str]]:
+        """Split "street, city, ST 12345" (commas optional) into zip, state and the text before them"""
+        text = COUNTRY_RE.sub('', address.strip())
+        zip_code = state = None
+        if m := ZIP_RE.search(text):
+            zip_code, text = m.group(1), text[:m.start()].rstrip(' ,')
+        if m := STATE_RE.search(text):
+            token = m.group('state')
+            code = STATE_NAMES.get(token.lower()) or token.upper()
+            # "Oak Ct" is a street; "Oak Ct, CT" or "CT 06103" is a state
+            if code in STATE_CODES and (len(token) > 2 or token.isupper() or zip_code or m.group('sep') == ','):
+                state, text = code, text[:m.start()].rstrip(' ,')
+        return {'zip': zip_code, 'state': state, 'rest': text}
+
+    def geocode(self, address: str) -> Optional[Dict[str, Any]]:
+        """Best coordinates for a free-form address: ZIP, then city, then ZIP3 area, then state"""
+        if not isinstance(address, str) or not address.strip():
+            return None
+        parsed = self.parse(address)
+        if parsed['zip'] and (found := self.zip(parsed['zip'])):
+            return found
+        if found := self._city_in(parsed['rest'], parsed['state']):
+            return found
+        if parsed['zip'] and (found := self.zip_prefix(parsed['zip'][:3])):
+            return found
+        return self.state(parsed['state']) if parsed['state'] else None
+
+    def _city_in(self, text: str, state: Optional[str]) -> Optional[Dict[str, Any]]:
+        """The city is the last comma part, or else the longest known run of trailing words"""
+        parts = [p.strip() for p in text.split(',') if p.strip()]
+        if not parts:
+            return None
+        if len(parts) > 1 and not parts[-1][0].isdigit() and (found := self.city(parts[-1], state)):
+            return found
+        words = parts[-1].split()
+        for n in range(min(MAX_CITY_WORDS, len(words)), 0, -1):
+            if found := self.city(' '.join(words[-n:]), state):
+                return found
+        return None
+
+    def locate(self, point: Any, label: str) -> Dict[str, Any]:
+        """A {lat, lng} point as-is, or a copy of an {address} point (or bare string) with coordinates added"""
+        if isinstance(point, str):
+            point = {'address': point}
+        if not isinstance(point, dict):
+            raise ValueError(f'{label} must be an object with lat and lng or an address')
+        if point.get('lat') is not None and point.get('lng') is not None:
+            return point
+        address = point.get('address')
+        if not address:
+            raise ValueError(f'{label} needs lat and lng or an address')
+        found = self.geocode(address)
+        if found is None:
+            raise ValueError(f'{label}: no coordinates found for {address!r}')
+        return dict(point, lat=found['lat'], lng=found['lng'], geocode_precision=found['precision'])
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'path': str(self.path),
+            'zip_count': len(self._zips),
+            'city_count': len(self._city_keys),
+            'state_count': len(self._states),
+            'loaded_at': self.loaded_at,
+            'load_ms': self.load_ms,
+        }
+
+def _location(lat: float, lng: float, precision: str, **fields) -> Dict[str, Any]:
+    return dict(lat=round(lat, 4), lng=round(lng, 4), precision=precision, **fields)
+
+_index: Optional[GeocodeIndex] = None
+_index_lock = threading.Lock()
+
+def default_index() -> GeocodeIndex:
+    """The process-wide index, loaded from DATA_PATH on first use"""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = GeocodeIndex().load()
+    return _index
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+BCIF Job Queue
+Durable SQLite-backed queue for long extract/fill work. The HTTP tier only
+writes a row and returns an id; a dispatcher thread claims queued rows and
+runs them in a process pool with bounded concurrency, retrying failures with
+backoff and expiring finished results after a TTL.
+
+Every API process runs its own dispatcher and pool (under gunicorn, each
+worker starts one in post_fork), so up to workers x BCIF_JOB_WORKERS jobs run
+at once. Claims are compare-and-set, and a claimed job carries a lease
+(BCIF_JOB_LEASE seconds) that its dispatcher renews while the job runs. When
+a process dies (a max-requests recycle, a crash) its leases lapse, and the
+next pass of any dispatcher puts those jobs back in the queue. A job still
+running after BCIF_JOB_TIMEOUT seconds is taken to be hung: it fails, and
+the pool is replaced so its process is freed (other jobs running in that
+pool are retried).
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, Set
+
+from bcif_progress import ProgressStore, NULL_TRACKER
+
+log = logging.getLogger('bcif.jobs')
+
+DEFAULT_WORKERS = int(os.environ.get('BCIF_JOB_WORKERS', 2))
+DEFAULT_MAX_PENDING = int(os.environ.get('BCIF_JOB_MAX_PENDING', 200))
+DEFAULT_MAX_ATTEMPTS = int(os.environ.get('BCIF_JOB_MAX_ATTEMPTS', 3))
+DEFAULT_RESULT_TTL = float(os.environ.get('BCIF_JOB_RESULT_TTL', 3600))
+LEASE = float(os.environ.get('BCIF_JOB_LEASE', 30))
+DEFAULT_TIMEOUT = float(os.environ.get('BCIF_JOB_TIMEOUT', 600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    template_name TEXT NOT NULL,
+    optimize TEXT NOT NULL,
+    linearize INTEGER NOT NULL DEFAULT 0,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after REAL NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+"""
+
+# ---------- Worker side (runs inside the process pool) ----------
+
+_worker_templates = None
+_worker_metrics = None
+_worker_warmup = None
+
+def _worker_registry():
+    """One registry per pool process: compiled mappings plus parsed templates kept across jobs"""
+    global _worker_templates
+    if _worker_templates is None:
+        from bcif_config import ConfigManager
+        from bcif_templates import TemplateRegistry
+        config = ConfigManager(poll_interval=0)
+        config.preload_templates()
+        _worker_templates = TemplateRegistry(config)
+    return _worker_templates
+
+def init_worker() -> None:
+    """Pool initializer: import the PDF backends and run a synthetic fill before the first job arrives"""
+    global _worker_warmup
+    import tempfile
+    from bcif_fill_enhanced import preload_backends
+    from bcif_warmup import Warmup
+    preload_backends()
+    _worker_warmup = Warmup(_worker_registry(), Path(tempfile.gettempdir()))
+    _worker_warmup.run()  # a failure is logged; jobs then report their own errors
+
+def warmup_state() -> Dict[str, Any]:
+    """Warm-up result of the pool process that runs this (its initializer has finished by then)"""
+    state = _worker_warmup.describe() if _worker_warmup else {'state': 'cold'}
+    return dict(state, pid=os.getpid())
+
+def run_job(kind: str, input_path: Optional[str], template_name: str, optimize: str, linearize: bool, output_path: str,
+            metrics_dir: Optional[str] = None, endpoint: str = '/jobs', text: Optional[str] = None,
+            progress_dir: Optional[str] = None, progress_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Extract (when the input is a PDF) and fill one job. Returns a small JSON-able summary.
+    A 'fill' job reads its text from input_path unless the text is passed directly.
+    With progress_dir, stage and page progress is recorded under progress_id.
+    """
+    global _worker_metrics
+    from bcif_fill_enhanced import extract_text, apply_text_mapping, apply_post_processing, collect_checkbox_states, fill_pdf
+    from bcif_metrics import Metrics
+
+    # Compiled mappings are refreshed if their file changed
+    registry = _worker_registry()
+    manager = registry.manager_for(template_name)
+    if manager.current is None:
+        manager.load()
+    else:
+        manager.reload_if_changed()
+    mapping = manager.current
+    if _worker_metrics is None:
+        # Flushed after every job rather than by a thread
+        _worker_metrics = Metrics(metrics_dir, flush_interval=0)
+    rm = _worker_metrics.request(endpoint, template_name, mapping.sha256[:12])
+    progress = ProgressStore(progress_dir).tracker(progress_id, resume=True) if progress_dir else NULL_TRACKER
+
+    status = 500
+    try:
+        progress.stage('running', pid=os.getpid())
+        template = registry.prepared(template_name)
+
+        with rm.stage('extract'):
+            if kind == 'extract_and_fill':
+                progress.stage('extracting')
+                text = extract_text(Path(input_path), on_page=progress.pages)
+            elif text is None:
+                text = Path(input_path).read_text(encoding='utf-8')
+
+        progress.stage('mapping')
+        with rm.stage('mapping'):
+            text_fields = apply_text_mapping(text, mapping.text_fields)
+            apply_post_processing(text_fields, mapping.post_processing)
+        with rm.stage('checkboxes'):
+            checkbox_fields = collect_checkbox_states(text, mapping.checkbox_rules)
+        progress.stage('filling')
+        with rm.stage('fill'):
+            optimized = fill_pdf(template, text_fields, checkbox_fields, Path(output_path), optimize=optimize,
+                                 linearize=linearize)
+
+        if not Path(output_path).exists():
+            raise RuntimeError('Fill produced no PDF output')
+        status = 200
+    finally:
+        rm.finish(status)
+        _worker_metrics.flush()
+    return {
+        'claim_number': text_fields.get('Claim Number'),
+        'field_count': len(text_fields),
+        'checkbox_count': len(checkbox_fields),
+        'mapping_version': mapping.sha256[:12],
+        'optimize': optimized,
+    }
+
+# ---------- Queue side (runs in the API process) ----------
+
+class JobQueue:
+    def __init__(self, folder: Path, workers: int = DEFAULT_WORKERS, max_pending: int = DEFAULT_MAX_PENDING,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, result_ttl: float = DEFAULT_RESULT_TTL,
+                 metrics_dir: Optional[Path] = None, progress: Optional[ProgressStore] = None,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.folder = Path(folder)
+        self.metrics_dir = str(metrics_dir) if metrics_dir else None
+        self.progress = progress
+        self.folder.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.folder / 'jobs.sqlite3'
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.max_attempts = max(1, max_attempts)
+        self.result_ttl = result_ttl
+        self.timeout = timeout
+        self._pool = None  # ProcessPoolExecutor, created by start()
+        self._running: Dict[str, Any] = {}
+        self._started: Dict[str, float] = {}  # job id -> monotonic time submitted
+        self._timed_out: Set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.owner = self._new_owner()
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            columns = {row['name'] for row in db.execute("PRAGMA table_info(jobs)")}
+            for column, kind in (('owner', 'TEXT'), ('lease_expires', 'REAL')):
+                if column not in columns:  # queues created before leases
+                    db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+
+    @contextmanager
+    def _connect(self):
+        # Autocommit connection per operation; safe across request and pool callback threads
+        db = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        try:
+            yield db
+        finally:
+            db.close()
+
+    # ----- HTTP-facing API -----
+
+    def pending_count(self) -> int:
+        with self._connect() as db:
+            return db.execute("SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')").fetchone()[0]
+
+    def enqueue(self, kind: str, input_path: Path, template_name: str, optimize: str, linearize: bool) -> str:
+        """Persist a job and wake the dispatcher. Raises OverflowError when the queue is full."""
+        if self.pending_count() >= self.max_pending:
+            raise OverflowError(f'Job queue full ({self.max_pending} pending)')
+        job_id = os.urandom(8).hex()
+        now = time.time()
+        with self._connect() as db:
+            db.execute(
+                "INSERT INTO jobs (id, kind, status, template_name, optimize, linearize, input_path, output_path,"
+                " max_attempts, run_after, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, template_name, optimize, int(linearize), str(input_path),
+                 str(self.folder / f'job_{job_id}.pdf'), self.max_attempts, now, now, now),
+            )
+        self._tracker(job_id).stage('queued')
+        self.start()
+        self._wake.set()
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._connect() as db:
+            row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as db:
+            counts = dict(db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        return {'workers': self.workers, 'in_flight': len(self._running), 'max_pending': self.max_pending, 'jobs': counts}
+
+    def _tracker(self, job_id: str, resume: bool = False):
+        return self.progress.tracker(job_id, resume) if self.progress else NULL_TRACKER
+
+    # ----- Dispatcher -----
+
+    def start(self) -> None:
+        """Start the dispatcher thread and process pool (idempotent, call after fork)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self.owner = self._new_owner()  # forked workers must not share the parent's leases
+            self._pool = self._new_pool()
+            self._running = {}
+            self._started = {}
+            self._timed_out = set()
+            self._thread = threading.Thread(target=self._dispatch_loop, name='bcif-job-dispatcher', daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _new_owner() -> str:
+        # The random part tells a recycled pid apart
+        return f'{socket.gethostname()}:{os.getpid()}:{os.urandom(4).hex()}'
+
+    def _new_pool(self):
+        # Imported here: API processes that never run a job don't pay for it
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # spawn: forking a threaded server process can deadlock the child
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_worker)
+
+    def _dispatch_loop(self) -> None:
+        last_sweep = last_renew = 0.0
+        while True:
+            self._wake.wait(timeout=1.0)
+            self._wake.clear()
+            try:
+                if time.time() - last_renew > LEASE / 3:
+                    self._renew_leases()
+                    last_renew = time.time()
+                self._requeue_expired()
+                self._fail_hung()
+                while len(self._running) < self.workers and self._claim_next():
+                    pass
+                if time.time() - last_sweep > 60:
+                    self.expire_results()
+                    last_sweep = time.time()
+            except Exception:
+                # Keep dispatching; the failed claim is retried on the next wake-up
+                log.exception('Job dispatcher error')
+
+    def _renew_leases(self) -> None:
+        """Extend the lease of every job this dispatcher is running"""
+        if self._running:
+            now = time.time()
+            with self._connect() as db:
+                db.execute("UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE owner = ? AND status = 'running'",
+                           (now + LEASE, now, self.owner))
+
+    def _requeue_expired(self) -> None:
+        """Jobs whose dispatcher stopped renewing (its process died) go back to the queue, or fail when out of attempts"""
+        now = time.time()
+        # Rows from before leases existed expire LEASE seconds after their last update
+        expired = "status = 'running' AND COALESCE(lease_expires, updated_at + ?) < ?"
+        with self._connect() as db:
+            rows = db.execute(f"SELECT * FROM jobs WHERE {expired}", (LEASE, now)).fetchall()
+            if not rows:
+                return
+            requeued = db.execute(
+                f"UPDATE jobs SET status = 'queued', owner = NULL, lease_expires = NULL, run_after = ?, updated_at = ?"
+                f" WHERE {expired} AND attempts < max_attempts", (now, now, LEASE, now)).rowcount
+            db.execute(
+                f"UPDATE jobs SET status = 'failed', error = 'Lease expired: the process running it stopped',"
+                f" owner = NULL, lease_expires = NULL, finished_at = ?, updated_at = ? WHERE {expired}",
+                (now, now, LEASE, now))
+        log.warning('Jobs lost their lease', extra={'data': {'jobs': [row['id'] for row in rows], 'requeued': requeued}})
+        for row in rows:
+            if row['attempts'] < row['max_attempts']:
+                self._tracker(row['id'], resume=True).stage('queued', error='lease expired')
+            else:
+                self._remove_input(dict(row))
+                self._tracker(row['id'], resume=True).failed('Lease expired: the process running it stopped')
+
+    def _fail_hung(self) -> None:
+        """
+        Fail jobs running past the timeout. A pool process can't be stopped on
+        its own, so the whole pool is replaced: the hung job fails, and any
+        other job it was running fails over to its normal retry.
+        """
+        now = time.monotonic()
+        hung = [job_id for job_id, started in list(self._started.items())
+                if now - started > self.timeout and self._running.get(job_id) is not None]
+        if not hung:
+            return
+        log.warning('Jobs timed out, restarting the job process pool',
+                    extra={'data': {'jobs': hung, 'timeout_seconds': self.timeout}})
+        self._timed_out.update(hung)
+        pool, self._pool = self._pool, self._new_pool()
+        for process in list((getattr(pool, '_processes', None) or {}).values()):
+            process.terminate()  # their futures then fail with BrokenProcessPool and reach _finish
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _claim_next(self) -> bool:
+        now = time.time()
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' AND run_after <= ? ORDER BY run_after LIMIT 1", (now,)
+            ).fetchone()
+            if row is None:
+                return False
+            # Compare-and-set so two dispatchers (one per API worker) never run the same job
+            claimed = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, lease_expires = ?, updated_at = ?"
+                " WHERE id = ? AND status = 'queued'",
+                (self.owner, now + LEASE, now, row['id']),
+            ).rowcount
+        if not claimed:
+            return True
+        # Reserve the slot before submitting; the done callback may fire immediately
+        self._running[row['id']] = None
+        args = (row['kind'], row['input_path'], row['template_name'], row['optimize'], bool(row['linearize']),
+                row['output_path'], self.metrics_dir)
+        kwargs = {'progress_dir': str(self.progress.directory) if self.progress else None, 'progress_id': row['id']}
+        from concurrent.futures.process import BrokenProcessPool
+        try:
+            future = self._pool.submit(run_job, *args, **kwargs)
+        except BrokenProcessPool:
+            # A worker process died (e.g. OOM kill); replace the pool and carry on
+            log.warning('Job process pool broken, restarting it')
+            self._pool = self._new_pool()
+            future = self._pool.submit(run_job, *args, **kwargs)
+        self._running[row['id']] = future
+        self._started[row['id']] = time.monotonic()
+        future.add_done_callback(lambda f, job_id=row['id']: self._finish(job_id, f))
+        return True
+
+    def _finish(self, job_id: str, future) -> None:
+        self._running.pop(job_id, None)
+        self._started.pop(job_id, None)
+        timed_out = job_id in self._timed_out
+        self._timed_out.discard(job_id)
+        now = time.time()
+        job = self.get(job_id)
+        if job is None or job['owner'] != self.owner:
+            # The lease lapsed and another dispatcher took the job over; its run decides the outcome
+            log.warning('Job finished after losing its lease', extra={'data': {'job_id': job_id}})
+            self._wake.set()
+            return
+        # Compare-and-set on the owner, like the claim
+        mine = "id = ? AND owner = ?"
+        try:
+            if timed_out:
+                raise TimeoutError(f'Job ran longer than {self.timeout:g} s')
+            result = future.result()
+        except Exception as e:
+            error = f'{type(e).__name__}: {e}'
+            with self._connect() as db:
+                # A hung job would hang again: no retry
+                if job['attempts'] < job['max_attempts'] and not timed_out:
+                    backoff = 2 ** job['attempts']
+                    db.execute("UPDATE jobs SET status = 'queued', error = ?, run_after = ?, owner = NULL,"
+                               f" lease_expires = NULL, updated_at = ? WHERE {mine}",
+                               (error, now + backoff, now, job_id, self.owner))
+                    self._tracker(job_id, resume=True).stage('queued', error=error, retry_in=backoff)
+                else:
+                    db.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, owner = NULL,"
+                               f" lease_expires = NULL, updated_at = ? WHERE {mine}",
+                               (error, now, now, job_id, self.owner))
+                    self._remove_input(job)
+                    self._tracker(job_id, resume=True).failed(error)
+        else:
+            with self._connect() as db:
+                db.execute("UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, owner = NULL,"
+                           f" lease_expires = NULL, updated_at = ? WHERE {mine}",
+                           (json.dumps(result), now, now, job_id, self.owner))
+            self._remove_input(job)
+            self._tracker(job_id, resume=True).done(result=result)
+        self._wake.set()
+
+    def _remove_input(self, job: Optional[Dict[str, Any]]) -> None:
+        if job:
+            Path(job['input_path']).unlink(missing_ok=True)
+
+    def expire_results(self) -> int:
+        """Delete finished jobs (and their files) older than the result TTL"""
+        cutoff = time.time() - self.result_ttl
+        with self._connect() as db:
+            rows = db.execute("SELECT id, input_path, output_path FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?",
+                              (cutoff,)).fetchall()
+            for row in rows:
+                Path(row['input_path']).unlink(missing_ok=True)
+                Path(row['output_path']).unlink(missing_ok=True)
+            db.execute("DELETE FROM jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (cutoff,))
+        return len(rows)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+BCIF Structured Logging
+JSON log records carrying the request id, written through a bounded queue by
+a listener thread so request threads never wait on stdout. Estimate text and
+resolved field values are PII: they are only logged at DEBUG level and only
+for the sampled fraction of requests (BCIF_LOG_PAYLOAD_SAMPLE, default 0).
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from typing import Optional
+
+DEFAULT_LEVEL = os.environ.get('BCIF_LOG_LEVEL', 'INFO').upper()
+DEFAULT_PAYLOAD_SAMPLE = float(os.environ.get('BCIF_LOG_PAYLOAD_SAMPLE', 0))
+DEFAULT_QUEUE_SIZE = int(os.environ.get('BCIF_LOG_QUEUE_SIZE', 10000))
+
+request_id_var: contextvars.ContextVar = contextvars.ContextVar('bcif_request_id', default=None)
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from extra={'data': {...}}"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process,
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        data = getattr(record, 'data', None)
+        if data:
+            entry.update(data)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops (and counts) records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Capture the request id on the request thread; the listener runs elsewhere
+        record.request_id = request_id_var.get()
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class LoggingSetup:
+    def __init__(self):
+        self.handler: Optional[DroppingQueueHandler] = None
+        self.listener: Optional[logging.handlers.QueueListener] = None
+        self.payload_sample = DEFAULT_PAYLOAD_SAMPLE
+
+    def configure(self, level: str = DEFAULT_LEVEL, payload_sample: float = DEFAULT_PAYLOAD_SAMPLE,
+                  queue_size: int = DEFAULT_QUEUE_SIZE) -> None:
+        """Route the 'bcif' logger hierarchy through the async JSON handler (idempotent)"""
+        self.payload_sample = payload_sample
+        logger = logging.getLogger('bcif')
+        logger.setLevel(level)
+        if self.handler is None:
+            self.handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+            logger.addHandler(self.handler)
+            logger.propagate = False
+        self.start()
+
+    def start(self) -> None:
+        """Start the listener thread (call again in each worker after fork)"""
+        if self.handler is None or self.listener is not None:
+            return
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(JsonFormatter())
+        self.listener = logging.handlers.QueueListener(self.handler.queue, stream, respect_handler_level=False)
+        self.listener.start()
+
+    def stop(self) -> None:
+        """Flush queued records and stop the listener (before fork / at exit)"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def sample_payload(self) -> bool:
+        """Whether this request's verbose (PII) payload may be logged"""
+        return self.payload_sample > 0 and random.random() < self.payload_sample
+
+logging_setup = LoggingSetup()
+
+def new_request_id() -> str:
+    return os.urandom(8).hex()
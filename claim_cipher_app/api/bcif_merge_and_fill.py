@@ -1,8 +1,6 @@
 import re, json, sys, argparse, time
 from pathlib import Path
 from typing import Dict, Any, List, Optional, Tuple
-from PyPDF2 import PdfReader, PdfWriter
-from PyPDF2.generic import NameObject, TextStringObject
 
 # ----------------- Merge helpers -----------------
 
@@ -105,6 +103,7 @@ def deep_merge_mappings(base: Dict[str, Any], patch: Dict[str, Any]) -> Dict[str
 # ----------------- Parsing helpers -----------------
 
 def extract_text(pdf_path: Path) -> str:
+    from PyPDF2 import PdfReader  # imported here so --merge_only never loads PyPDF2
     text = ""
     r = PdfReader(str(pdf_path))
     for p in r.pages:
@@ -213,6 +212,8 @@ def collect_checkbox_states(text: str, checkbox_rules: Dict[str,Any]) -> List[st
 # ----------------- PDF filler -----------------
 
 def fill_pdf(template: Path, text_fields: Dict[str,str], on_fields: List[str], output: Path) -> None:
+    from PyPDF2 import PdfReader, PdfWriter
+    from PyPDF2.generic import NameObject, TextStringObject
     r = PdfReader(str(template))
     w = PdfWriter()
     for p in r.pages:
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+BCIF Pipeline Metrics
+Per-stage latency histograms and request counters, rendered at /metrics in
+the Prometheus text exposition format. Each process keeps its own registry
+and periodically writes a snapshot to a shared directory; /metrics merges
+every snapshot so the numbers cover all workers. Recording a stage is a
+perf_counter pair, a bisect and an uncontended lock (a few microseconds).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+from typing import Dict, Any, Tuple, Optional, Callable, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: single process, no compaction needed
+    fcntl = None
+
+log = logging.getLogger('bcif.metrics')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+DEFAULT_FLUSH_SECONDS = float(os.environ.get('BCIF_METRICS_FLUSH_SECONDS', 5))
+
+STAGE_LABELS = ('stage', 'endpoint', 'template', 'mapping_version')
+REQUEST_LABELS = ('endpoint', 'status')
+
+class _Stage:
+    __slots__ = ('request', 'name', 'start')
+
+    def __init__(self, request, name):
+        self.request = request
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.request.record(self.name, time.perf_counter() - self.start)
+        return False
+
+class RequestMetrics:
+    """Labels for one request; stage() times a block under those labels"""
+    __slots__ = ('metrics', 'endpoint', 'template', 'mapping_version', 'started', 'timings')
+
+    def __init__(self, metrics, endpoint: str, template: str = '', mapping_version: str = ''):
+        self.metrics = metrics
+        self.endpoint = endpoint
+        self.template = template
+        self.mapping_version = mapping_version
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        self.timings[name] = seconds
+        self.metrics.observe((name, self.endpoint, self.template, self.mapping_version), seconds)
+
+    def finish(self, status: int) -> None:
+        """Count the request and record its total time as the 'total' stage"""
+        self.record('total', time.perf_counter() - self.started)
+        self.metrics.inc((self.endpoint, str(status)))
+
+class Metrics:
+    def __init__(self, directory: Optional[Path] = None, buckets=DEFAULT_BUCKETS, flush_interval: float = DEFAULT_FLUSH_SECONDS):
+        self.buckets = tuple(buckets)
+        self.directory = Path(directory) if directory else None
+        self.flush_interval = flush_interval
+        self._hist: Dict[Tuple, list] = {}
+        self._requests: Dict[Tuple, int] = {}
+        self._gauges: List[Callable[[], List[Tuple[str, str, Dict[str, str], float]]]] = []
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    # ---------- Recording ----------
+
+    def request(self, endpoint: str, template: str = '', mapping_version: str = '') -> RequestMetrics:
+        return RequestMetrics(self, endpoint, template, mapping_version)
+
+    def observe(self, key: Tuple, seconds: float) -> None:
+        i = bisect_left(self.buckets, seconds)
+        with self._lock:
+            h = self._hist.get(key)
+            if h is None:
+                h = self._hist[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][i] += 1
+            h[1] += seconds
+            h[2] += 1
+            self._dirty = True
+
+    def inc(self, key: Tuple, amount: int = 1) -> None:
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + amount
+            self._dirty = True
+
+    def add_gauge_source(self, source: Callable[[], List[Tuple[str, str, Dict[str, str], float]]]) -> None:
+        """Register a callable returning (name, help, labels, value) gauges, evaluated at scrape time"""
+        self._gauges.append(source)
+
+    # ---------- Cross-process sharing ----------
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'buckets': list(self.buckets),
+                'hist': [[list(k), list(v[0]), v[1], v[2]] for k, v in self._hist.items()],
+                'requests': [[list(k), v] for k, v in self._requests.items()],
+            }
+
+    def _own_file(self) -> Path:
+        return self.directory / f'worker_{os.getpid()}.json'
+
+    def flush(self) -> None:
+        """Write this process's snapshot for other workers' /metrics to merge"""
+        if not self.directory:
+            return
+        self._dirty = False
+        path = self._own_file()
+        tmp = path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(self.snapshot()))
+        tmp.replace(path)
+
+    def compact(self) -> None:
+        """Fold this process's snapshot into the shared archive and drop its file (on worker exit)"""
+        if not self.directory or fcntl is None:
+            return self.flush()
+        lock_path = self.directory / 'archive.lock'
+        with open(lock_path, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive_path = self.directory / 'archive.json'
+            archive = json.loads(archive_path.read_text()) if archive_path.exists() else None
+            merged = merge_snapshots([s for s in (archive, self.snapshot()) if s])
+            tmp = archive_path.with_suffix('.tmp')
+            tmp.write_text(json.dumps(merged))
+            tmp.replace(archive_path)
+            self._own_file().unlink(missing_ok=True)
+            with self._lock:
+                self._hist.clear()
+                self._requests.clear()
+
+    def reset_directory(self) -> None:
+        """Clear snapshots left by a previous server run (call once, in the master)"""
+        if not self.directory:
+            return
+        for path in self.directory.glob('*.json'):
+            path.unlink(missing_ok=True)
+
+    def collect(self) -> Dict[str, Any]:
+        """Merge the live registry with every other process's latest snapshot"""
+        snapshots = [self.snapshot()]
+        if self.directory:
+            own = self._own_file().name
+            for path in self.directory.glob('*.json'):
+                if path.name == own:
+                    continue
+                try:
+                    snapshots.append(json.loads(path.read_text()))
+                except (OSError, ValueError):
+                    continue  # being replaced or removed right now
+        return merge_snapshots(snapshots)
+
+    def start_flusher(self) -> None:
+        if not self.directory or self.flush_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._flush_loop, name='bcif-metrics-flusher', daemon=True)
+        self._thread.start()
+
+    def stop_flusher(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            if self._dirty:
+                try:
+                    self.flush()
+                except OSError as e:
+                    log.warning('Metrics flush failed: %s', e)
+
+    # ---------- Exposition ----------
+
+    def render(self) -> str:
+        merged = self.collect()
+        buckets = merged['buckets']
+        lines = [
+            '# HELP bcif_stage_duration_seconds Time spent in each BCIF pipeline stage',
+            '# TYPE bcif_stage_duration_seconds histogram',
+        ]
+        for key, counts, total, count in sorted(merged['hist'], key=lambda h: h[0]):
+            labels = _labels(dict(zip(STAGE_LABELS, key)))
+            cumulative = 0
+            for bound, n in zip(buckets + ['+Inf'], counts):
+                cumulative += n
+                le = bound if bound == '+Inf' else repr(float(bound))
+                lines.append(f'bcif_stage_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'bcif_stage_duration_seconds_sum{{{labels}}} {total}')
+            lines.append(f'bcif_stage_duration_seconds_count{{{labels}}} {count}')
+
+        lines += ['# HELP bcif_requests_total Requests handled, by endpoint and HTTP status',
+                  '# TYPE bcif_requests_total counter']
+        for key, value in sorted(merged['requests']):
+            lines.append(f'bcif_requests_total{{{_labels(dict(zip(REQUEST_LABELS, key)))}}} {value}')
+
+        seen = set()
+        for source in self._gauges:
+            try:
+                gauges = source()
+            except Exception:
+                continue
+            for name, help_text, labels, value in gauges:
+                if name not in seen:
+                    lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge']
+                    seen.add(name)
+                label_str = f'{{{_labels(labels)}}}' if labels else ''
+                lines.append(f'{name}{label_str} {value}')
+        return '\n'.join(lines) + '\n'
+
+def merge_snapshots(snapshots: List[Dict[str, Any]]) -> Dict[str, Any]:
+    hist: Dict[Tuple, list] = {}
+    requests: Dict[Tuple, int] = {}
+    buckets = snapshots[0]['buckets'] if snapshots else list(DEFAULT_BUCKETS)
+    for snap in snapshots:
+        if snap.get('buckets') != buckets:
+            continue  # written by a build with different buckets
+        for key, counts, total, count in snap['hist']:
+            h = hist.setdefault(tuple(key), [[0] * len(counts), 0.0, 0])
+            h[0] = [a + b for a, b in zip(h[0], counts)]
+            h[1] += total
+            h[2] += count
+        for key, value in snap['requests']:
+            requests[tuple(key)] = requests.get(tuple(key), 0) + value
+    return {
+        'buckets': buckets,
+        'hist': [[list(k), v[0], v[1], v[2]] for k, v in hist.items()],
+        'requests': [[list(k), v] for k, v in requests.items()],
+    }
+
+def _labels(labels: Dict[str, str]) -> str:
+    def esc(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return ','.join(f'{k}="{esc(v)}"' for k, v in labels.items())
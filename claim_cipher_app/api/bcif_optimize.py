@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+BCIF Output Optimization
+Shrinks filled BCIF PDFs after fill_pdf: dedupes identical objects (pypdf),
+compresses streams left uncompressed and (at the max level) packs objects
+into object streams (pikepdf, or the qpdf command line tool). Can also
+linearize the output ("fast web view") so viewers show page 1 early. Steps
+whose library is missing are skipped and the report says which level the
+output actually got.
+"""
+
+import logging
+import re
+import shutil
+import subprocess
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+log = logging.getLogger("bcif.optimize")
+
+# Optimization levels, cheapest first; each adds one step to the one before.
+# On the shipped template: none 430 KB, fast 275 KB (the repeated appearance
+# streams are deduped, and the smaller write pays for itself), standard
+# 261 KB, max 198 KB. "fast" is the API default.
+OPTIMIZE_LEVELS: Dict[str, Dict[str, Any]] = {
+    "none": {"dedupe": False, "compress_streams": False, "object_streams": False},
+    "fast": {"dedupe": True, "compress_streams": False, "object_streams": False},
+    "standard": {"dedupe": True, "compress_streams": True, "object_streams": False},
+    "max": {"dedupe": True, "compress_streams": True, "object_streams": True},
+}
+
+DEFAULT_OPTIMIZE_LEVEL = "fast"
+
+_warned = set()
+
+def resolve_level(level: str) -> str:
+    """Normalize a requested level name, falling back to the default"""
+    if not level:
+        return DEFAULT_OPTIMIZE_LEVEL
+    level = str(level).strip().lower()
+    if level not in OPTIMIZE_LEVELS:
+        raise ValueError(f"Unknown optimize level '{level}' (expected one of: {', '.join(OPTIMIZE_LEVELS)})")
+    return level
+
+def optimize_writer(writer, level: str) -> Dict[str, Any]:
+    """
+    Apply the in-memory steps of an optimization level to a PdfWriter before
+    it is written. Returns the report that optimize_file completes.
+    """
+    level = resolve_level(level)
+    report = {"level": level, "applied": level, "steps": [], "missing": []}
+    if OPTIMIZE_LEVELS[level]["dedupe"]:
+        # pypdf only; PyPDF2 3.x writers cannot dedupe
+        if hasattr(writer, "compress_identical_objects"):
+            writer.compress_identical_objects()
+            report["steps"].append("dedupe")
+        else:
+            _missing(report, "dedupe", "pypdf")
+    return report
+
+def optimize_file(path: Path, level: str, linearize: bool = False,
+                  report: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Apply the post-write steps of an optimization level (and optional
+    linearization) to a written PDF. Fills in report["applied"]: the highest
+    level, up to the requested one, whose every step ran.
+    """
+    level = resolve_level(level)
+    spec = OPTIMIZE_LEVELS[level]
+    report = report if report is not None else {"level": level, "applied": level, "steps": [], "missing": []}
+    rewrite = [step for step in ("compress_streams", "object_streams") if spec[step]]
+    if rewrite or linearize:
+        if rewrite_with_qpdf(Path(path), object_streams=spec["object_streams"], linearize=linearize):
+            # pikepdf and qpdf compress uncompressed streams on every rewrite
+            report["steps"] += ["compress_streams"] + (["object_streams"] if spec["object_streams"] else [])
+            if linearize:
+                report["steps"].append("linearize")
+        else:
+            for step in rewrite + (["linearize"] if linearize else []):
+                _missing(report, step, "pikepdf or qpdf")
+    done = set(report["steps"])
+    report["applied"] = "none"
+    for name, steps in OPTIMIZE_LEVELS.items():
+        if all(step in done for step, on in steps.items() if on):
+            report["applied"] = name
+        if name == level:
+            break
+    return report
+
+def _missing(report: Dict[str, Any], step: str, needs: str) -> None:
+    report["missing"].append(step)
+    if step not in _warned:
+        _warned.add(step)
+        log.warning("Optimize step %s skipped: needs %s; output gets a lower level than requested", step, needs)
+
+def rewrite_with_qpdf(path: Path, object_streams: bool = False, linearize: bool = False) -> bool:
+    """
+    Rewrite a PDF in place with qpdf, compressing streams left uncompressed,
+    plus what pypdf cannot produce: compressed object streams and
+    linearization. Uses pikepdf when installed, then the qpdf command line
+    tool; without either the file is left unchanged and this returns False.
+    """
+    path = Path(path)
+    tmp_path = path.with_suffix(path.suffix + ".qpdf")
+    try:
+        import pikepdf
+    except ImportError:
+        pikepdf = None
+
+    if pikepdf is not None:
+        mode = pikepdf.ObjectStreamMode.generate if object_streams else pikepdf.ObjectStreamMode.preserve
+        try:
+            with pikepdf.open(str(path)) as pdf:
+                pdf.save(str(tmp_path), object_stream_mode=mode, compress_streams=True, linearize=linearize)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    elif shutil.which("qpdf"):
+        cmd = ["qpdf", "--compress-streams=y"]
+        if object_streams:
+            cmd.append("--object-streams=generate")
+        if linearize:
+            cmd.append("--linearize")
+        cmd += [str(path), str(tmp_path)]
+        # qpdf exits 3 when it succeeded with warnings
+        if subprocess.run(cmd, capture_output=True).returncode not in (0, 3):
+            tmp_path.unlink(missing_ok=True)
+            log.warning("qpdf could not rewrite %s", path.name)
+            return False
+    else:
+        return False
+
+    tmp_path.replace(path)
+    return True
+
+_LINEARIZATION_DICT = re.compile(rb"(\d+)\s+0\s+obj\s*<<(.*?/Linearized.*?)>>", re.DOTALL)
+_LIN_INT = r"/%s\s+(\d+)"
+
+def check_linearized(path: Path) -> Dict[str, Any]:
+    """
+    Structural check of a linearized PDF: the linearization dictionary must be
+    the first object, its /L must match the file length and its hint stream,
+    first-page end and main xref offsets must point inside the file.
+    """
+    path = Path(path)
+    size = path.stat().st_size
+    with open(path, "rb") as f:
+        head = f.read(1024)
+        problems: List[str] = []
+
+        m = _LINEARIZATION_DICT.search(head)
+        if not m or re.search(rb"\d+\s+0\s+obj", head[:m.start()]):
+            return {"linearized": False, "problems": ["Linearization dictionary is not the first object in the file"]}
+        lin = m.group(2).decode("latin-1")
+
+        def int_key(key):
+            km = re.search(_LIN_INT % key, lin)
+            return int(km.group(1)) if km else None
+
+        length, first_end, main_xref, pages = int_key("L"), int_key("E"), int_key("T"), int_key("N")
+        hint = re.search(r"/H\s*\[\s*(\d+)\s+(\d+)", lin)
+
+        if length != size:
+            problems.append(f"/L is {length} but file is {size} bytes (file was modified after linearization)")
+        if pages is None or pages < 1:
+            problems.append("/N page count missing")
+        if first_end is None or first_end > size:
+            problems.append("/E first-page end offset missing or past end of file")
+        if hint is None:
+            problems.append("/H hint stream offsets missing")
+        else:
+            f.seek(int(hint.group(1)))
+            if not re.match(rb"\s*\d+\s+0\s+obj", f.read(32)):
+                problems.append("/H does not point at the hint stream object")
+        if main_xref is None or main_xref >= size:
+            problems.append("/T main xref offset missing or past end of file")
+        else:
+            # /T points just before the first entry of the main xref table
+            # (or at the main xref stream object), so inspect the bytes around it
+            f.seek(max(0, main_xref - 32))
+            window = f.read(64)
+            if b"xref" not in window and not re.search(rb"\d+\s+0\s+obj", window):
+                problems.append("/T does not point at a cross-reference section")
+
+    return {"linearized": not problems, "problems": problems, "bytes": size, "first_page_end": first_end}
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+BCIF Route Partitioning
+Splits a week of claims between several adjusters and their working days,
+then plans every day's route. Stops go to adjusters by capacitated k-medoids
+seeded at the home bases (cost: miles to the cluster's medoid plus miles
+from home), each adjuster's share is split into days the same way, and each
+day is ordered by bcif_routing from home and back. Day routes are
+independent, so large plans solve them in a spawn process pool.
+"""
+
+import logging
+import os
+import threading
+import time
+from math import ceil
+from typing import Dict, Any, List, Optional, Sequence
+
+import numpy as np
+
+from bcif_routing import CIRCUITY, SPEED_MPH, TIME_LIMIT, coordinates, haversine_cross, optimize_route, priority_tiers
+
+log = logging.getLogger('bcif.partition')
+
+DAYS = int(os.environ.get('BCIF_PARTITION_DAYS', 5))
+DAY_CAPACITY = int(os.environ.get('BCIF_PARTITION_DAY_CAPACITY', 8))
+# Most stops one adjuster takes, relative to an even split by capacity
+BALANCE = float(os.environ.get('BCIF_PARTITION_BALANCE', 1.2))
+MAX_STOPS = int(os.environ.get('BCIF_PARTITION_MAX_STOPS', 5000))
+MAX_ADJUSTERS = int(os.environ.get('BCIF_PARTITION_MAX_ADJUSTERS', 100))
+WORKERS = int(os.environ.get('BCIF_PARTITION_WORKERS', os.cpu_count() or 1))
+# Smaller plans route their days in the calling thread; pool round trips would cost more than they save
+PARALLEL_MIN_STOPS = int(os.environ.get('BCIF_PARTITION_PARALLEL_MIN_STOPS', 300))
+ITERATIONS = 10
+MEDOID_CANDIDATES = 256
+
+def capacitated_assign(cost: np.ndarray, capacity: Sequence[int], tiers: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cluster (column) for each point (row) of an n x k cost matrix, with at
+    most capacity[c] points in cluster c. Higher-priority tiers choose first,
+    then the points that lose most by missing their cheapest cluster.
+    -1 where every cluster is already full.
+    """
+    n, k = cost.shape
+    labels = np.full(n, -1, dtype=int)
+    if not n or not k:
+        return labels
+    prefs = np.argsort(cost, axis=1)
+    ranked = np.take_along_axis(cost, prefs[:, :2], axis=1)
+    regret = ranked[:, 1] - ranked[:, 0] if k > 1 else np.zeros(n)
+    tiers = np.zeros(n, dtype=int) if tiers is None else tiers
+    room = np.asarray(capacity, dtype=int).copy()
+    left = int(room.sum())
+    for i in np.lexsort((-regret, tiers)):
+        if not left:
+            break
+        for c in prefs[i]:
+            if room[c] > 0:
+                labels[i] = c
+                room[c] -= 1
+                left -= 1
+                break
+    return labels
+
+def k_medoids(lat: np.ndarray, lng: np.ndarray, seed_lat: Sequence[float], seed_lng: Sequence[float],
+              capacity: Sequence[int], tiers: Optional[np.ndarray] = None, anchor: Optional[np.ndarray] = None,
+              iterations: int = ITERATIONS):
+    """
+    Capacitated k-medoids starting from the seeds. A point's cost in a cluster
+    is its miles to the cluster's medoid, plus anchor[point, cluster] if given.
+    Returns (labels, medoid latitudes, medoid longitudes, iterations run).
+    """
+    mlat, mlng = np.array(seed_lat, dtype=float), np.array(seed_lng, dtype=float)
+    labels = None
+    iteration = 0
+    for iteration in range(1, iterations + 1):
+        cost = haversine_cross(lat, lng, mlat, mlng)
+        if anchor is not None:
+            cost += anchor
+        assigned = capacitated_assign(cost, capacity, tiers)
+        if labels is not None and np.array_equal(assigned, labels):
+            break
+        labels = assigned
+        for c in range(len(mlat)):
+            members = np.flatnonzero(labels == c)
+            if len(members):
+                mlat[c], mlng[c] = _medoid(lat[members], lng[members])
+    return labels, mlat, mlng, iteration
+
+def partition_routes(adjusters: List[Dict[str, Any]], stops: List[Dict[str, Any]], days: int = DAYS,
+                     day_capacity: int = DAY_CAPACITY, priority_mode: str = 'strict', return_to_start: bool = True,
+                     circuity: float = CIRCUITY, speed_mph: float = SPEED_MPH, time_limit: float = TIME_LIMIT,
+                     distance_cache=None) -> Dict[str, Any]:
+    """
+    Day plans for every adjuster. Adjusters are objects with the lat and lng
+    of their home base and optional days and day_capacity (stops per day)
+    overriding the defaults; stops are as for optimize_route. Every other key
+    is passed back untouched. Stops beyond the adjusters' total capacity come
+    back unassigned, lowest priority first.
+    """
+    if not adjusters:
+        raise ValueError('At least one adjuster is required')
+    if len(adjusters) > MAX_ADJUSTERS:
+        raise ValueError(f'At most {MAX_ADJUSTERS} adjusters per plan')
+    if not stops:
+        raise ValueError('At least one stop is required')
+    if len(stops) > MAX_STOPS:
+        raise ValueError(f'At most {MAX_STOPS} stops per plan')
+    homes = [coordinates(adjuster, f'adjuster {a}') for a, adjuster in enumerate(adjusters)]
+    points = np.array([coordinates(stop, f'stop {i}') for i, stop in enumerate(stops)])
+    tiers = priority_tiers([stop.get('priority') for stop in stops], priority_mode)
+    day_counts = np.array([_count(adjuster.get('days', days), f'adjuster {a} days', 14)
+                           for a, adjuster in enumerate(adjusters)])
+    capacities = np.array([_count(adjuster.get('day_capacity', day_capacity), f'adjuster {a} day_capacity', 100)
+                           for a, adjuster in enumerate(adjusters)])
+
+    started = time.perf_counter()
+    lat, lng = points[:, 0], points[:, 1]
+    home_lat, home_lng = zip(*homes)
+    # Each adjuster takes a share in proportion to their capacity, with BALANCE slack for geography
+    weekly = day_counts * capacities
+    share = np.minimum(weekly, np.ceil(len(stops) * weekly / max(int(weekly.sum()), 1) * BALANCE)).astype(int)
+    owner, _, _, iterations = k_medoids(lat, lng, home_lat, home_lng, share, tiers,
+                                        anchor=haversine_cross(lat, lng, home_lat, home_lng))
+
+    jobs = []
+    for a in range(len(adjusters)):
+        members = np.flatnonzero(owner == a)
+        if not len(members):
+            continue
+        k = ceil(len(members) / capacities[a])
+        seed_lat, seed_lng = _spread(lat[members], lng[members], homes[a], k)
+        labels, _, _, _ = k_medoids(lat[members], lng[members], seed_lat, seed_lng, [capacities[a]] * k,
+                                    tiers[members])
+        # Days with the most pressing stops come first in the week
+        groups = [members[labels == d] for d in range(k)]
+        groups.sort(key=lambda group: (tiers[group].min(), tiers[group].mean()))
+        for day, group in enumerate(groups, 1):
+            jobs.append((a, day, [int(i) for i in group]))
+    cluster_ms = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    options = {'return_to_start': return_to_start, 'priority_mode': priority_mode, 'circuity': circuity,
+               'speed_mph': speed_mph, 'time_limit': time_limit}
+    tasks = [({'lat': homes[a][0], 'lng': homes[a][1]}, [dict(stops[i], stop=i) for i in group])
+             for a, _, group in jobs]
+    parallel = WORKERS > 1 and len(tasks) > 1 and len(stops) >= PARALLEL_MIN_STOPS
+    routes = _solve_parallel(tasks, options, distance_cache) if parallel else None
+    if routes is None:
+        parallel = False
+        routes = _solve_batch(tasks, options, distance_cache)
+    route_ms = (time.perf_counter() - started) * 1000
+
+    plans = [dict(adjuster, adjuster=a, days=[], total_distance_miles=0.0, total_duration_minutes=0.0)
+             for a, adjuster in enumerate(adjusters)]
+    cached = 0
+    for (a, day, group), route in zip(jobs, routes):
+        legs = [dict(leg, **{end: group[leg[end]] for end in ('from', 'to') if leg[end] != 'start'})
+                for leg in route['legs']]
+        plans[a]['days'].append({
+            'day': day,
+            'stops': route['stops'],
+            'legs': legs,
+            'total_distance_miles': route['total_distance_miles'],
+            'total_duration_minutes': route['total_duration_minutes'],
+        })
+        plans[a]['total_distance_miles'] += route['total_distance_miles']
+        plans[a]['total_duration_minutes'] += route['total_duration_minutes']
+        cached += route['cached_pairs']
+    for plan in plans:
+        plan['stop_count'] = sum(len(day['stops']) for day in plan['days'])
+        plan['total_distance_miles'] = round(plan['total_distance_miles'], 1)
+        plan['total_duration_minutes'] = round(plan['total_duration_minutes'], 1)
+
+    unassigned = [{'stop': int(i), 'reason': f'all adjusters are fully booked ({int(weekly.sum())} stops of capacity)'}
+                  for i in np.flatnonzero(owner < 0)]
+    return {
+        'plans': plans,
+        'unassigned': unassigned,
+        'totals': {
+            'assigned': len(stops) - len(unassigned),
+            'days': len(jobs),
+            'distance_miles': round(sum(plan['total_distance_miles'] for plan in plans), 1),
+            'duration_minutes': round(sum(plan['total_duration_minutes'] for plan in plans), 1),
+        },
+        'cached_pairs': cached,
+        'solver': {
+            'cluster_iterations': iterations,
+            'cluster_ms': round(cluster_ms, 2),
+            'route_ms': round(route_ms, 2),
+            'workers': WORKERS if parallel else 1,
+        },
+    }
+
+def _count(value: Any, label: str, limit: int) -> int:
+    try:
+        count = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{label} must be a whole number') from None
+    if not 1 <= count <= limit:
+        raise ValueError(f'{label} must be between 1 and {limit}')
+    return count
+
+def _medoid(lat: np.ndarray, lng: np.ndarray):
+    """Member with the least total miles to the others, among those nearest the mean (bounds the matrix size)"""
+    candidates = np.arange(len(lat))
+    if len(lat) > MEDOID_CANDIDATES:
+        to_mean = haversine_cross(lat, lng, [lat.mean()], [lng.mean()])[:, 0]
+        candidates = np.argpartition(to_mean, MEDOID_CANDIDATES)[:MEDOID_CANDIDATES]
+    best = candidates[int(np.argmin(haversine_cross(lat[candidates], lng[candidates], lat, lng).sum(axis=1)))]
+    return lat[best], lng[best]
+
+def _spread(lat: np.ndarray, lng: np.ndarray, home, k: int):
+    """k far-apart seed points: farthest-first traversal starting from home"""
+    nearest = haversine_cross(lat, lng, [home[0]], [home[1]])[:, 0]
+    seeds = []
+    for _ in range(k):
+        far = int(np.argmax(nearest))
+        seeds.append(far)
+        nearest = np.minimum(nearest, haversine_cross(lat, lng, lat[far:far + 1], lng[far:far + 1])[:, 0])
+    return lat[seeds], lng[seeds]
+
+# ---------- Day routes ----------
+
+_pool = None
+_pool_lock = threading.Lock()
+_worker_caches: Dict[str, Any] = {}
+
+def _solve_batch(tasks, options: Dict[str, Any], distance_cache) -> List[Dict[str, Any]]:
+    return [optimize_route(home, stops, distance_cache=distance_cache, **options) for home, stops in tasks]
+
+def _solve_in_worker(tasks, options: Dict[str, Any], cache_path: Optional[str]) -> List[Dict[str, Any]]:
+    """Pool task: the cache object holds a lock, so each process opens its own on the same file"""
+    distance_cache = None
+    if cache_path:
+        from bcif_distance_cache import DistanceCache
+        distance_cache = _worker_caches.get(cache_path)
+        if distance_cache is None:
+            distance_cache = _worker_caches[cache_path] = DistanceCache(cache_path)
+    return _solve_batch(tasks, options, distance_cache)
+
+def _executor():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Imported here: requests that never reach PARALLEL_MIN_STOPS don't pay for it
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # spawn: forking a threaded server process can deadlock the child
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _solve_parallel(tasks, options: Dict[str, Any], distance_cache) -> Optional[List[Dict[str, Any]]]:
+    """Routes in WORKERS interleaved batches (one pickle round trip each); None if the pool is broken"""
+    global _pool
+    from concurrent.futures.process import BrokenProcessPool
+    cache_path = str(distance_cache.path) if distance_cache else None
+    batches = [tasks[w::WORKERS] for w in range(min(WORKERS, len(tasks)))]
+    try:
+        pool = _executor()
+        futures = [pool.submit(_solve_in_worker, batch, options, cache_path) for batch in batches]
+        solved = [future.result() for future in futures]
+    except BrokenProcessPool:
+        # A worker process died (e.g. OOM kill); replace the pool next time and route in this thread
+        log.warning('Partition process pool broken, routing in the request thread')
+        with _pool_lock:
+            _pool = None
+        return None
+    routes: List[Optional[Dict[str, Any]]] = [None] * len(tasks)
+    for w, batch in enumerate(solved):
+        routes[w::WORKERS] = batch
+    return routes
+
+def shutdown() -> None:
+    """Stop the route worker processes (they start again on the next large plan)"""
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+BCIF Request Profiling
+Opt-in profiling of single requests in production. A caller holding
+BCIF_PROFILE_TOKEN sends X-BCIF-Profile-Token plus X-BCIF-Profile (or
+?profile=) set to "cprofile" (deterministic) or "sample" (stack sampling of
+the request thread only). The top functions by cumulative time are saved
+under a profile id for download; unflagged requests pay one header lookup.
+"""
+
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Any, Optional, Callable, Tuple, List
+
+DEFAULT_TOKEN = os.environ.get('BCIF_PROFILE_TOKEN', '')
+DEFAULT_TOP_N = int(os.environ.get('BCIF_PROFILE_TOP', 30))
+DEFAULT_SAMPLE_INTERVAL = float(os.environ.get('BCIF_PROFILE_SAMPLE_MS', 5)) / 1000
+
+MODES = ('cprofile', 'sample')
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread; other threads are never interrupted"""
+
+    def __init__(self, thread_id: int, interval: float = DEFAULT_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.cumulative: Counter = Counter()
+        self.own: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, name='bcif-profile-sampler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.own[_frame_key(frame)] += 1
+            seen = set()
+            while frame is not None:
+                key = _frame_key(frame)
+                if key not in seen:  # recursion counts once per sample
+                    seen.add(key)
+                    self.cumulative[key] += 1
+                frame = frame.f_back
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        per_sample_ms = self.interval * 1000
+        return [{
+            'function': key,
+            'samples': count,
+            'cumulative_ms': round(count * per_sample_ms, 1),
+            'own_ms': round(self.own[key] * per_sample_ms, 1),
+            'cumulative_fraction': round(count / self.samples, 4),
+        } for key, count in self.cumulative.most_common(limit)]
+
+def _frame_key(frame) -> str:
+    code = frame.f_code
+    return f'{_short_path(code.co_filename)}:{code.co_firstlineno}({code.co_name})'
+
+def _short_path(filename: str) -> str:
+    parts = Path(filename).parts
+    return '/'.join(parts[-2:]) if len(parts) > 1 else filename
+
+class RequestProfiler:
+    def __init__(self, storage, token: str = DEFAULT_TOKEN, top_n: int = DEFAULT_TOP_N):
+        self.storage = storage
+        self.token = token
+        self.top_n = top_n
+        # One profile at a time per process: the profilers are process-wide resources
+        self._busy = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.token)
+
+    def authorized(self, headers) -> bool:
+        if not self.enabled:
+            return False
+        supplied = headers.get('X-BCIF-Profile-Token', '')
+        return hmac.compare_digest(supplied.encode(), self.token.encode())
+
+    def requested_mode(self, headers, args) -> Optional[str]:
+        """The profiling mode asked for by an authorised caller, else None"""
+        mode = (headers.get('X-BCIF-Profile') or args.get('profile') or '').strip().lower()
+        if not mode or not self.authorized(headers):
+            return None
+        return mode if mode in MODES else 'cprofile'
+
+    def run(self, mode: str, func: Callable, *args, **kwargs) -> Tuple[Any, Optional[str]]:
+        """Call func under the profiler. Returns (result, profile_id); profile_id is None when busy."""
+        if not self._busy.acquire(blocking=False):
+            return func(*args, **kwargs), None
+        try:
+            started = time.perf_counter()
+            if mode == 'sample':
+                with StackSampler(threading.get_ident()) as sampler:
+                    result = func(*args, **kwargs)
+                top, raw = sampler.top(self.top_n), None
+                extra = {'samples': sampler.samples, 'interval_ms': sampler.interval * 1000}
+            else:
+                profiler = cProfile.Profile()
+                result = profiler.runcall(func, *args, **kwargs)
+                top, raw = self._cprofile_top(profiler), profiler
+                extra = {}
+            elapsed = time.perf_counter() - started
+        finally:
+            self._busy.release()
+        profile_id = self._save(mode, elapsed, top, raw, extra)
+        return result, profile_id
+
+    def _cprofile_top(self, profiler: cProfile.Profile) -> List[Dict[str, Any]]:
+        stats = pstats.Stats(profiler, stream=io.StringIO())
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({
+                'function': f'{_short_path(filename)}:{line}({name})',
+                'calls': nc,
+                'primitive_calls': cc,
+                'cumulative_ms': round(ct * 1000, 3),
+                'own_ms': round(tt * 1000, 3),
+            })
+        rows.sort(key=lambda r: r['cumulative_ms'], reverse=True)
+        return rows[:self.top_n]
+
+    def _save(self, mode: str, elapsed: float, top: List[Dict[str, Any]], raw, extra: Dict[str, Any]) -> str:
+        profile_id, json_path = self.storage.new_path('profile', '.json')
+        summary = dict({
+            'profile_id': profile_id,
+            'mode': mode,
+            'created_at': time.time(),
+            'wall_ms': round(elapsed * 1000, 3),
+            'pid': os.getpid(),
+            'top': top,
+        }, **extra)
+        if raw is not None:
+            pstats_path = self.storage.path_for('profile', profile_id, '.pstats')
+            raw.dump_stats(str(pstats_path))
+            self.storage.register(pstats_path)
+            summary['pstats_url'] = f'/profiles/{profile_id}?format=pstats'
+        json_path.write_text(json.dumps(summary, indent=2))
+        self.storage.register(json_path)
+        return profile_id
+
+    def load(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        path = self.storage.path_for('profile', profile_id, '.json')
+        if not path.exists():
+            return None
+        self.storage.touch(path)
+        return json.loads(path.read_text())
+
+    def pstats_path(self, profile_id: str) -> Optional[Path]:
+        path = self.storage.path_for('profile', profile_id, '.pstats')
+        return path if path.exists() else None
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+BCIF Progress
+Progress of a request (by a progress id the server issues) or job (by job
+id): stage transitions and page counts, kept as one small JSON file per id so the
+Server-Sent Events stream can be served by any worker while the work runs in
+another worker or a pool process. Each stage transition writes the file
+(a handful per request); page updates only change memory and are written
+at most every BCIF_PROGRESS_INTERVAL seconds, so a 100-page estimate costs
+about as many writes as a 2-page one.
+"""
+
+import json
+import os
+import re
+import time
+from pathlib import Path
+from typing import Dict, Any, Iterator, Optional
+
+MIN_WRITE_INTERVAL = float(os.environ.get('BCIF_PROGRESS_INTERVAL', 0.25))
+STREAM_SECONDS = float(os.environ.get('BCIF_PROGRESS_STREAM_SECONDS', 300))
+RECORD_MAX_AGE = 3600.0
+# Ids reserved with POST /progress must be claimed within this time, and only
+# so many may be outstanding at once (across workers: they live on disk)
+RESERVATION_SECONDS = float(os.environ.get('BCIF_PROGRESS_RESERVATION_SECONDS', 120))
+MAX_RESERVATIONS = int(os.environ.get('BCIF_PROGRESS_MAX_RESERVATIONS', 1000))
+TERMINAL_STAGES = ('done', 'failed')
+
+VALID_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+class ProgressTracker:
+    """Written by the pipeline; cheap enough to call per page"""
+
+    def __init__(self, store: 'ProgressStore', progress_id: str, state: Optional[Dict[str, Any]] = None):
+        self.store = store
+        self.progress_id = progress_id
+        self.state: Dict[str, Any] = state or {'id': progress_id, 'stage': None, 'stages': [], 'seq': 0}
+        self._written_at = 0.0
+
+    def stage(self, name: str, **fields) -> None:
+        """Enter a stage (uploaded, extracting, mapping, filling, done, failed, ...)"""
+        now = time.time()
+        self.state['stage'] = name
+        self.state['stages'].append({'stage': name, 'at': round(now, 3)})
+        # Page counts and extra fields belong to the stage they were reported in
+        for key in ['page', 'pages'] + self.state.pop('fields', []):
+            self.state.pop(key, None)
+        self.state.update(fields)
+        if fields:
+            self.state['fields'] = sorted(fields)
+        self._changed(now, force=True)
+
+    def pages(self, page: int, pages: int) -> None:
+        """Page k of N finished in the current stage"""
+        self.state['page'] = page
+        self.state['pages'] = pages
+        self._changed(time.time(), force=page == pages)
+
+    def done(self, **fields) -> None:
+        self.stage('done', **fields)
+
+    def failed(self, error: str) -> None:
+        self.stage('failed', error=error)
+
+    def _changed(self, now: float, force: bool = False) -> None:
+        self.state['seq'] += 1
+        if force or now - self._written_at >= self.store.min_interval:
+            self._written_at = now
+            self.state['updated_at'] = round(now, 3)
+            self.store.write(self.progress_id, self.state)
+
+class _NullTracker:
+    """Stands in when there is no usable id; every call is a no-op"""
+
+    def stage(self, name, **fields): pass
+    def pages(self, page, pages): pass
+    def done(self, **fields): pass
+    def failed(self, error): pass
+
+NULL_TRACKER = _NullTracker()
+
+def new_progress_id() -> str:
+    """Unguessable, so only the client it was issued to can follow or feed a record"""
+    return os.urandom(16).hex()
+
+class ProgressStore:
+    def __init__(self, directory: Path, min_interval: float = MIN_WRITE_INTERVAL,
+                 reservation_seconds: float = RESERVATION_SECONDS, max_reservations: int = MAX_RESERVATIONS):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.min_interval = min_interval
+        self.reservation_seconds = reservation_seconds
+        self.max_reservations = max(1, max_reservations)
+        self._last_sweep = 0.0
+
+    @staticmethod
+    def valid_id(progress_id: Optional[str]) -> bool:
+        return bool(progress_id) and VALID_ID.match(progress_id) is not None
+
+    def reserve(self) -> str:
+        """
+        Issue a progress id ahead of a request, so the client can open the
+        stream before sending the work (with X-Progress-Id). The reservation
+        is claimed by the first request that presents it, and lapses if none
+        does in time. Raises OverflowError when too many are outstanding.
+        """
+        if self._outstanding_reservations() >= self.max_reservations:
+            raise OverflowError(f'Too many progress ids reserved ({self.max_reservations} outstanding)')
+        progress_id = new_progress_id()
+        try:
+            (self.directory / f'{progress_id}.reserved').touch(exist_ok=False)
+        except OSError:
+            pass  # best effort, like the records; the id then works after the fact only
+        return progress_id
+
+    def claim(self, progress_id: Optional[str]) -> bool:
+        """Take a reserved id for one request; false if it was never issued, has lapsed or is already taken"""
+        if not self.valid_id(progress_id):
+            return False
+        path = self.directory / f'{progress_id}.reserved'
+        try:
+            live = time.time() - path.stat().st_mtime <= self.reservation_seconds
+            os.unlink(path)
+        except OSError:
+            return False
+        return live
+
+    def known(self, progress_id: str) -> bool:
+        """Recorded, or reserved and not lapsed; streams for anything else are refused"""
+        if (self.directory / f'{progress_id}.json').exists():
+            return True
+        try:
+            return time.time() - (self.directory / f'{progress_id}.reserved').stat().st_mtime <= self.reservation_seconds
+        except OSError:
+            return False
+
+    def _outstanding_reservations(self) -> int:
+        """Live reservations, removing lapsed ones on the way"""
+        now, live = time.time(), 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.reserved'):
+                    continue
+                try:
+                    if now - entry.stat().st_mtime <= self.reservation_seconds:
+                        live += 1
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+        return live
+
+    def tracker(self, progress_id: Optional[str], resume: bool = False):
+        """
+        A tracker for the id (a no-op one if the id is unusable). resume=True
+        continues the recorded state, for work that moves between processes
+        (a job is queued by the API, run in a pool process, finished by the API).
+        """
+        if not self.valid_id(progress_id):
+            return NULL_TRACKER
+        return ProgressTracker(self, progress_id, self.read(progress_id) if resume else None)
+
+    def write(self, progress_id: str, state: Dict[str, Any]) -> None:
+        path = self.directory / f'{progress_id}.json'
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        try:
+            tmp.write_text(json.dumps(state, separators=(',', ':')))
+            tmp.replace(path)
+        except OSError:
+            pass  # progress is best effort; never fail the work over it
+        if state.get('stage') in TERMINAL_STAGES:
+            self._maybe_sweep()
+
+    def read(self, progress_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((self.directory / f'{progress_id}.json').read_text())
+        except (OSError, ValueError):
+            return None
+
+    def stream(self, progress_id: str, timeout: float = STREAM_SECONDS, poll: Optional[float] = None) -> Iterator[str]:
+        """
+        Server-Sent Events for one id: a 'stage' event per transition, a
+        'progress' event whenever the state changes, ending after done/failed.
+        A comment is sent every 15 s so proxies keep the connection open.
+        """
+        poll = poll or self.min_interval
+        deadline = time.monotonic() + timeout
+        last_seq, stages_sent, last_beat = -1, 0, time.monotonic()
+        yield f'retry: {int(poll * 4000)}\n\n'
+        while time.monotonic() < deadline:
+            state = self.read(progress_id)
+            if state is not None and state['seq'] != last_seq:
+                last_seq = state['seq']
+                for transition in state['stages'][stages_sent:]:
+                    yield _event('stage', transition)
+                stages_sent = len(state['stages'])
+                yield _event('progress', {k: v for k, v in state.items() if k not in ('stages', 'fields')},
+                             event_id=state['seq'])
+                if state['stage'] in TERMINAL_STAGES:
+                    return
+            if time.monotonic() - last_beat >= 15:
+                last_beat = time.monotonic()
+                yield ': keep-alive\n\n'
+            time.sleep(poll)
+        yield _event('timeout', {'id': progress_id})
+
+    def _maybe_sweep(self) -> None:
+        """Drop progress records nobody will ask about any more"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime > RECORD_MAX_AGE:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+
+def _event(name: str, data: Dict[str, Any], event_id: Optional[int] = None) -> str:
+    head = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{head}event: {name}\ndata: {json.dumps(data, separators=(",", ":"))}\n\n'
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+"""
+BCIF Appointment Scheduling
+Fits a day of vehicle inspections into their time windows: every stop has
+an earliest and latest arrival and a service duration, and the day has a
+start and an end. Stops are placed by cheapest feasible insertion (urgent
+and tight windows first), then relocated one at a time while that shortens
+the drive. Each position keeps how far its appointment can slip without
+breaking a later one, so a candidate insertion is checked in constant time.
+Stops that cannot fit come back with the reason.
+"""
+
+import os
+import time
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+from bcif_routing import PRIORITIES, TIME_LIMIT, coordinates, travel_matrices
+
+DAY_START = os.environ.get('BCIF_SCHEDULE_DAY_START', '08:00')
+DAY_END = os.environ.get('BCIF_SCHEDULE_DAY_END', '17:00')
+SERVICE_MINUTES = float(os.environ.get('BCIF_SCHEDULE_SERVICE_MINUTES', 30))
+MAX_STOPS = int(os.environ.get('BCIF_SCHEDULE_MAX_STOPS', 200))
+EPSILON = 1e-6
+
+def parse_clock(value: Any, label: str) -> float:
+    """Minutes after midnight from "HH:MM" (or a number of minutes)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        minutes = float(value)
+    else:
+        try:
+            hours, _, mins = str(value).strip().partition(':')
+            minutes = int(hours) * 60 + int(mins or 0)
+        except ValueError:
+            raise ValueError(f'{label} must be HH:MM, got {value!r}') from None
+    if not 0 <= minutes <= 48 * 60:
+        raise ValueError(f'{label} is out of range: {value!r}')
+    return minutes
+
+def format_clock(minutes: float) -> str:
+    minutes = int(round(minutes))
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+class _Day:
+    """One route under construction: node 0 is the start, stops are 1..n"""
+
+    def __init__(self, minutes: List[List[float]], service: List[float], early: List[float], late: List[float],
+                 day_start: float, day_end: float, return_to_start: bool):
+        self.t = minutes
+        self.service = service
+        self.early = early
+        self.late = late
+        self.day_start = day_start
+        self.day_end = day_end
+        self.return_to_start = return_to_start
+        self.route: List[int] = []
+        self.refresh()
+
+    def back(self, node: int) -> float:
+        return self.t[node][0] if self.return_to_start else 0.0
+
+    def refresh(self) -> None:
+        """Recompute arrival, start and slack for every position (O(n), after each change)"""
+        t, route = self.t, self.route
+        self.arrive, self.begin = [], []
+        clock, prev = self.day_start, 0
+        for node in route:
+            arrive = clock + t[prev][node]
+            begin = max(arrive, self.early[node])
+            self.arrive.append(arrive)
+            self.begin.append(begin)
+            clock, prev = begin + self.service[node], node
+        self.finish = clock + self.back(prev)
+        # slack[p]: how late the appointment at p may start without breaking p or anything after it
+        self.slack = [0.0] * len(route)
+        after = self.day_end - self.finish
+        for p in range(len(route) - 1, -1, -1):
+            node = route[p]
+            self.slack[p] = after = min(self.late[node] - self.begin[p], after)
+            after += self.begin[p] - self.arrive[p]  # waiting at p absorbs that much delay from before it
+
+    def departure(self, p: int) -> Tuple[int, float]:
+        """(node, time) leaving the position before p"""
+        if p == 0:
+            return 0, self.day_start
+        node = self.route[p - 1]
+        return node, self.begin[p - 1] + self.service[node]
+
+    def insertion(self, node: int, p: int) -> Optional[float]:
+        """Added drive minutes for visiting node just before position p, or None if some window breaks"""
+        t = self.t
+        prev, leave = self.departure(p)
+        arrive = leave + t[prev][node]
+        if arrive > self.late[node] + EPSILON:
+            return None
+        done = max(arrive, self.early[node]) + self.service[node]
+        if p == len(self.route):
+            if done + self.back(node) > self.day_end + EPSILON:
+                return None
+            return t[prev][node] + self.back(node) - self.back(prev)
+        nxt = self.route[p]
+        shift = max(done + t[node][nxt], self.early[nxt]) - self.begin[p]
+        if shift > self.slack[p] + EPSILON:
+            return None
+        return t[prev][node] + t[node][nxt] - t[prev][nxt]
+
+    def best_insertion(self, node: int) -> Optional[Tuple[float, int]]:
+        best = None
+        for p in range(len(self.route) + 1):
+            cost = self.insertion(node, p)
+            if cost is not None and (best is None or cost < best[0] - EPSILON):
+                best = (cost, p)
+        return best
+
+    def insert(self, node: int, p: int) -> None:
+        self.route.insert(p, node)
+        self.refresh()
+
+    def remove(self, p: int) -> int:
+        node = self.route.pop(p)
+        self.refresh()
+        return node
+
+    def drive_minutes(self) -> float:
+        nodes = [0] + self.route
+        return sum(self.t[a][b] for a, b in zip(nodes, nodes[1:])) + (self.back(nodes[-1]) if self.route else 0.0)
+
+    def explain(self, node: int, label) -> str:
+        """Why node fits nowhere in the current day"""
+        alone = self.day_start + self.t[0][node]
+        if alone > self.late[node] + EPSILON:
+            return (f'unreachable in its window: driving straight from the start at {format_clock(self.day_start)} '
+                    f'arrives {format_clock(alone)}, after it closes at {format_clock(self.late[node])}')
+        done = max(alone, self.early[node]) + self.service[node] + self.back(node)
+        if done > self.day_end + EPSILON:
+            return (f'does not fit the day: even as the only stop it finishes at {format_clock(done)}, '
+                    f'after the day ends at {format_clock(self.day_end)}')
+        # Report what breaks at the position that adds the least driving
+        p = min(range(len(self.route) + 1), key=lambda q: self._detour(node, q))
+        prev, leave = self.departure(p)
+        arrive = leave + self.t[prev][node]
+        if arrive > self.late[node] + EPSILON:
+            return (f'no room in the day: the nearest free slot arrives {format_clock(arrive)}, '
+                    f'after its window closes at {format_clock(self.late[node])}')
+        clock, prev = max(arrive, self.early[node]) + self.service[node], node
+        for q in range(p, len(self.route)):
+            nxt = self.route[q]
+            arrive = clock + self.t[prev][nxt]
+            if arrive > self.late[nxt] + EPSILON:
+                return (f'no room in the day: fitting it in makes {label(nxt)} arrive {format_clock(arrive)}, '
+                        f'after its window closes at {format_clock(self.late[nxt])}')
+            clock, prev = max(arrive, self.early[nxt]) + self.service[nxt], nxt
+        return (f'no room in the day: fitting it in ends the day at {format_clock(clock + self.back(prev))}, '
+                f'after {format_clock(self.day_end)}')
+
+    def _detour(self, node: int, p: int) -> float:
+        prev = self.route[p - 1] if p else 0
+        if p == len(self.route):
+            return self.t[prev][node] + self.back(node) - self.back(prev)
+        nxt = self.route[p]
+        return self.t[prev][node] + self.t[node][nxt] - self.t[prev][nxt]
+
+def schedule_day(start: Dict[str, Any], stops: List[Dict[str, Any]], day_start: Any = DAY_START,
+                 day_end: Any = DAY_END, return_to_start: bool = False, time_limit: float = TIME_LIMIT,
+                 travel: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Schedule stops (objects with lat, lng and optional earliest, latest,
+    service_minutes and priority; other keys are passed back) into one day.
+    travel holds keyword arguments for bcif_routing.travel_matrices
+    (circuity, speed_mph, distance_cache).
+    """
+    if not stops:
+        raise ValueError('At least one stop is required')
+    if len(stops) > MAX_STOPS:
+        raise ValueError(f'At most {MAX_STOPS} stops per day')
+    opens, closes = parse_clock(day_start, 'day_start'), parse_clock(day_end, 'day_end')
+    if closes <= opens:
+        raise ValueError('day_end must be after day_start')
+    points = [coordinates(start, 'start')] + [coordinates(stop, f'stop {i}') for i, stop in enumerate(stops)]
+    service, early, late = [0.0], [opens], [closes]
+    for i, stop in enumerate(stops):
+        earliest = parse_clock(stop.get('earliest', opens), f'stop {i} earliest')
+        latest = parse_clock(stop.get('latest', closes), f'stop {i} latest')
+        minutes = float(stop.get('service_minutes', SERVICE_MINUTES))
+        if latest < earliest:
+            raise ValueError(f'stop {i} window ends ({format_clock(latest)}) before it starts ({format_clock(earliest)})')
+        if minutes < 0:
+            raise ValueError(f'stop {i} has a negative service_minutes')
+        service.append(minutes)
+        early.append(max(earliest, opens))
+        late.append(latest)
+
+    started = time.perf_counter()
+    deadline = started + time_limit
+    miles, minutes, cached = travel_matrices(points, **(travel or {}))
+    t = minutes.tolist()  # plain lists: the inner loops read single elements
+    day = _Day(t, service, early, late, opens, closes, return_to_start)
+
+    def label(node):
+        stop = stops[node - 1]
+        return f"stop {node - 1}" + (f" ({stop['address']})" if stop.get('address') else '')
+
+    # Urgent and tightly windowed stops claim their places first
+    rank = {p: r for r, p in enumerate(PRIORITIES)}
+    pending = sorted(range(1, len(stops) + 1),
+                     key=lambda k: (rank.get(stops[k - 1].get('priority'), 2), late[k], -t[0][k]))
+    unplaced = _insert_all(day, pending)
+    moves = 0
+    while time.perf_counter() < deadline:
+        moved = _relocate(day, deadline)
+        moves += moved
+        placed_more = len(unplaced) - len(unplaced := _insert_all(day, unplaced))
+        if not (moved or placed_more):
+            break
+    solve_ms = (time.perf_counter() - started) * 1000
+
+    appointments = []
+    nodes = [0] + day.route
+    for p, node in enumerate(day.route):
+        prev = nodes[p]
+        appointments.append(dict(
+            stops[node - 1],
+            stop=node - 1,
+            sequence=p + 1,
+            arrive=format_clock(day.arrive[p]),
+            start=format_clock(day.begin[p]),
+            depart=format_clock(day.begin[p] + service[node]),
+            wait_minutes=round(day.begin[p] - day.arrive[p], 1),
+            travel_minutes=round(t[prev][node], 1),
+            travel_miles=round(float(miles[prev, node]), 1),
+        ))
+    last = nodes[-1]
+    drive_miles = sum(float(miles[a, b]) for a, b in zip(nodes, nodes[1:]))
+    if return_to_start and day.route:
+        drive_miles += float(miles[last, 0])
+    return {
+        'day': {'start': format_clock(opens), 'end': format_clock(closes), 'return_to_start': return_to_start},
+        'appointments': appointments,
+        'unscheduled': [dict(stop=k - 1, reason=day.explain(k, label)) for k in sorted(unplaced)],
+        'feasible': not unplaced,
+        'totals': {
+            'scheduled': len(day.route),
+            'travel_miles': round(drive_miles, 1),
+            'travel_minutes': round(day.drive_minutes(), 1),
+            'service_minutes': round(sum(service[k] for k in day.route), 1),
+            'wait_minutes': round(sum(b - a for a, b in zip(day.arrive, day.begin)), 1),
+            'finish': format_clock(day.finish) if day.route else format_clock(opens),
+        },
+        'cached_pairs': cached,
+        'solver': {'relocations': moves, 'solve_ms': round(solve_ms, 2)},
+    }
+
+def _insert_all(day: _Day, nodes: Sequence[int]) -> List[int]:
+    """Cheapest feasible insertion of each node in turn; returns those that fit nowhere"""
+    unplaced = []
+    for node in nodes:
+        best = day.best_insertion(node)
+        if best is None:
+            unplaced.append(node)
+        else:
+            day.insert(node, best[1])
+    return unplaced
+
+def _relocate(day: _Day, deadline: float) -> int:
+    """Move single stops to cheaper feasible positions until none saves driving"""
+    moves = 0
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for p in range(len(day.route)):
+            node = day.route[p]
+            saved = _removal_saving(day, p)
+            day.remove(p)
+            best = day.best_insertion(node)
+            if best is not None and best[0] < saved - EPSILON:
+                day.insert(node, best[1])
+                moves += 1
+                improved = True
+            else:
+                day.insert(node, p)
+    return moves
+
+def _removal_saving(day: _Day, p: int) -> float:
+    """Drive minutes saved by taking the stop at p out of the route"""
+    t, route = day.t, day.route
+    prev = route[p - 1] if p else 0
+    node = route[p]
+    if p == len(route) - 1:
+        return t[prev][node] + day.back(node) - day.back(prev)
+    nxt = route[p + 1]
+    return t[prev][node] + t[node][nxt] - t[prev][nxt]
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+BCIF API Server Modes
+dev:  single-process Werkzeug server with reloader and debugger
+prod: gunicorn pre-fork server. The app, compiled mapping and template bytes
+      are loaded once in the master before workers fork, so workers share
+      those pages copy-on-write; the preloaded heap is frozen out of the
+      cyclic GC (BCIF_GC_FREEZE=0 disables) so collections in the workers
+      don't dirty it. Workers recycle after --max-requests.
+async: uvicorn serving the ASGI app in bcif_asgi.py; one event loop handles
+      the connections and --workers processes do the extraction and filling.
+"""
+
+import argparse
+import gc
+import importlib
+import os
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 5000
+
+def add_server_arguments(parser: argparse.ArgumentParser) -> None:
+    """Register the dev/prod serving options on a CLI parser"""
+    parser.add_argument('--mode', choices=['dev', 'prod', 'async'], default=os.environ.get('BCIF_SERVER_MODE', 'dev'),
+                        help='dev: Werkzeug debug server; prod: multi-worker gunicorn; async: uvicorn + process pool')
+    parser.add_argument('--host', default=DEFAULT_HOST, help='Interface to bind')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to bind')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('BCIF_WORKERS', os.cpu_count() or 1)),
+                        help='prod: worker processes; async: fill pool processes (default: CPU count)')
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('BCIF_THREADS', 4)),
+                        help='prod: request threads per worker')
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('BCIF_MAX_REQUESTS', 1000)),
+                        help='prod: recycle a worker after this many requests (0 disables)')
+    parser.add_argument('--max-requests-jitter', type=int, default=100,
+                        help='prod: random spread added to --max-requests so workers do not recycle together')
+    parser.add_argument('--timeout', type=int, default=120,
+                        help='prod: seconds before a silent worker is killed and replaced')
+
+def preload():
+    """Import the app and warm shared state in the parent process, before any fork"""
+    from bcif_memory import gc_freeze_enabled, freeze_heap, process_memory
+    freeze = gc_freeze_enabled()
+    if freeze:
+        # No collections while the heap is built, so it isn't left full of freed holes
+        gc.disable()
+
+    # Read by bcif_api at import time: no watcher, janitor or warm-up threads in the master
+    os.environ['BCIF_DEFER_BACKGROUND_TASKS'] = '1'
+    from bcif_api import app, config_manager, templates, warmup, metrics, stop_background_tasks
+    from bcif_fill_enhanced import preload_backends
+
+    metrics.reset_directory()
+    # Import PDF backends now (shared by every worker) rather than inside a request
+    backends = preload_backends()
+    importlib.import_module('bcif_routing')  # and NumPy, for the route endpoints
+    from bcif_geocode import default_index
+    geocode = default_index().describe()
+    if config_manager.current is None:
+        config_manager.load()
+    template_bytes = config_manager.preload_templates()
+    # Parse the paired templates once here so workers share them copy-on-write
+    prepared = templates.preload()
+    # Workers fork already warm (and so report ready) unless this fails; then they retry
+    warmup.run()
+    # Only the log listener (started with logging) runs here; flush and stop it before fork.
+    # Each worker starts its threads in post_fork.
+    stop_background_tasks()
+    print(f"Preloaded mapping v{config_manager.current.version}, {template_bytes:,} bytes of templates "
+          f"({prepared} parsed), {geocode['zip_count']:,} ZIP centroids and backends: {', '.join(backends)}; "
+          f"warm-up {warmup.state}")
+    if freeze:
+        # Everything alive now is shared with the workers; the GC must never write to it
+        frozen = freeze_heap()
+        gc.enable()
+        memory = process_memory()
+        print(f"Froze {frozen:,} objects out of the GC"
+              + (f"; master RSS {memory['rss'] / 2**20:.1f} MiB" if memory else ""))
+    return app
+
+def run_dev(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+    from bcif_api import app, metrics
+    from bcif_fill_enhanced import preload_backends
+    metrics.reset_directory()
+    preload_backends()
+    app.run(debug=True, host=host, port=port)
+
+def run_prod(args: argparse.Namespace) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        # gunicorn is Unix-only; keep serving, just without worker processes
+        print("WARNING: gunicorn not installed, falling back to single-process threaded server (no debug)")
+        app = preload()
+        from bcif_api import start_background_tasks
+        start_background_tasks()
+        app.run(debug=False, threaded=True, host=args.host, port=args.port)
+        return
+
+    def post_fork(server, worker):
+        from bcif_api import start_background_tasks, job_queue
+        start_background_tasks()
+        # Every worker dispatches jobs with its own pool (BCIF_JOB_WORKERS processes each);
+        # claims are compare-and-set and leases hand a recycled worker's jobs to the others
+        job_queue.start()
+
+    def worker_exit(server, worker):
+        # Keep the exiting worker's counts without leaving one file per recycled worker
+        from bcif_api import metrics
+        metrics.compact()
+
+    class BCIFApplication(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    options = {
+        'bind': f'{args.host}:{args.port}',
+        'workers': max(1, args.workers),
+        'threads': max(1, args.threads),
+        'worker_class': 'gthread',
+        'max_requests': max(0, args.max_requests),
+        'max_requests_jitter': max(0, args.max_requests_jitter) if args.max_requests else 0,
+        'timeout': args.timeout,
+        'preload_app': True,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit,
+    }
+    print(f"Starting prod server: {options['workers']} workers x {options['threads']} threads, "
+          f"recycle after {options['max_requests'] or 'unlimited'} requests")
+    BCIFApplication(preload(), options).run()
+
+def run_async(args: argparse.Namespace) -> None:
+    try:
+        import uvicorn
+    except ImportError:
+        print("ERROR: async mode needs the packages in requirements-async.txt "
+              "(pip install -r requirements-async.txt)")
+        raise SystemExit(1)
+    # Read by bcif_asgi at import time
+    os.environ.setdefault('BCIF_ASYNC_POOL_WORKERS', str(max(1, args.workers)))
+    from bcif_asgi import app
+    print(f"Starting async server: 1 event loop, {os.environ['BCIF_ASYNC_POOL_WORKERS']} fill processes")
+    uvicorn.run(app, host=args.host, port=args.port, log_level='warning', timeout_keep_alive=args.timeout)
+
+def run(args: argparse.Namespace) -> None:
+    if args.mode == 'prod':
+        run_prod(args)
+    elif args.mode == 'async':
+        run_async(args)
+    else:
+        run_dev(args.host, args.port)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+BCIF Single-Flight
+Coalesces concurrent identical extract/fill requests. The key is a hash of
+the input (upload bytes or extracted text) plus everything else that shapes
+the output. Within a process, duplicates wait on the first caller's
+computation; across worker processes, the first caller holds a lock file and
+publishes its result, which workers that were waiting on the lock reuse.
+This is not a cache: only requests that overlap in time share a result.
+Callers that wait give their admission slot back, so one hot key cannot
+fill the heavy lane with requests that are only waiting.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+from pathlib import Path
+from typing import Dict, Any, Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+log = logging.getLogger('bcif.singleflight')
+
+DEFAULT_LOCK_WAIT = float(os.environ.get('BCIF_SINGLEFLIGHT_WAIT_SECONDS', 120))
+RECORD_MAX_AGE = 600.0
+
+class _Call:
+    __slots__ = ('event', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.waiters = 0
+
+class SingleFlight:
+    def __init__(self, directory: Optional[Path] = None, lock_wait: float = DEFAULT_LOCK_WAIT):
+        self.directory = Path(directory) if directory else None
+        self.lock_wait = lock_wait
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._stats = {'leader_total': 0, 'coalesced_local_total': 0, 'coalesced_remote_total': 0, 'in_flight': 0}
+        if self.directory:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(content: bytes, *parts) -> str:
+        """Hash of the input content plus the options and versions that shape the output"""
+        h = hashlib.sha256(content)
+        for part in parts:
+            h.update(b'\0' + str(part).encode())
+        return h.hexdigest()
+
+    def do(self, key: str, fn: Callable[[], Any], reusable: Callable[[Any], bool] = lambda result: True,
+           slot=None) -> Tuple[Any, Optional[str]]:
+        """
+        Run fn once per concurrent key. Returns (result, coalesced) where coalesced
+        is None for the caller that computed, else 'local' or 'remote'. The result
+        must be JSON-serializable so other workers can reuse it; reusable() can
+        reject another worker's result (e.g. its file was already evicted).
+        slot is the caller's admission Slot (bcif_admission): a duplicate gives it
+        up while it waits, and a caller queued behind another worker's lock
+        takes it again before computing.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['in_flight'] += 1
+            else:
+                call.waiters += 1
+
+        if not leader:
+            if slot is not None:
+                slot.release()  # nothing left to do but send the leader's result
+            call.event.wait()
+            with self._lock:
+                self._stats['coalesced_local_total'] += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, 'local'
+
+        coalesced = None
+        try:
+            call.result, coalesced = self._lead(key, fn, reusable, slot)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+                self._stats['in_flight'] -= 1
+                if call.error is None:
+                    self._stats['coalesced_remote_total' if coalesced else 'leader_total'] += 1
+            call.event.set()
+        if call.waiters:
+            log.info('coalesced duplicate requests', extra={'data': {'key': key[:12], 'waiters': call.waiters}})
+        return call.result, coalesced
+
+    def _lead(self, key: str, fn: Callable[[], Any], reusable: Callable[[Any], bool], slot) -> Tuple[Any, Optional[str]]:
+        if self.directory is None or fcntl is None:
+            return fn(), None
+        started = time.time()
+        with open(self.directory / f'{key}.lock', 'a') as lock:
+            if not self._lock_file(lock, slot):
+                return fn(), None  # the other worker is stuck; don't hang with it
+            try:
+                record = self._read_record(key)
+                if record is not None and record['finished_at'] >= started and reusable(record['result']):
+                    return record['result'], 'remote'
+                result = fn()
+                self._write_record(key, result)
+                return result, None
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                self._maybe_sweep()
+
+    def _lock_file(self, lock, slot=None) -> bool:
+        if self._try_flock(lock):
+            return True
+        # Another worker is computing this key: wait without holding an admission slot
+        deadline = time.monotonic() + self.lock_wait
+        with slot.paused() if slot is not None else nullcontext():
+            while not self._try_flock(lock):
+                if time.monotonic() > deadline:
+                    return False
+                time.sleep(0.02)
+        return True
+
+    @staticmethod
+    def _try_flock(lock) -> bool:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            return False
+
+    def _read_record(self, key: str) -> Optional[Dict[str, Any]]:
+        try:
+            return json.loads((self.directory / f'{key}.json').read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_record(self, key: str, result: Any) -> None:
+        path = self.directory / f'{key}.json'
+        tmp = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp.write_text(json.dumps({'finished_at': time.time(), 'result': result}))
+        tmp.replace(path)
+
+    def _maybe_sweep(self) -> None:
+        """Drop records and lock files nobody can be waiting on any more"""
+        now = time.time()
+        if now - self._last_sweep < 60:
+            return
+        self._last_sweep = now
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    if now - entry.stat().st_mtime <= RECORD_MAX_AGE:
+                        continue
+                    if entry.name.endswith('.lock'):
+                        self._unlink_lock(entry.path)
+                    else:
+                        os.unlink(entry.path)
+                except OSError:
+                    continue
+
+    def _unlink_lock(self, path: str) -> None:
+        """Remove a lock file only while holding it: a leader's lock file keeps its old mtime all along"""
+        with open(path, 'a') as lock:
+            if self._try_flock(lock):
+                try:
+                    os.unlink(path)
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        s = self.stats()
+        return [
+            ('bcif_singleflight_computed_total', 'Extract/fill computations actually run (this process)', {}, s['leader_total']),
+            ('bcif_singleflight_coalesced_total', 'Duplicate requests served from a concurrent computation (this process)',
+             {'scope': 'local'}, s['coalesced_local_total']),
+            ('bcif_singleflight_coalesced_total', 'Duplicate requests served from a concurrent computation (this process)',
+             {'scope': 'remote'}, s['coalesced_remote_total']),
+            ('bcif_singleflight_in_flight', 'Distinct keys being computed (this process)', {}, s['in_flight']),
+        ]
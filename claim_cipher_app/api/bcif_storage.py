@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+"""
+BCIF Storage Manager
+Owns UPLOAD_FOLDER: files live in 256 sharded subdirectories (first two hex
+characters of their id) so scans stay fast with 100k+ files. A background
+janitor deletes files past their TTL and evicts least-recently-used files
+while the folder is over its byte quota. Recency is the file mtime, which
+readers bump with touch(), so every worker process sees the same LRU order.
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple
+
+log = logging.getLogger('bcif.storage')
+
+DEFAULT_QUOTA_BYTES = int(os.environ.get('BCIF_STORAGE_QUOTA_BYTES', 2 * 1024 ** 3))
+DEFAULT_JANITOR_SECONDS = float(os.environ.get('BCIF_STORAGE_JANITOR_SECONDS', 60))
+
+# Idle TTL per file kind (the part of the file name before the id)
+DEFAULT_TTLS = {
+    'upload': float(os.environ.get('BCIF_UPLOAD_TTL', 600)),
+    'filled_bcif': float(os.environ.get('BCIF_RESULT_TTL', 3600)),
+    'profile': float(os.environ.get('BCIF_PROFILE_TTL', 86400)),
+    # Extracted estimate text holds claimant PII: kept no longer than the filled results
+    'text': float(os.environ.get('BCIF_TEXT_CACHE_TTL', os.environ.get('BCIF_RESULT_TTL', 3600))),
+}
+FALLBACK_TTL = 3600.0
+
+HEX = set('0123456789abcdef')
+
+class StorageManager:
+    def __init__(self, root: Path, quota_bytes: int = DEFAULT_QUOTA_BYTES, ttls: Optional[Dict[str, float]] = None,
+                 janitor_interval: float = DEFAULT_JANITOR_SECONDS):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.quota_bytes = quota_bytes
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.janitor_interval = janitor_interval
+        self._ttl_overrides: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            'file_count': 0, 'bytes': 0, 'expired_total': 0, 'evicted_total': 0,
+            'evicted_bytes_total': 0, 'last_sweep_at': None, 'last_sweep_seconds': None,
+        }
+
+    # ---------- Paths ----------
+
+    def new_path(self, kind: str, suffix: str = '.pdf') -> Tuple[str, Path]:
+        """Allocate a new file id and its sharded path: returns (file_id, path)"""
+        file_id = os.urandom(8).hex()
+        return file_id, self.path_for(kind, file_id, suffix)
+
+    def path_for(self, kind: str, file_id: str, suffix: str = '.pdf') -> Path:
+        shard = self.root / file_id[:2]
+        shard.mkdir(exist_ok=True)
+        return shard / f'{kind}_{file_id}{suffix}'
+
+    @staticmethod
+    def valid_id(file_id: str) -> bool:
+        return len(file_id) == 16 and all(c in HEX for c in file_id)
+
+    # ---------- Bookkeeping ----------
+
+    def register(self, path: Path, ttl: Optional[float] = None) -> None:
+        """Record a newly written file; optionally give it its own TTL"""
+        try:
+            size = Path(path).stat().st_size
+        except OSError:
+            return
+        with self._lock:
+            if ttl is not None:
+                self._ttl_overrides[str(path)] = ttl
+            self._stats['file_count'] += 1
+            self._stats['bytes'] += size
+            over_quota = self._stats['bytes'] > self.quota_bytes
+        if over_quota:
+            self._wake.set()
+
+    def touch(self, path: Path) -> None:
+        """Mark a file as recently used (moves it to the back of the LRU order and renews its TTL)"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def remove(self, path: Path) -> None:
+        try:
+            size = Path(path).stat().st_size
+            Path(path).unlink()
+        except OSError:
+            return
+        with self._lock:
+            self._ttl_overrides.pop(str(path), None)
+            self._stats['file_count'] -= 1
+            self._stats['bytes'] -= size
+
+    def ttl_for(self, path: str, name: str) -> float:
+        override = self._ttl_overrides.get(path)
+        if override is not None:
+            return override
+        kind = name.rsplit('_', 1)[0]
+        return self.ttls.get(kind, FALLBACK_TTL)
+
+    # ---------- Janitor ----------
+
+    def _scan(self) -> List[Tuple[float, int, str, str]]:
+        """(mtime, size, path, name) for every managed file: shard dirs plus legacy flat files in the root"""
+        entries = []
+        with os.scandir(self.root) as top:
+            for entry in top:
+                if entry.is_file(follow_symlinks=False):
+                    dirs = ()
+                    files = [entry]
+                elif entry.is_dir(follow_symlinks=False) and len(entry.name) == 2 and set(entry.name) <= HEX:
+                    dirs = (entry.path,)
+                    files = []
+                else:
+                    continue  # e.g. the job queue's own directory
+                for d in dirs:
+                    with os.scandir(d) as shard:
+                        files.extend(e for e in shard if e.is_file(follow_symlinks=False))
+                for f in files:
+                    try:
+                        st = f.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, f.path, f.name))
+        return entries
+
+    def sweep(self) -> Dict[str, int]:
+        """Expire files past their TTL, then evict LRU files until under quota"""
+        started = time.perf_counter()
+        now = time.time()
+        expired = evicted = evicted_bytes = 0
+        live = []
+        for mtime, size, path, name in self._scan():
+            stem = name.rsplit('.', 1)[0]
+            if mtime + self.ttl_for(path, stem) < now:
+                if self._unlink(path):
+                    expired += 1
+                continue
+            live.append((mtime, size, path))
+
+        total = sum(size for _, size, _ in live)
+        if total > self.quota_bytes:
+            live.sort()  # oldest mtime first = least recently used
+            for mtime, size, path in live:
+                if total <= self.quota_bytes:
+                    break
+                if self._unlink(path):
+                    evicted += 1
+                    evicted_bytes += size
+                    total -= size
+
+        with self._lock:
+            self._stats.update({
+                'file_count': len(live) - evicted,
+                'bytes': total,
+                'last_sweep_at': now,
+                'last_sweep_seconds': round(time.perf_counter() - started, 4),
+            })
+            self._stats['expired_total'] += expired
+            self._stats['evicted_total'] += evicted
+            self._stats['evicted_bytes_total'] += evicted_bytes
+            live_paths = {p for _, _, p in live}
+            self._ttl_overrides = {p: t for p, t in self._ttl_overrides.items() if p in live_paths}
+        return {'expired': expired, 'evicted': evicted, 'evicted_bytes': evicted_bytes}
+
+    def _unlink(self, path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except OSError:
+            return False  # already removed by another worker's janitor
+
+    def start_janitor(self) -> None:
+        """Start the background janitor (idempotent; call again after fork)"""
+        if self.janitor_interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._janitor_loop, name='bcif-storage-janitor', daemon=True)
+        self._thread.start()
+
+    def stop_janitor(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _janitor_loop(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                log.exception('Storage janitor error')
+            self._wake.wait(self.janitor_interval)
+            self._wake.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'root': str(self.root),
+            'quota_bytes': self.quota_bytes,
+            'utilization': round(stats['bytes'] / self.quota_bytes, 4) if self.quota_bytes else None,
+            'ttl_seconds': dict(self.ttls),
+            'janitor_running': bool(self._thread and self._thread.is_alive()),
+        })
+        return stats
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+BCIF Template Registry
+Discovers the fillable PDF templates in forms/ (those with AcroForm fields;
+a sample estimate kept alongside is not a template) and pairs each with a
+mapping: any
+JSON in config/ whose meta.pdf_template names the template (state-specific
+variants), falling back to the default bcif-mapping.json. Parsed templates
+(PreparedTemplate: every object resolved, field inventory built) are kept in
+a bounded LRU so many templates can be served without per-request parsing.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from bcif_config import ConfigManager, CompiledMapping, BASE_DIR
+
+log = logging.getLogger('bcif.templates')
+
+DEFAULT_CONFIG_DIR = BASE_DIR / 'config'
+DEFAULT_CACHE_SIZE = int(os.environ.get('BCIF_TEMPLATE_CACHE_SIZE', 8))
+
+class TemplateRegistry:
+    def __init__(self, default_config: ConfigManager, config_dir: Path = DEFAULT_CONFIG_DIR,
+                 cache_size: int = DEFAULT_CACHE_SIZE):
+        self.default_config = default_config
+        self.forms_dir = default_config.forms_dir
+        self.config_dir = Path(config_dir)
+        self.cache_size = max(1, cache_size)
+        # template name -> ConfigManager of its paired mapping (absent: default mapping)
+        self._pairs: Dict[str, ConfigManager] = {}
+        self._managers: Dict[Path, ConfigManager] = {}
+        # template name -> (file mtime, PreparedTemplate), least recently used first
+        self._cache: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self._building: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # file name -> (mtime, has AcroForm fields)
+        self._forms: Dict[str, Tuple[float, bool]] = {}
+        self._watching = False
+        self.discover()
+
+    # ---------- Discovery ----------
+
+    def discover(self) -> None:
+        """Pair templates with mappings by scanning config/*.json for meta.pdf_template"""
+        pairs: Dict[str, ConfigManager] = {}
+        default_path = self.default_config.mapping_path.resolve()
+        for path in sorted(self.config_dir.glob('*.json')):
+            try:
+                meta = json.loads(path.read_text()).get('meta') or {}
+            except (OSError, ValueError, AttributeError):
+                continue
+            template_name = meta.get('pdf_template')
+            if not template_name:
+                continue
+            if path.resolve() == default_path:
+                manager = self.default_config
+            else:
+                manager = self._managers.get(path.resolve())
+                if manager is None:
+                    manager = ConfigManager(path, self.forms_dir, self.default_config.poll_interval)
+                    self._managers[path.resolve()] = manager
+            if template_name in pairs and pairs[template_name] is not self.default_config:
+                log.warning('Several mappings name the same template', extra={'data': {
+                    'template': template_name, 'mappings': [pairs[template_name].mapping_path.name, path.name]}})
+                continue
+            pairs[template_name] = manager
+        self._pairs = pairs
+        # Managers a rescan adds are watched like the rest; ones it drops stop polling
+        in_use = set(pairs.values())
+        for path, manager in list(self._managers.items()):
+            if manager not in in_use:
+                manager.stop_watching()
+                del self._managers[path]
+            elif self._watching:
+                manager.start_watching()
+
+    def template_names(self):
+        """Fillable templates in forms/: PDFs with AcroForm fields"""
+        return sorted(p.name for p in self.forms_dir.glob('*.pdf') if self._is_form(p))
+
+    def configured_templates(self):
+        """Templates that exist in forms/ and have a mapping naming them"""
+        return [name for name in self._pairs if self.resolve_template(name) is not None]
+
+    def resolve_template(self, template_name: str) -> Optional[Path]:
+        """The template's file in forms/, or None if there is none or it has no form fields"""
+        path = self.default_config.resolve_template(template_name)
+        return path if path is not None and self._is_form(path) else None
+
+    def _is_form(self, path: Path) -> bool:
+        """Whether the PDF has AcroForm fields, read once per file version (the reader only parses the catalog)"""
+        try:
+            mtime = path.stat().st_mtime
+        except OSError:
+            return False
+        known = self._forms.get(path.name)
+        if known is not None and known[0] == mtime:
+            return known[1]
+        from bcif_fill_enhanced import pdf_backend
+        try:
+            root = pdf_backend()[0](str(path)).trailer['/Root'].get_object()
+            acroform = root.get('/AcroForm')
+            is_form = bool(acroform and acroform.get_object().get('/Fields'))
+        except Exception as e:
+            log.warning('Could not read template', extra={'data': {'path': str(path), 'error': str(e)}})
+            is_form = False
+        self._forms[path.name] = (mtime, is_form)
+        return is_form
+
+    # ---------- Mappings ----------
+
+    def manager_for(self, template_name: str) -> ConfigManager:
+        return self._pairs.get(template_name, self.default_config)
+
+    def mapping_for(self, template_name: str) -> CompiledMapping:
+        """Active mapping snapshot for a template, loading it on first use"""
+        manager = self.manager_for(template_name)
+        if manager.current is None:
+            manager.load()
+        return manager.current
+
+    def start_watching(self) -> None:
+        """Hot-reload the paired mappings (the default mapping is watched by its owner)"""
+        self._watching = True
+        for manager in self._managers.values():
+            manager.start_watching()
+
+    def stop_watching(self) -> None:
+        self._watching = False
+        for manager in self._managers.values():
+            manager.stop_watching()
+
+    # ---------- Prepared template cache ----------
+
+    def prepared(self, template_name: str):
+        """The parsed template for fill_pdf, from the LRU or built once (concurrent callers share the build)"""
+        from bcif_fill_enhanced import PreparedTemplate
+
+        path = self.resolve_template(template_name)
+        if path is None:
+            raise FileNotFoundError(f'PDF template not found: {template_name}')
+        mtime = path.stat().st_mtime
+        with self._lock:
+            entry = self._cache.get(template_name)
+            if entry is not None and entry[0] == mtime:
+                self._cache.move_to_end(template_name)
+                self._stats['hits'] += 1
+                return entry[1]
+            build_lock = self._building.setdefault(template_name, threading.Lock())
+        with build_lock:
+            with self._lock:
+                entry = self._cache.get(template_name)
+                if entry is not None and entry[0] == mtime:
+                    self._stats['hits'] += 1
+                    return entry[1]
+            started = time.perf_counter()
+            template = PreparedTemplate(self.default_config.template_source(path))
+            log.info('Prepared template', extra={'data': dict(template.describe(), template=template_name,
+                     prepare_ms=round((time.perf_counter() - started) * 1000, 1))})
+            with self._lock:
+                self._stats['misses'] += 1
+                self._cache[template_name] = (mtime, template)
+                self._cache.move_to_end(template_name)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self._stats['evictions'] += 1
+            return template
+
+    def preload(self) -> int:
+        """Prepare the paired templates (up to the cache size) before workers fork. Returns the count."""
+        names = self.configured_templates()[:self.cache_size]
+        for template_name in names:
+            self.prepared(template_name)
+        return len(names)
+
+    # ---------- Reporting ----------
+
+    def describe(self) -> Dict[str, Any]:
+        """Every template in forms/ with its mapping and, once parsed, its field inventory"""
+        with self._lock:
+            cached = {name: entry[1] for name, entry in self._cache.items()}
+            stats = dict(self._stats, cached=len(self._cache), capacity=self.cache_size)
+        templates = []
+        for name in self.template_names():
+            manager = self.manager_for(name)
+            mapping = manager.current
+            info = {
+                'name': name,
+                'bytes': (self.forms_dir / name).stat().st_size,
+                'loaded': name in cached,
+                'mapping': {
+                    'file': manager.mapping_path.name,
+                    'paired': name in self._pairs,
+                    'name': mapping.meta.get('name') if mapping else None,
+                    'hash': mapping.sha256[:12] if mapping else None,
+                },
+            }
+            if name in cached:
+                info.update(cached[name].describe())
+            templates.append(info)
+        return {'templates': templates, 'cache': stats}
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        with self._lock:
+            s = dict(self._stats, cached=len(self._cache))
+        return [
+            ('bcif_template_cache_entries', 'Parsed templates held in the LRU (this process)', {}, s['cached']),
+            ('bcif_template_cache_capacity', 'Parsed templates the LRU can hold (this process)', {}, self.cache_size),
+            ('bcif_template_cache_total', 'Parsed template lookups by outcome (this process)', {'result': 'hit'}, s['hits']),
+            ('bcif_template_cache_total', 'Parsed template lookups by outcome (this process)', {'result': 'miss'}, s['misses']),
+            ('bcif_template_cache_evictions_total', 'Parsed templates evicted from the LRU (this process)', {}, s['evictions']),
+        ]
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+BCIF Warm-up
+Runs a synthetic extract and fill against every configured template so the
+lazy imports, regex compilation, template parsing and file cache misses are
+paid before the first real request. /health/ready reports ready only once
+this has succeeded in the process, so load balancers skip cold workers.
+"""
+
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+from bcif_fill_enhanced import apply_text_mapping, apply_post_processing, collect_checkbox_states, fill_pdf, extract_text
+from bcif_optimize import DEFAULT_OPTIMIZE_LEVEL
+
+log = logging.getLogger('bcif.warmup')
+
+RETRY_SECONDS = float(os.environ.get('BCIF_WARMUP_RETRY_SECONDS', 5))
+# BCIF_WARMUP=0 skips warm-up; the process then reports ready immediately
+ENABLED = os.environ.get('BCIF_WARMUP', '1').strip().lower() not in ('0', 'false', 'no', 'off')
+
+# Made-up estimate text that exercises every kind of mapping pattern; no customer data
+SAMPLE_ESTIMATE = """For: Warmup Insurance Company
+Claim #: 000000-WU-1 Policy #: WU-0000000
+Written By: Sample Appraiser
+Adjuster: Sample, Adjuster (555) 555-0100
+Owner: SAMPLE, OWNER Job Number: 0
+Insured: SAMPLE, INSURED Policy
+Type of Loss: Collision Date of Loss: 01/01/2025
+Loss Location: Springfield, IL
+Inspection Location: 1 Main St Springfield IL 62701 (555) 555-0101
+VEHICLE
+2025 CHEV EQUINOX LT 4D UTV 1.5L Turbo Gas FWD
+VIN: 3GNAXKEV0RL000000 Odometer: 12,345
+Automatic Transmission Power Steering Power Brakes Air Conditioning Cruise Control
+Anti-Lock Brakes Traction Control Stability Control Backup Camera Bluetooth
+"""
+
+class Warmup:
+    def __init__(self, templates, workdir: Path, retry_interval: float = RETRY_SECONDS, enabled: bool = ENABLED):
+        self.templates = templates
+        self.workdir = Path(workdir)
+        self.retry_interval = retry_interval
+        self.state = 'cold' if enabled else 'disabled'
+        self.error: Optional[str] = None
+        self.results: Dict[str, float] = {}
+        self.finished_at: Optional[float] = None
+        self._run_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self.state in ('ready', 'disabled')
+
+    def run(self) -> bool:
+        """Warm every configured template in this process; concurrent callers wait for the first"""
+        with self._run_lock:
+            if self.ready:
+                return True
+            self.state = 'warming'
+            started = time.perf_counter()
+            results = {}
+            try:
+                for template_name in self.templates.configured_templates():
+                    results[template_name] = self._warm(template_name)
+            except Exception as e:
+                self.state = 'failed'
+                self.error = f'{type(e).__name__}: {e}'
+                log.warning('Warm-up failed', extra={'data': {'error': self.error}})
+                return False
+            self.results = results
+            self.error = None
+            self.finished_at = time.time()
+            self.state = 'ready'
+            log.info('Warm-up complete', extra={'data': {
+                'templates_ms': results, 'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}})
+            return True
+
+    def _warm(self, template_name: str) -> float:
+        """One synthetic extract and fill; returns its milliseconds"""
+        started = time.perf_counter()
+        mapping = self.templates.mapping_for(template_name)
+        text_fields = apply_text_mapping(SAMPLE_ESTIMATE, mapping.text_fields)
+        apply_post_processing(text_fields, mapping.post_processing)
+        checkbox_fields = collect_checkbox_states(SAMPLE_ESTIMATE, mapping.checkbox_rules)
+        output = self.workdir / f'warmup_{os.getpid()}_{threading.get_ident()}.pdf'
+        try:
+            fill_pdf(self.templates.prepared(template_name), text_fields, checkbox_fields, output,
+                     optimize=DEFAULT_OPTIMIZE_LEVEL)
+            # Reading the filled form back warms the extraction path
+            extract_text(output)
+        finally:
+            output.unlink(missing_ok=True)
+        return round((time.perf_counter() - started) * 1000, 1)
+
+    # ---------- Background warm-up ----------
+
+    def start(self) -> None:
+        """Warm up in a thread (retrying on failure) so the process can report liveness meanwhile"""
+        if self.ready or (self._thread and self._thread.is_alive()):
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='bcif-warmup', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _loop(self) -> None:
+        while not self.run() and not self._stop.wait(self.retry_interval):
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'error': self.error,
+            'templates_ms': self.results,
+            'finished_at': self.finished_at,
+        }
+
+    def gauges(self):
+        """(name, help, labels, value) tuples for the /metrics gauge source"""
+        return [('bcif_ready', 'Whether warm-up has completed and the worker accepts traffic (this process)', {},
+                 1 if self.ready else 0)]
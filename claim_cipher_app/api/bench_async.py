@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark: sync Flask (gunicorn) vs async ASGI (uvicorn + process pool)
+Starts each server, then has many concurrent slow clients upload the
+estimate to /extract-and-fill at a throttled rate (mobile uplink) and
+reports successes, latency percentiles and time to finish all requests.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+API_DIR = Path(__file__).parent
+BASE_DIR = API_DIR.parent
+
+def multipart_body(pdf_bytes: bytes, boundary: str) -> bytes:
+    return b''.join([
+        f'--{boundary}\r\nContent-Disposition: form-data; name="pdf_file"; filename="estimate.pdf"\r\n'
+        f'Content-Type: application/pdf\r\n\r\n'.encode(),
+        pdf_bytes,
+        f'\r\n--{boundary}\r\nContent-Disposition: form-data; name="optimize"\r\n\r\nfast\r\n--{boundary}--\r\n'.encode(),
+    ])
+
+async def slow_upload(port: int, body: bytes, boundary: str, rate: int, chunk: int = 8192):
+    """POST the body at roughly `rate` bytes/second; returns (status, seconds)"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write((f'POST /extract-and-fill HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n'
+                  f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+                  f'Content-Length: {len(body)}\r\n\r\n').encode())
+    for i in range(0, len(body), chunk):
+        writer.write(body[i:i + chunk])
+        await writer.drain()
+        await asyncio.sleep(chunk / rate)
+    status_line = await reader.readline()
+    await reader.read()  # drain the PDF until the server closes
+    writer.close()
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        status = 0
+    return status, time.perf_counter() - started
+
+async def probe_health(port: int, stop: asyncio.Event, latencies: list):
+    """Measure /health latency while the uploads are running"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b'GET /health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n')
+        await reader.read()
+        writer.close()
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.25)
+
+async def run_load(port: int, clients: int, body: bytes, boundary: str, rate: int):
+    stop = asyncio.Event()
+    health = []
+    prober = asyncio.create_task(probe_health(port, stop, health))
+    started = time.perf_counter()
+    results = await asyncio.gather(*(slow_upload(port, body, boundary, rate) for _ in range(clients)),
+                                   return_exceptions=True)
+    wall = time.perf_counter() - started
+    stop.set()
+    await prober
+    return results, wall, health
+
+def wait_ready(port: int, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health/ready', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not become ready')
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))] if values else float('nan')
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare sync and async BCIF servers under slow concurrent uploads")
+    ap.add_argument("--estimate", default=str(BASE_DIR / "forms" / "JALSTON 25 CHEVY EQUINOX EST.pdf"), help="Estimate PDF to upload")
+    ap.add_argument("--clients", type=int, default=24, help="Concurrent slow clients")
+    ap.add_argument("--rate", type=int, default=64 * 1024, help="Upload bytes/second per client")
+    ap.add_argument("--workers", type=int, default=2, help="gunicorn workers (sync) / pool processes (async)")
+    ap.add_argument("--threads", type=int, default=4, help="Threads per gunicorn worker (sync)")
+    ap.add_argument("--modes", default="prod,async", help="Server modes to benchmark")
+    ap.add_argument("--port", type=int, default=5099)
+    args = ap.parse_args()
+
+    boundary = 'bcifbench' + os.urandom(8).hex()
+    body = multipart_body(Path(args.estimate).read_bytes(), boundary)
+    # Only threads/processes should limit either server, not admission control
+    env = dict(os.environ, BCIF_LOG_LEVEL='WARNING', BCIF_HEAVY_CONCURRENCY=str(args.threads),
+               BCIF_HEAVY_QUEUE='10000', BCIF_HEAVY_QUEUE_TIMEOUT='600', BCIF_ASYNC_MAX_PENDING='10000')
+
+    print(f"{args.clients} clients uploading {len(body):,} bytes at {args.rate // 1024} KiB/s each")
+    print(f"{'mode':<8}{'ok':>5}{'err':>5}{'p50 s':>8}{'p95 s':>8}{'wall s':>8}{'health p95 ms':>15}")
+    for mode in args.modes.split(','):
+        cmd = [sys.executable, 'start_api.py', '--mode', mode, '--port', str(args.port), '--workers', str(args.workers),
+               '--threads', str(args.threads), '--skip-dependency-check']
+        server = subprocess.Popen(cmd, cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            results, wall, health = asyncio.run(run_load(args.port, args.clients, body, boundary, args.rate))
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        ok = [t for r in results if not isinstance(r, BaseException) and r[0] == 200 for t in [r[1]]]
+        errors = len(results) - len(ok)
+        print(f"{mode:<8}{len(ok):>5}{errors:>5}{percentile(ok, 0.5):>8.2f}{percentile(ok, 0.95):>8.2f}{wall:>8.2f}"
+              f"{percentile(health, 0.95) * 1000:>15.1f}")
+
+if __name__ == "__main__":
+    main()
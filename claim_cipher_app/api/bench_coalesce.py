@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Coalesced-fill admission check
+A fill that finds its key locked by another worker gives up its heavy-lane
+slot while it waits. This saturates the lane in that window (one slot, no
+queue, taken by a slow unrelated fill) and checks that the waiter, unable to
+take its slot back, gets 503 with Retry-After rather than a 500. Exits 1 on
+failure.
+"""
+
+import fcntl
+import os
+import sys
+import threading
+import time
+
+# One heavy slot and no wait queue, before bcif_api builds its lanes
+os.environ.update(BCIF_HEAVY_CONCURRENCY='1', BCIF_HEAVY_QUEUE='0', BCIF_WARMUP='0')
+os.environ.setdefault('BCIF_LOG_LEVEL', 'ERROR')
+
+import bcif_api
+from bcif_optimize import resolve_level, DEFAULT_OPTIMIZE_LEVEL
+
+TEMPLATE = 'Fillable_CCC_BCIF.pdf'
+WAITER_TEXT = 'Claim Number: COALESCE-CHECK-1'
+SLOW_TEXT = 'Claim Number: COALESCE-CHECK-2'
+
+def main():
+    mapping = bcif_api.active_mapping(TEMPLATE)
+    key = bcif_api.singleflight.key(WAITER_TEXT.encode('utf-8'), TEMPLATE, mapping.sha256,
+                                    resolve_level(DEFAULT_OPTIMIZE_LEVEL), False)
+    heavy = bcif_api.admission.lanes['heavy']
+
+    # The unrelated fill holds the only slot for a while (the waiter never gets to fill)
+    fill_pdf = bcif_api.fill_pdf
+    def slow_fill(*args, **kwargs):
+        time.sleep(1.5)
+        return fill_pdf(*args, **kwargs)
+    bcif_api.fill_pdf = slow_fill
+
+    results = {}
+    def post(name, text):
+        client = bcif_api.app.test_client()
+        results[name] = client.post('/fill-bcif', json={'extracted_text': text, 'template_name': TEMPLATE})
+
+    # "Another worker" is computing the waiter's key
+    with open(bcif_api.singleflight.directory / f'{key}.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        waiter = threading.Thread(target=post, args=('waiter', WAITER_TEXT))
+        waiter.start()
+        while heavy.stats()['admitted_total'] < 1 or heavy.stats()['in_flight']:
+            time.sleep(0.01)  # admitted, then paused on the lock
+        slow = threading.Thread(target=post, args=('slow', SLOW_TEXT))
+        slow.start()
+        while heavy.stats()['in_flight'] < 1:
+            time.sleep(0.01)
+        fcntl.flock(lock, fcntl.LOCK_UN)
+    waiter.join()
+    slow.join()
+
+    got = results['waiter']
+    ok = got.status_code == 503 and got.headers.get('Retry-After') and results['slow'].status_code == 200
+    print(f"waiter: {got.status_code} Retry-After={got.headers.get('Retry-After')}  "
+          f"slow fill: {results['slow'].status_code}  {'ok' if ok else 'FAILED'}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
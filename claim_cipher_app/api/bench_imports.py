@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Import-time budget check for the BCIF modules
+Imports each module in a fresh interpreter, reports the best of several runs
+and fails (exit 1) when a module exceeds its budget or loads a heavy
+dependency that should only be imported on first use.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+API_DIR = Path(__file__).parent
+
+# module: (budget in ms, modules it must not import)
+BUDGETS = {
+    "bcif_optimize": (100, ("pypdf", "PyPDF2", "pikepdf")),
+    "bcif_fill_enhanced": (100, ("pypdf", "PyPDF2", "reportlab", "pikepdf")),
+    "bcif_config": (100, ("pypdf", "PyPDF2", "reportlab")),
+    "bcif_merge_and_fill": (100, ("PyPDF2", "pypdf")),
+    "bcif_jobs": (100, ("pypdf", "PyPDF2", "flask", "concurrent.futures.process")),
+    # Flask is the API's own dependency; PDF backends come from preload_backends()
+    # and NumPy from the first route request (or the prod preload)
+    "bcif_api": (600, ("pypdf", "PyPDF2", "reportlab", "pikepdf", "numpy")),
+    # NumPy is the one dependency; bcif_api only imports this on first use
+    "bcif_routing": (250, ("flask", "pypdf")),
+    # The route process pool is created on the first plan big enough to use it
+    "bcif_partition": (250, ("flask", "pypdf", "concurrent.futures.process")),
+    "bcif_billing": (250, ("flask", "pypdf")),
+}
+
+PROBE = """
+import sys, time
+t = time.perf_counter()
+import {module}
+elapsed = (time.perf_counter() - t) * 1000
+print(elapsed, *[m for m in {forbidden!r} if m in sys.modules])
+"""
+
+def measure(module, forbidden, runs):
+    best, leaked = None, set()
+    # bcif_api starts a warm-up thread that loads the backends on purpose; only the import itself counts
+    env = dict(os.environ, BCIF_LOG_LEVEL="ERROR", BCIF_WARMUP="0")
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, forbidden=tuple(forbidden))],
+                             cwd=API_DIR, env=env, capture_output=True, text=True, check=True).stdout.split()
+        elapsed = float(out[0])
+        best = elapsed if best is None else min(best, elapsed)
+        leaked.update(out[1:])
+    return best, sorted(leaked)
+
+def main():
+    ap = argparse.ArgumentParser(description="Check BCIF module import times against their budgets")
+    ap.add_argument("--runs", type=int, default=5, help="Fresh-interpreter imports per module (best time is used)")
+    ap.add_argument("--scale", type=float, default=1.0, help="Multiply every budget (slow CI machines)")
+    ap.add_argument("modules", nargs="*", help="Modules to check (default: all)")
+    args = ap.parse_args()
+
+    failures = 0
+    print(f"{'module':<22}{'best ms':>10}{'budget':>10}  status")
+    for module in args.modules or BUDGETS:
+        budget, forbidden = BUDGETS[module]
+        budget *= args.scale
+        best, leaked = measure(module, forbidden, args.runs)
+        status = "ok"
+        if best > budget:
+            status = "OVER BUDGET"
+        if leaked:
+            status = f"eagerly imports {', '.join(leaked)}"
+        failures += status != "ok"
+        print(f"{module:<22}{best:>10.1f}{budget:>10.0f}  {status}")
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
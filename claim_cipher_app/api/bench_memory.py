@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-worker memory of the prod (pre-fork) server
+Starts gunicorn with and without the GC freeze, sends fills so every worker
+has parsed, mapped and written PDFs, then reads each worker's USS (private),
+PSS (fair share) and RSS from /proc. Linux only.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from bcif_memory import process_memory
+
+API_DIR = Path(__file__).parent
+BASE_DIR = API_DIR.parent
+
+def wait_ready(port: int, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/health/ready', timeout=1)
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'server on port {port} did not become ready')
+
+def fill(port: int, text: str) -> int:
+    body = json.dumps({'extracted_text': text, 'optimize': 'fast'}).encode()
+    req = urllib.request.Request(f'http://127.0.0.1:{port}/fill-bcif', data=body,
+                                 headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(req, timeout=120) as resp:
+        resp.read()
+        return resp.status
+
+def worker_pids(master: int):
+    with open(f'/proc/{master}/task/{master}/children') as f:
+        return [int(pid) for pid in f.read().split()]
+
+def mib(n):
+    return n / 2**20
+
+def main():
+    ap = argparse.ArgumentParser(description="Measure per-worker USS/PSS of the prod server with and without GC freeze")
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--requests", type=int, default=48, help="Fills sent before measuring (spread over the workers)")
+    ap.add_argument("--port", type=int, default=5098)
+    args = ap.parse_args()
+
+    from bcif_fill_enhanced import extract_text
+    text = extract_text(BASE_DIR / "forms" / "JALSTON 25 CHEVY EQUINOX EST.pdf")
+
+    print(f"{args.workers} workers, {args.requests} fills")
+    print(f"{'gc freeze':<10}{'USS MiB':>10}{'PSS MiB':>10}{'RSS MiB':>10}{'total PSS MiB':>15}")
+    for freeze in ('1', '0'):
+        # Distinct texts so single-flight doesn't coalesce the warm-up fills
+        env = dict(os.environ, BCIF_LOG_LEVEL='WARNING', BCIF_GC_FREEZE=freeze, BCIF_HEAVY_QUEUE='1000',
+                   BCIF_HEAVY_QUEUE_TIMEOUT='300')
+        cmd = [sys.executable, 'start_api.py', '--mode', 'prod', '--port', str(args.port), '--workers', str(args.workers),
+               '--threads', '2', '--max-requests', '0', '--skip-dependency-check']
+        server = subprocess.Popen(cmd, cwd=API_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            wait_ready(args.port)
+            with ThreadPoolExecutor(args.workers * 2) as pool:
+                statuses = list(pool.map(lambda i: fill(args.port, f'{text}\n#{i}'), range(args.requests)))
+            if any(s != 200 for s in statuses):
+                print(f"warning: {sum(s != 200 for s in statuses)} fills failed")
+            usage = [m for m in (process_memory(pid) for pid in worker_pids(server.pid)) if m]
+            master = process_memory(server.pid)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        n = len(usage) or 1
+        total_pss = sum(m['pss'] for m in usage) + (master['pss'] if master else 0)
+        print(f"{'on' if freeze == '1' else 'off':<10}{mib(sum(m['uss'] for m in usage) / n):>10.1f}"
+              f"{mib(sum(m['pss'] for m in usage) / n):>10.1f}{mib(sum(m['rss'] for m in usage) / n):>10.1f}"
+              f"{mib(total_pss):>15.1f}")
+
+if __name__ == "__main__":
+    main()
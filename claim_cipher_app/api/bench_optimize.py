@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark for BCIF output optimization levels
+Fills the template once per level and reports output bytes and fill time
+"""
+
+import argparse
+import json
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from bcif_fill_enhanced import extract_text, apply_text_mapping, apply_post_processing, collect_checkbox_states, fill_pdf
+from bcif_optimize import OPTIMIZE_LEVELS
+
+BASE_DIR = Path(__file__).parent.parent
+
+def main():
+    ap = argparse.ArgumentParser(description="Report output size and fill time for each optimization level")
+    ap.add_argument("--template", default=str(BASE_DIR / "forms" / "Fillable_CCC_BCIF.pdf"), help="Path to fillable BCIF PDF")
+    ap.add_argument("--mapping", default=str(BASE_DIR / "config" / "bcif-mapping.json"), help="Path to mapping JSON")
+    ap.add_argument("--estimate", default="", help="Optional estimate PDF to extract field values from")
+    ap.add_argument("--repeat", type=int, default=5, help="Fills per level (median time is reported)")
+    args = ap.parse_args()
+
+    with open(args.mapping, "r") as f:
+        spec = json.load(f)
+
+    text = extract_text(Path(args.estimate)) if args.estimate else ""
+    text_fields = apply_text_mapping(text, spec.get("text_fields", {}))
+    apply_post_processing(text_fields, spec.get("post_processing", {}))
+    on_fields = collect_checkbox_states(text, spec.get("checkbox_rules", {}))
+
+    template = Path(args.template)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for level in OPTIMIZE_LEVELS:
+            output = Path(tmp) / f"bench_{level}.pdf"
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                report = fill_pdf(template, text_fields, on_fields, output, optimize=level)
+                timings.append(time.perf_counter() - start)
+            results.append((level, report["applied"], output.stat().st_size, statistics.median(timings)))
+
+    template_bytes = template.stat().st_size
+    print(f"\nTemplate: {template.name} ({template_bytes:,} bytes), {args.repeat} fills per level")
+    print(f"{'level':<10}{'applied':<10}{'bytes':>12}{'vs template':>14}{'median ms':>12}")
+    for level, applied, size, seconds in results:
+        print(f"{level:<10}{applied:<10}{size:>12,}{size / template_bytes:>13.0%}{seconds * 1000:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,31 +1,113 @@
 #!/usr/bin/env python3
 """
 Startup script for BCIF API
-Ensures dependencies are installed and starts the Flask server
+Checks installed dependencies against requirements.txt and starts the Flask server
 """
 
+import time
+LAUNCHED_AT = time.time()
+
+import argparse
+import hashlib
+import json
+import os
+import re
 import subprocess
 import sys
-import os
 from pathlib import Path
 
-def install_requirements():
-    """Install required packages"""
+from bcif_server import add_server_arguments, run
+
+CACHE_DIR = Path(os.environ.get('BCIF_CACHE_DIR', Path.home() / '.cache' / 'bcif'))
+
+# Distributions that satisfy a requirement in its place (bcif_fill_enhanced prefers pypdf over PyPDF2)
+ALTERNATIVES = {'pypdf2': ('pypdf',)}
+
+def parse_requirement(line):
+    """(name, specifier, applies) for one requirements line, or None for blanks/comments"""
     try:
-        print("Installing Python dependencies...")
-        subprocess.check_call([
-            sys.executable, "-m", "pip", "install", "-r", "requirements.txt"
-        ])
-        print("Dependencies installed successfully")
-    except subprocess.CalledProcessError as e:
-        print(f"Failed to install dependencies: {e}")
-        return False
+        from packaging.requirements import Requirement
+    except ImportError:  # checked by name only
+        Requirement = None
+    line = line.split('#', 1)[0].strip()
+    if not line or line.startswith('-'):
+        return None
+    if Requirement is not None:
+        req = Requirement(line)
+        return req.name, req.specifier, req.marker is None or req.marker.evaluate()
+    name = re.match(r'[A-Za-z0-9._-]+', line).group(0)
+    return name, None, True
+
+def missing_requirements(requirements_path):
+    """Check installed distributions via package metadata: returns (missing, version_warnings)"""
+    from importlib import metadata  # only needed when the cached result is stale
+    missing, warnings = [], []
+    for line in Path(requirements_path).read_text().splitlines():
+        parsed = parse_requirement(line)
+        if parsed is None:
+            continue
+        name, specifier, applies = parsed
+        if not applies or name in sys.stdlib_module_names:
+            continue  # e.g. gunicorn on Windows, or a stdlib module like pathlib
+        for candidate in (name,) + ALTERNATIVES.get(name.lower(), ()):
+            try:
+                version = metadata.version(candidate)
+                break
+            except metadata.PackageNotFoundError:
+                continue
+        else:
+            missing.append(line.strip())
+            continue
+        if candidate == name and specifier is not None and not specifier.contains(version, prereleases=True):
+            warnings.append(f"{name} {version} installed, requirements pin {specifier}")
+    return missing, warnings
+
+def check_requirements(requirements_path='requirements.txt', install_missing=False):
+    """
+    Verify dependencies without pip. A passing check is cached per
+    requirements hash and interpreter, so repeat launches skip it entirely.
+    """
+    digest = hashlib.sha256(Path(requirements_path).read_bytes()).hexdigest()
+    cache_key = f"{digest}:{sys.prefix}:{sys.version_info[:3]}"
+    cache_file = CACHE_DIR / 'requirements-ok.json'
+    try:
+        if json.loads(cache_file.read_text()).get('key') == cache_key:
+            print("Dependencies OK (cached)")
+            return True
+    except (OSError, ValueError):
+        pass
+    
+    missing, warnings = missing_requirements(requirements_path)
+    for warning in warnings:
+        print(f"Warning: {warning}")
+    if missing:
+        print("Missing Python dependencies:")
+        for requirement in missing:
+            print(f"   - {requirement}")
+        if not install_missing:
+            print(f"Install them with: {sys.executable} -m pip install -r {requirements_path}")
+            print("(or rerun with --install-missing)")
+            return False
+        try:
+            subprocess.check_call([sys.executable, "-m", "pip", "install", *missing])
+        except subprocess.CalledProcessError as e:
+            print(f"Failed to install dependencies: {e}")
+            return False
+        return check_requirements(requirements_path)
+    
+    print("Dependencies OK")
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps({'key': cache_key, 'checked_at': time.time()}))
+    except OSError:
+        pass  # read-only home; the check just runs again next time
     return True
 
 def check_files():
     """Check if required files exist"""
     required_files = [
-        'bcif_fill.py',
+        'bcif_api.py',
+        'bcif_fill_enhanced.py',
         'requirements.txt',
         '../config/bcif-mapping.json',
         '../forms/Fillable_CCC_BCIF.pdf'
@@ -45,10 +127,10 @@ def check_files():
     print("All required files found")
     return True
 
-def start_server():
-    """Start the Flask API server"""
+def start_server(args):
+    """Start the Flask API server in dev or prod mode"""
     try:
-        print("Starting BCIF API server on http://localhost:5000")
+        print(f"Starting BCIF API server ({args.mode} mode) on http://localhost:{args.port}")
         print("Available endpoints:")
         print("   - GET  /health - Health check")
         print("   - POST /fill-bcif - Fill BCIF form with extracted text")
@@ -56,8 +138,7 @@ def start_server():
         print("   - POST /debug-extraction - Debug extraction results")
         print("\nPress Ctrl+C to stop the server\n")
         
-        from bcif_api import app
-        app.run(debug=True, host='0.0.0.0', port=5000)
+        run(args)
         
     except KeyboardInterrupt:
         print("\nServer stopped by user")
@@ -66,6 +147,14 @@ def start_server():
 
 def main():
     """Main startup sequence"""
+    parser = argparse.ArgumentParser(description="Start the BCIF API server")
+    add_server_arguments(parser)
+    parser.add_argument('--install-missing', action='store_true',
+                        help='pip install any requirement that is not installed')
+    parser.add_argument('--skip-dependency-check', action='store_true',
+                        help='start without checking installed packages')
+    args = parser.parse_args()
+    
     print("BCIF API Startup")
     print("=" * 40)
     
@@ -77,13 +166,17 @@ def main():
         print("Startup failed: Missing required files")
         sys.exit(1)
     
-    # Install dependencies
-    if not install_requirements():
-        print("Startup failed: Could not install dependencies")
+    # Check dependencies (in-process, cached); pip only runs when asked to
+    if not args.skip_dependency_check and not check_requirements(install_missing=args.install_missing):
+        print("Startup failed: Missing dependencies")
         sys.exit(1)
     
+    # bcif_api reports the first served request relative to this launch time
+    os.environ['BCIF_LAUNCHED_AT'] = repr(LAUNCHED_AT)
+    print(f"Startup checks took {(time.time() - LAUNCHED_AT) * 1000:.0f} ms")
+    
     # Start the server
-    start_server()
+    start_server(args)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
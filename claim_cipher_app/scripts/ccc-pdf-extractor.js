@@ -6,6 +6,8 @@ class CCCPDFExtractor {
         this.extractionZones = null;
         this.professionalMapper = null;
         this.initialized = false;
+        // BCIF API that parses estimates server-side (/parse-estimate)
+        this.apiBaseUrl = window.BCIF_API_URL || 'http://localhost:5000';
         this.initPromise = this.init();
     }
 
@@ -113,6 +115,15 @@ class CCCPDFExtractor {
     async extractDataFromCCC(pdfFile) {
         console.log('🔍 Starting advanced CCC PDF extraction...');
         
+        // Prefer server-side parsing: upload the bytes, render the structured result
+        try {
+            const serverData = await this.parseOnServer(pdfFile);
+            console.log('✅ Server-side parsing completed:', serverData);
+            return this.enhanceExtractedData(serverData);
+        } catch (error) {
+            console.warn('⚠️ Server-side parsing unavailable, falling back to in-browser extraction:', error.message);
+        }
+        
         // Ensure initialization is complete
         if (!this.initialized) {
             await this.initPromise;
@@ -152,6 +163,77 @@ class CCCPDFExtractor {
         }
     }
 
+    /**
+     * Parse the estimate with the BCIF API instead of pdf.js
+     * @param {File} pdfFile - The uploaded CCC PDF file
+     * @returns {Object} - Extracted data in the same shape as the in-browser path
+     */
+    async parseOnServer(pdfFile) {
+        const form = new FormData();
+        form.append('pdf_file', pdfFile);
+        
+        const response = await fetch(`${this.apiBaseUrl}/parse-estimate`, { method: 'POST', body: form });
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            throw new Error(errorData.error || `HTTP ${response.status}`);
+        }
+        
+        const doc = await response.json();
+        if (doc.schema !== 'ccc-estimate' || doc.schema_version !== 1) {
+            throw new Error(`Unsupported estimate schema ${doc.schema} v${doc.schema_version}`);
+        }
+        return this.fromEstimateDocument(doc);
+    }
+
+    /**
+     * Flatten a /parse-estimate document into the extractor's field names
+     * @param {Object} doc - Structured estimate (schema "ccc-estimate" v1)
+     * @returns {Object} - Flat extracted data; missing fields are left out for addDefaultValues
+     */
+    fromEstimateDocument(doc) {
+        const claim = doc.claim || {};
+        const parties = doc.parties || {};
+        const vehicle = doc.vehicle || {};
+        const options = doc.options || [];
+        const str = (value) => (value === undefined || value === null ? undefined : String(value));
+        
+        const data = {
+            claimNumber: claim.claim_number,
+            policyNumber: claim.policy_number,
+            lossDate: claim.date_of_loss,
+            lossState: claim.loss_state,
+            lossZipCode: claim.loss_zip,
+            insuredFirstName: parties.insured?.first_name,
+            insuredLastName: parties.insured?.last_name,
+            ownerFirstName: parties.owner?.first_name,
+            ownerLastName: parties.owner?.last_name,
+            adjusterFirstName: parties.adjuster?.first_name,
+            adjusterLastName: parties.adjuster?.last_name,
+            adjusterContact: parties.adjuster?.phone,
+            year: str(vehicle.year),
+            make: vehicle.make,
+            model: vehicle.model,
+            trim: vehicle.trim,
+            vin: vehicle.vin,
+            odometer: str(vehicle.odometer),
+            vehicleOptions: options,
+            checkboxFields: Object.fromEntries(options.map((option) => [option, true])),
+            totals: doc.totals,
+            extractionMetadata: {
+                source: 'server',
+                schemaVersion: doc.schema_version,
+                mappingVersion: doc.mapping_version
+            }
+        };
+        
+        for (const key of Object.keys(data)) {
+            if (data[key] === undefined) {
+                delete data[key];
+            }
+        }
+        return data;
+    }
+
     /**
      * Extract PDF content with coordinate information
      * @param {ArrayBuffer} pdfBuffer - PDF file as array buffer
@@ -8,6 +8,7 @@ class MileageCypherCalculator {
     this.settings = this.initializeSettings();
     this.currentCalculation = null;
     this.calculationHistory = [];
+    this.apiBaseUrl = window.BCIF_API_URL || "http://localhost:5000";
 
     this.init();
   }
@@ -269,6 +270,30 @@ class MileageCypherCalculator {
     console.log("🧮 Auto-calculation setup complete");
   }
 
+  async calculateDistanceOffline(origin, destination) {
+    // Road-estimated miles between the ZIP/city centroids of both addresses
+    const response = await fetch(`${this.apiBaseUrl}/routes/optimize`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        start: { address: origin },
+        stops: [{ address: destination }],
+      }),
+    });
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.error || `HTTP ${response.status}`);
+    }
+
+    const route = await response.json();
+    const miles = route.legs[0].distance_miles;
+    document.getElementById("distanceMiles").value = miles;
+    console.log("🧮 Distance estimated offline:", miles, "miles");
+
+    this.performCalculation(false);
+    this.showCalculateLoading(false);
+  }
+
   debounceAutoCalculate() {
     // Clear existing timeout
     if (this.autoCalculateTimeout) {
@@ -308,16 +333,20 @@ class MileageCypherCalculator {
   async triggerAutoDistance() {
     // Check if Google Maps API is available
     const apiKey = window.MILEAGE_CYPHER_CONFIG?.GOOGLE_MAPS_API_KEY;
+    const pointA = document.getElementById("pointA").value.trim();
+    const pointB = document.getElementById("pointB").value.trim();
 
-    if (!apiKey || apiKey === "YOUR_API_KEY_HERE") {
-      console.log("🧮 Auto-distance skipped: No API key configured");
-      this.showNotification("Please enter distance manually", "info");
-      this.showCalculateLoading(false);
-      return;
-    }
-
-    if (typeof google === "undefined") {
-      console.log("🧮 Auto-distance skipped: Google Maps not loaded yet");
+    if (!apiKey || apiKey === "YOUR_API_KEY_HERE" || typeof google === "undefined") {
+      console.log("🧮 Google Maps unavailable, estimating distance offline");
+      if (pointA && pointB) {
+        try {
+          await this.calculateDistanceOffline(pointA, pointB);
+          this.updateDistanceStatus("Distance estimated offline", "📍");
+          return;
+        } catch (error) {
+          console.warn("🧮 Offline distance estimate failed:", error.message);
+        }
+      }
       this.showNotification("Please enter distance manually", "info");
       this.showCalculateLoading(false);
       return;
@@ -325,9 +354,6 @@ class MileageCypherCalculator {
 
     console.log("🧮 Triggering auto-distance calculation...");
 
-    const pointA = document.getElementById("pointA").value.trim();
-    const pointB = document.getElementById("pointB").value.trim();
-
     if (!pointA || !pointB) {
       console.log(
         "🧮 Missing addresses - Point A:",
@@ -11,6 +11,7 @@ class RouteOptimizer {
     this.geocoder = null;
     this.currentRoute = null;
     this.routeStops = [];
+    this.apiBaseUrl = window.BCIF_API_URL || 'http://localhost:5000';
     this.firmColors = {
       'State Farm': '#cc0000',
       'Allstate': '#003da5',
@@ -232,8 +233,15 @@ class RouteOptimizer {
         const prioritySelect = destDiv.querySelector(".priority-select");
         const address = input?.value.trim();
         const priority = prioritySelect?.value || "normal";
+        if (!address || address.length === 0) return null;
 
-        return address && address.length > 0 ? { address, priority } : null;
+        // Claims dropped from Cipher Dispatch carry coordinates for offline routing
+        const claim = this.routeStops.find(
+          (c) => String(c.id) === destDiv.dataset.claimId
+        );
+        return claim
+          ? { address, priority, lat: claim.lat, lng: claim.lng }
+          : { address, priority };
       })
       .filter((dest) => dest !== null);
 
@@ -347,6 +355,21 @@ class RouteOptimizer {
     // Show user notification about fallback mode
     this.showFallbackNotification();
 
+    try {
+      const serverRoute = await this.optimizeOnServer(
+        startLocation,
+        destinations,
+        settings
+      );
+      console.log("🗺️ Route optimized by the API from coordinates");
+      return serverRoute;
+    } catch (error) {
+      console.warn(
+        "⚠️ Server route optimization unavailable, using estimated legs:",
+        error.message
+      );
+    }
+
     // Use geographical optimization for smarter routing
     const sortedDestinations = this.geographicallyOptimizeRoute(
       startLocation,
@@ -376,6 +399,47 @@ class RouteOptimizer {
     return route;
   }
 
+  async optimizeOnServer(startLocation, destinations, settings) {
+    // Priority tiers as the browser applies them: strict ordering unless clustering
+    const start = { address: startLocation };
+    const response = await fetch(`${this.apiBaseUrl}/routes/optimize`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        start,
+        stops: destinations,
+        priority_mode: settings.geographicClustering ? "urgent" : "strict",
+      }),
+    });
+    if (!response.ok) {
+      const errorData = await response.json().catch(() => ({}));
+      throw new Error(errorData.error || `HTTP ${response.status}`);
+    }
+
+    const result = await response.json();
+    const label = (end) =>
+      end === "start" ? start.address : destinations[end].address;
+    const legs = result.legs.map((leg) => ({
+      origin: label(leg.from),
+      destination: label(leg.to),
+      distance: leg.distance_miles,
+      duration: Math.round(leg.duration_minutes),
+      distanceText: `${leg.distance_miles} mi`,
+      durationText: `${Math.round(leg.duration_minutes)} min`,
+      estimated: true,
+    }));
+    const sortedDestinations = result.order.map((k) => destinations[k]);
+
+    return {
+      stops: [start.address, ...sortedDestinations.map((d) => d.address)],
+      legs,
+      totalDistance: result.total_distance_miles,
+      totalDuration: Math.round(result.total_duration_minutes),
+      destinationData: sortedDestinations,
+      fallbackMode: true,
+    };
+  }
+
   showFallbackNotification() {
     const statusElement = document.getElementById("exportStatus");
     if (statusElement) {
@@ -836,9 +900,31 @@ class RouteOptimizer {
       processedRoute.totalDuration += leg.duration.value / 60;
     });
 
+    // Let offline planning reuse these road distances (best effort)
+    this.recordLegsOnServer(legs);
+
     return processedRoute;
   }
 
+  recordLegsOnServer(legs) {
+    const point = (location) => ({ lat: location.lat(), lng: location.lng() });
+    fetch(`${this.apiBaseUrl}/distances`, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({
+        source: "google",
+        legs: legs.map((leg) => ({
+          origin: point(leg.start_location),
+          destination: point(leg.end_location),
+          miles: leg.distance.value * 0.000621371,
+          minutes: leg.duration.value / 60,
+        })),
+      }),
+    }).catch((error) =>
+      console.warn("⚠️ Could not cache route legs on the server:", error.message)
+    );
+  }
+
   applySplitting(route, settings) {
     if (!settings.splitEnabled) {
       return {